@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+Skylight Shopping List - Benchmark Suite
+========================================
+
+Measures the hot paths of the Linux app offline: product parsing,
+cached record decoding, categorization, fuzzy name matching, pantry
+nutrition summaries, barcode lookups and searches against the local OFF
+stand-in from mock_servers, image downloads and barcode decoding.
+
+Every benchmark reports p50/p95/p99 latency and ops/sec. Results are
+compared against a saved baseline and the run exits non-zero when any
+benchmark regresses beyond the tolerance, or when there is no baseline
+to compare against (unless --allow-missing-baseline is given). Calls
+that take only a few microseconds are gated on ops/sec alone, since
+their per-call timings are mostly clock overhead and jitter.
+
+Usage:
+    python benchmarks/run_benchmarks.py                  # run + compare
+    python benchmarks/run_benchmarks.py --save-baseline  # record baseline
+    python benchmarks/run_benchmarks.py --only get_product --concurrency 32
+    python benchmarks/run_benchmarks.py --allow-missing-baseline  # first run
+
+Baselines are machine specific; record one on the machine (or CI runner
+class) that will be compared against it.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+from lib.metrics import percentile  # noqa: E402
+from lib.openfoodfacts_api import OFFProduct, OpenFoodFactsAPI  # noqa: E402
+from mock_servers import load_products, start_mock_server  # noqa: E402
+from lib.product_codec import ProductCache, decode_product, encode_product  # noqa: E402
+from lib.fuzzy_matcher import FuzzyMatcher  # noqa: E402
+from lib.nutrition_analytics import NutritionMatrix  # noqa: E402
+
+DEFAULT_BASELINE = BENCH_DIR / "baseline.json"
+PHOTOS_DIR = BENCH_DIR / "photos"
+
+# Below this baseline p50, latency is not compared (ops/sec still is)
+LATENCY_FLOOR_MS = 0.05
+
+
+@dataclass
+class BenchResult:
+    """Latency samples for one benchmark"""
+    name: str
+    samples: List[float] = field(default_factory=list)
+    wall_time: float = 0.0
+
+    def percentile(self, pct: float) -> float:
+        """Nearest-rank percentile in milliseconds"""
+        return percentile(self.samples, pct) * 1000
+
+    @property
+    def ops_per_sec(self) -> float:
+        return len(self.samples) / self.wall_time if self.wall_time else 0.0
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'ops': len(self.samples),
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'ops_per_sec': self.ops_per_sec,
+        }
+
+
+def time_sync(name: str, fn: Callable[[], Any], iterations: int) -> BenchResult:
+    """Time a synchronous callable per call"""
+    result = BenchResult(name)
+    clock = time.perf_counter
+    start = clock()
+    for _ in range(iterations):
+        t0 = clock()
+        fn()
+        result.samples.append(clock() - t0)
+    result.wall_time = clock() - start
+    return result
+
+
+async def time_async(
+    name: str,
+    make_call: Callable[[int], Any],
+    iterations: int,
+    concurrency: int
+) -> BenchResult:
+    """Time an async callable per call with ``concurrency`` workers"""
+    result = BenchResult(name)
+    counter = iter(range(iterations))
+    clock = time.perf_counter
+
+    async def worker():
+        for i in counter:
+            t0 = clock()
+            await make_call(i)
+            result.samples.append(clock() - t0)
+
+    start = clock()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.wall_time = clock() - start
+    return result
+
+
+# Individual benchmarks
+
+def bench_from_dict(products: List[Dict[str, Any]], iterations: int) -> BenchResult:
+    cycle = [products[i % len(products)] for i in range(iterations)]
+    it = iter(cycle)
+    return time_sync("from_dict", lambda: OFFProduct.from_dict(next(it)), iterations)
+
+
+def bench_categorize(products: List[Dict[str, Any]], iterations: int) -> BenchResult:
+    parsed = [OFFProduct.from_dict(p) for p in products]
+    it = iter([parsed[i % len(parsed)] for i in range(iterations)])
+    return time_sync("categorize", lambda: next(it).categorize(), iterations)
+
+
+def bench_codec(products: List[Dict[str, Any]], iterations: int) -> List[BenchResult]:
+    """Warm-cache decode: raw OFF JSON + from_dict vs compact records"""
+    raw = [json.dumps(p).encode() for p in products]
+    records = [encode_product(OFFProduct.from_dict(p)) for p in products]
+
+    json_size = sum(map(len, raw))
+    record_size = sum(map(len, records))
+    print(f"  cached size: JSON {json_size} B, records {record_size} B "
+          f"({json_size / record_size:.1f}x smaller)")
+
+    raw_it = iter([raw[i % len(raw)] for i in range(iterations)])
+    record_it = iter([records[i % len(records)] for i in range(iterations)])
+    return [
+        time_sync("decode_json", lambda: OFFProduct.from_dict(json.loads(next(raw_it))), iterations),
+        time_sync("decode_record", lambda: decode_product(next(record_it)), iterations),
+    ]
+
+
+def bench_fuzzy_match(products: List[Dict[str, Any]], store_size: int, iterations: int) -> BenchResult:
+    """Batch-match 50 scanned names against a synthetic product store"""
+    rng = random.Random(7)
+    words = sorted({w.lower() for p in products for w in
+                    f"{p.get('product_name') or ''} {p.get('categories') or ''}".replace(",", " ").split()
+                    if len(w) > 2})
+    brands = sorted({p['brands'] for p in products if p.get('brands')})
+    names = (
+        f"{rng.choice(brands)} {' '.join(rng.sample(words, rng.randint(2, 4)))} {rng.randint(100, 999)}g"
+        for _ in range(store_size)
+    )
+    matcher = FuzzyMatcher.from_products((str(i), name) for i, name in enumerate(names))
+
+    def typo(word: str) -> str:
+        i = rng.randrange(len(word))
+        return word[:i] + word[i + 1:]
+
+    batches = [
+        [" ".join(typo(w) for w in rng.sample(words, rng.randint(1, 2))) for _ in range(50)]
+        for _ in range(iterations)
+    ]
+    it = iter(batches)
+    return time_sync("fuzzy_match_50", lambda: matcher.match_many(next(it), k=5), iterations)
+
+
+def bench_nutrition_summary(products: List[Dict[str, Any]], pantry_size: int, iterations: int) -> BenchResult:
+    """Full nutrition summary over a synthetic pantry"""
+    parsed = [OFFProduct.from_dict(p) for p in products]
+    matrix = NutritionMatrix()
+    for i in range(pantry_size):
+        matrix.add(replace(parsed[i % len(parsed)], code=str(i)))
+    return time_sync("nutrition_summary", matrix.summary, iterations)
+
+
+async def bench_network(
+    products: List[Dict[str, Any]],
+    iterations: int,
+    concurrency: int
+) -> List[BenchResult]:
+    runner, base_url = await start_mock_server(products=products)
+    api = OpenFoodFactsAPI(base_url=base_url)
+    codes = [p["code"] for p in products]
+    image_url = f"{base_url}/images/products/{codes[0]}/front_en.3.400.jpg"
+    queries = ["nutella", "cola", "pain", "yogurt", "haricots"]
+
+    cache_dir = tempfile.TemporaryDirectory()
+    cached_api = OpenFoodFactsAPI(base_url=base_url, cache=ProductCache(Path(cache_dir.name) / "products.bin"))
+
+    try:
+        # Warm up the connection pool (and the cache) so the first samples are comparable
+        await api.get_product(codes[0])
+        for code in codes:
+            await cached_api.get_product(code)
+
+        results = [
+            await time_async(
+                "get_product",
+                lambda i: api.get_product(codes[i % len(codes)]),
+                iterations, concurrency
+            ),
+            await time_async(
+                "get_product_cached",
+                lambda i: cached_api.get_product(codes[i % len(codes)]),
+                iterations, concurrency
+            ),
+            await time_async(
+                "search_products",
+                lambda i: api.search_products(queries[i % len(queries)]),
+                max(1, iterations // 5), concurrency
+            ),
+            await time_async(
+                "download_image",
+                lambda i: api.download_image(image_url),
+                iterations, concurrency
+            ),
+        ]
+    finally:
+        await api.close()
+        await cached_api.close()
+        cached_api.cache.close()
+        cache_dir.cleanup()
+        await runner.cleanup()
+
+    return results
+
+
+# Synthetic EAN-13 rendering for the decode corpus
+
+_EAN_L = ["0001101", "0011001", "0010011", "0111101", "0100011",
+          "0110001", "0101111", "0111011", "0110111", "0001011"]
+_EAN_G = [code.translate(str.maketrans("01", "10"))[::-1] for code in _EAN_L]
+_EAN_R = [code.translate(str.maketrans("01", "10")) for code in _EAN_L]
+_EAN_PARITY = ["LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG",
+               "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL"]
+
+
+def _ean13_check_digit(digits: str) -> str:
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits))
+    return str((10 - total % 10) % 10)
+
+
+def render_ean13(code: str, module: int = 3, height: int = 80, noise: int = 24):
+    """Render an EAN-13 as an 8-bit grayscale (pixels, width, height) tuple"""
+    parity = _EAN_PARITY[int(code[0])]
+    bits = "101"
+    for d, p in zip(code[1:7], parity):
+        bits += (_EAN_L if p == "L" else _EAN_G)[int(d)]
+    bits += "01010"
+    for d in code[7:]:
+        bits += _EAN_R[int(d)]
+    bits += "101"
+
+    quiet = "0" * 10
+    row = bytearray()
+    for bit in quiet + bits + quiet:
+        row.extend((0 if bit == "1" else 255,) * module)
+
+    rng = random.Random(code)
+    pixels = bytearray()
+    for _ in range(height):
+        pixels.extend(
+            max(0, min(255, v + rng.randint(-noise, noise))) for v in row
+        )
+    return bytes(pixels), len(row), height
+
+
+def load_decode_corpus(size: int) -> List[Any]:
+    """Synthetic barcodes plus any photos dropped into benchmarks/photos/"""
+    rng = random.Random(42)
+    corpus: List[Any] = []
+    for _ in range(size):
+        digits = "".join(str(rng.randint(0, 9)) for _ in range(12))
+        corpus.append(render_ean13(digits + _ean13_check_digit(digits)))
+
+    if PHOTOS_DIR.is_dir():
+        from PIL import Image
+        for path in sorted(PHOTOS_DIR.iterdir()):
+            if path.suffix.lower() in (".jpg", ".jpeg", ".png", ".webp"):
+                corpus.append(Image.open(path).convert("L"))
+    return corpus
+
+
+def bench_barcode_decode(iterations: int) -> Optional[BenchResult]:
+    try:
+        from pyzbar import pyzbar
+    except ImportError:
+        print("  (skipping barcode_decode: pyzbar not installed)")
+        return None
+
+    corpus = load_decode_corpus(min(iterations, 50))
+    it = iter([corpus[i % len(corpus)] for i in range(iterations)])
+    return time_sync("barcode_decode", lambda: pyzbar.decode(next(it)), iterations)
+
+
+# Baseline comparison
+
+def compare_to_baseline(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float
+) -> List[str]:
+    """
+    Return a description of every regression beyond ``tolerance``
+
+    p50 is only compared for benchmarks whose baseline p50 is at least
+    LATENCY_FLOOR_MS; faster ones are judged by ops/sec.
+    """
+    regressions = []
+    for name, current in results.items():
+        saved = baseline.get(name)
+        if not saved:
+            continue
+        if current['ops_per_sec'] < saved['ops_per_sec'] * (1 - tolerance):
+            regressions.append(
+                f"{name}: ops/sec {current['ops_per_sec']:.0f} < baseline {saved['ops_per_sec']:.0f}"
+            )
+        if saved['p50_ms'] < LATENCY_FLOOR_MS:
+            continue
+        if current['p50_ms'] > saved['p50_ms'] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p50 {current['p50_ms']:.3f} ms > baseline {saved['p50_ms']:.3f} ms"
+            )
+    return regressions
+
+
+def print_table(results: Dict[str, Dict[str, float]]):
+    print(f"{'benchmark':<18}{'ops':>8}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'ops/sec':>13}")
+    for name, s in results.items():
+        print(f"{name:<18}{s['ops']:>8}{s['p50_ms']:>11.3f}{s['p95_ms']:>11.3f}"
+              f"{s['p99_ms']:>11.3f}{s['ops_per_sec']:>13.0f}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the offline benchmark suite")
+    parser.add_argument("--iterations", type=int, default=2000,
+                        help="calls per benchmark (network benchmarks use fewer)")
+    parser.add_argument("--concurrency", type=int, default=16,
+                        help="concurrent requests for network benchmarks")
+    parser.add_argument("--fuzzy-products", type=int, default=100_000,
+                        help="synthetic store size for the fuzzy matching benchmark")
+    parser.add_argument("--only", action="append", default=[],
+                        help="run only the named benchmark (repeatable)")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown before failing (0.25 = 25%%)")
+    parser.add_argument("--allow-missing-baseline", action="store_true",
+                        help="succeed when there is no baseline to compare against")
+    parser.add_argument("--json", type=Path, help="also write results to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    # Expected not-found/HTTP errors would otherwise flood the output
+    logging.getLogger("lib.openfoodfacts_api").setLevel(logging.CRITICAL)
+    products = load_products()
+    wanted = set(args.only)
+
+    def selected(name: str) -> bool:
+        return not wanted or name in wanted
+
+    runs: List[Optional[BenchResult]] = []
+    if selected("from_dict"):
+        runs.append(bench_from_dict(products, args.iterations * 10))
+    if selected("categorize"):
+        runs.append(bench_categorize(products, args.iterations * 10))
+    if wanted & {"decode_json", "decode_record"} or not wanted:
+        runs.extend(r for r in bench_codec(products, args.iterations * 10) if selected(r.name))
+    if wanted & {"get_product", "get_product_cached", "search_products", "download_image"} or not wanted:
+        network = asyncio.run(bench_network(products, args.iterations, args.concurrency))
+        runs.extend(r for r in network if selected(r.name))
+    if selected("fuzzy_match_50"):
+        runs.append(bench_fuzzy_match(products, args.fuzzy_products, max(1, args.iterations // 200)))
+    if selected("nutrition_summary"):
+        runs.append(bench_nutrition_summary(products, 10_000, max(1, args.iterations // 10)))
+    if selected("barcode_decode"):
+        runs.append(bench_barcode_decode(max(1, args.iterations // 10)))
+
+    results = {r.name: r.summary() for r in runs if r is not None}
+    print_table(results)
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        merged = {}
+        if args.baseline.exists():
+            merged = json.loads(args.baseline.read_text())
+        merged.update(results)
+        args.baseline.write_text(json.dumps(merged, indent=2))
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+
+    if not args.baseline.exists():
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to record one")
+        return 0 if args.allow_missing_baseline else 2
+
+    regressions = compare_to_baseline(results, json.loads(args.baseline.read_text()), args.tolerance)
+    if regressions:
+        print("\nPERFORMANCE REGRESSIONS:")
+        for line in regressions:
+            print(f"  ✗ {line}")
+        return 1
+
+    print("\n✓ No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
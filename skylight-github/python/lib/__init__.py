@@ -0,0 +1,7 @@
+"""
+Modules shared by the GTK app, the command line tools and the services
+
+Scripts run from the directory above (main.py, skylight_cli.py,
+lookup_service.py, ...) and import these as ``lib.<module>``; the
+modules import each other the same way.
+"""
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Barcode Validation & Known-Barcode Index
+========================================
+
+Rejects bogus barcodes locally before they cost a get_product round trip:
+
+1. normalize_barcode() validates the GS1 check digit and normalizes
+   UPC-A (12 digits) and EAN-13 to a canonical 13-digit form; EAN-8
+   codes are kept as 8 digits, like OpenFoodFacts does.
+2. BarcodeIndex answers "is this code in OFF at all?" from a file built
+   out of an OFF dump: a Bloom filter for O(1) negative answers, backed
+   by a sorted uint64 array for exact confirmation. The file is
+   memory-mapped, so opening it costs no parsing.
+
+Index file layout (little endian):
+
+    8s  magic b"SKYBCIX1"
+    Q   number of barcodes
+    Q   Bloom filter size in bits (power of two)
+    I   number of Bloom hash functions
+    I   reserved
+    ... Bloom filter bits (bits / 8 bytes, padded to 8)
+    ... sorted uint64 barcodes
+
+Usage:
+    python -m lib.barcode_index build en.openfoodfacts.org.products.csv barcodes.idx
+
+    index = BarcodeIndex.open("barcodes.idx")
+    api = OpenFoodFactsAPI(barcode_index=index)
+"""
+
+import argparse
+import csv
+import mmap
+import struct
+import sys
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+import numpy as np
+
+MAGIC = b"SKYBCIX1"
+_HEADER = struct.Struct("<8sQQII")
+
+# Bloom sizing: ~10 bits per key with 7 hashes gives ~1% false positives
+BITS_PER_KEY = 10
+NUM_HASHES = 7
+
+_MASK64 = (1 << 64) - 1
+
+
+def check_digit(digits: str) -> int:
+    """GS1 check digit for the given payload digits (any length)"""
+    total = 0
+    for i, d in enumerate(reversed(digits)):
+        total += int(d) * (3 if i % 2 == 0 else 1)
+    return (10 - total % 10) % 10
+
+
+def normalize_barcode(barcode: str) -> Optional[str]:
+    """
+    Validate and normalize a scanned barcode
+
+    Args:
+        barcode: Raw scanner output (EAN-13, UPC-A, EAN-8, with or
+            without surrounding whitespace)
+
+    Returns:
+        13-digit EAN for UPC-A/EAN-13 input, 8-digit EAN-8, or None when
+        the code is malformed or its check digit is wrong
+    """
+    code = barcode.strip()
+    if not code.isdigit() or not code.isascii():
+        return None
+
+    if len(code) == 12:
+        code = "0" + code
+    elif len(code) == 14 and code[0] == "0":
+        code = code[1:]  # GTIN-14 with an empty packaging indicator
+    elif len(code) not in (8, 13):
+        return None
+
+    # Weighted digit sum over the bytes, check digit included, must be 0 mod 10
+    raw = code.encode("ascii")
+    total = sum(raw[-1::-2]) + 3 * sum(raw[-2::-2]) - 48 * ((len(raw) + 1) // 2 + 3 * (len(raw) // 2))
+    if total % 10:
+        return None
+    return code
+
+
+def _mix(x: int) -> int:
+    """splitmix64 finalizer"""
+    x = (x ^ (x >> 30)) * 0xBF58476D1CE4E5B9 & _MASK64
+    x = (x ^ (x >> 27)) * 0x94D049BB133111EB & _MASK64
+    return x ^ (x >> 31)
+
+
+def _mix_array(x: np.ndarray) -> np.ndarray:
+    """Vectorized splitmix64 finalizer (wrapping uint64 arithmetic)"""
+    with np.errstate(over="ignore"):
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+class BarcodeIndex:
+    """
+    Memory-mapped Bloom filter + sorted barcode array
+
+    Use BarcodeIndex.open() for an index file or BarcodeIndex.build() to
+    create one.
+    """
+
+    def __init__(self, buffer, count: int, bloom_bits: int, num_hashes: int, offset: int):
+        self._buffer = buffer
+        self.count = count
+        self.num_hashes = num_hashes
+        self._bloom_mask = bloom_bits - 1
+        bloom_bytes = _bloom_bytes(bloom_bits)
+        self._bloom = memoryview(buffer)[offset:offset + bloom_bytes]
+        codes_offset = offset + bloom_bytes
+        self.codes = np.frombuffer(buffer, dtype="<u8", count=count, offset=codes_offset)
+
+    @classmethod
+    def open(cls, path: Union[str, Path]) -> "BarcodeIndex":
+        """Map an index file; nothing is read until it is queried"""
+        with open(path, "rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, bloom_bits, num_hashes, _ = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            buffer.close()
+            raise ValueError(f"{path} is not a barcode index")
+        return cls(buffer, count, bloom_bits, num_hashes, _HEADER.size)
+
+    @classmethod
+    def build(cls, barcodes: Iterable[str], path: Union[str, Path]) -> "BarcodeIndex":
+        """
+        Write an index of the valid barcodes in ``barcodes`` and open it
+
+        Invalid codes are skipped; duplicates and UPC-A/EAN-13 variants
+        of the same product collapse to one entry.
+        """
+        values = {int(code) for code in map(normalize_barcode, barcodes) if code}
+        codes = np.fromiter(sorted(values), dtype="<u8", count=len(values))
+
+        bloom_bits = 64
+        while bloom_bits < max(1, len(codes)) * BITS_PER_KEY:
+            bloom_bits <<= 1
+        bloom = np.zeros(_bloom_bytes(bloom_bits), dtype=np.uint8)
+
+        h1 = _mix_array(codes)
+        h2 = _mix_array(h1) | np.uint64(1)
+        mask = np.uint64(bloom_bits - 1)
+        with np.errstate(over="ignore"):
+            for i in range(NUM_HASHES):
+                bits = (h1 + np.uint64(i) * h2) & mask
+                np.bitwise_or.at(bloom, (bits >> np.uint64(3)).astype(np.intp),
+                                 (np.uint8(1) << (bits & np.uint64(7)).astype(np.uint8)))
+
+        path = Path(path)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, len(codes), bloom_bits, NUM_HASHES, 0))
+            f.write(bloom.tobytes())
+            f.write(codes.tobytes())
+        tmp.replace(path)
+        return cls.open(path)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def might_contain(self, value: int) -> bool:
+        """Bloom filter check; False means definitely absent"""
+        h1 = _mix(value)
+        h2 = _mix(h1) | 1
+        bloom = self._bloom
+        mask = self._bloom_mask
+        for i in range(self.num_hashes):
+            bit = (h1 + i * h2) & _MASK64 & mask
+            if not bloom[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return True
+
+    def contains(self, barcode: str) -> bool:
+        """
+        Whether ``barcode`` (raw scanner output) is a known product
+
+        Invalid codes and Bloom negatives return without touching the
+        barcode array; positives are confirmed by binary search.
+        """
+        code = normalize_barcode(barcode)
+        if code is None:
+            return False
+        value = int(code)
+        if not self.might_contain(value):
+            return False
+        i = int(np.searchsorted(self.codes, np.uint64(value)))
+        return i < self.count and int(self.codes[i]) == value
+
+    __contains__ = contains
+
+    def close(self):
+        self.codes = np.empty(0, dtype="<u8")
+        self._bloom.release()
+        self._buffer.close()
+
+
+def _bloom_bytes(bits: int) -> int:
+    return ((bits + 63) // 64) * 8
+
+
+def read_dump_barcodes(path: Union[str, Path]) -> Iterable[str]:
+    """
+    Barcodes from an OpenFoodFacts dump
+
+    Accepts the tab-separated CSV export (``code`` column) or a plain
+    text file with one barcode per line.
+    """
+    csv.field_size_limit(sys.maxsize)
+    with open(path, encoding="utf-8", errors="replace", newline="") as f:
+        first = f.readline()
+        if "\t" in first and "code" in first.split("\t"):
+            column = first.rstrip("\r\n").split("\t").index("code")
+            for row in csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE):
+                if len(row) > column:
+                    yield row[column]
+        else:
+            yield first.strip()
+            for line in f:
+                yield line.strip()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Build or query a barcode index")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="build an index from an OFF dump")
+    build.add_argument("dump", type=Path, help="OFF CSV export or one barcode per line")
+    build.add_argument("index", type=Path)
+
+    query = sub.add_parser("query", help="check barcodes against an index")
+    query.add_argument("index", type=Path)
+    query.add_argument("barcodes", nargs="+")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        index = BarcodeIndex.build(read_dump_barcodes(args.dump), args.index)
+        print(f"Indexed {len(index)} barcodes into {args.index}")
+        index.close()
+        return 0
+
+    index = BarcodeIndex.open(args.index)
+    for barcode in args.barcodes:
+        if normalize_barcode(barcode) is None:
+            status = "invalid"
+        else:
+            status = "known" if index.contains(barcode) else "unknown"
+        print(f"{barcode}\t{status}")
+    index.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
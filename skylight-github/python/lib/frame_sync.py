@@ -0,0 +1,498 @@
+"""
+Multi-Frame Sync
+================
+
+Keeps several Skylight frames (kitchen, cabin, ...) in sync at once.
+Each frame has its own SkylightAPI, local mirror, outbox and schedule;
+all of them share one aiohttp connection pool.
+
+Isolation between frames:
+- connection slots are handed out round-robin between frames that are
+  waiting for one, and while other frames are waiting each frame is
+  capped at part of the pool, so a frame with a long outbox cannot
+  starve the others; a frame syncing alone may use the whole pool
+- every sync runs under a timeout, and errors are confined to the
+  frame's result; a failing frame is retried with backoff while the
+  others keep their normal schedule
+- frames are synced concurrently, so a full round takes about as long
+  as the slowest frame
+
+Credentials live in auth.json, either the original single-frame form
+({"frame_id", "auth_token", "auth_type"}) or
+{"frames": [{"name", "frame_id", "auth_token", "auth_type", "sync_interval"}, ...]}.
+
+Local files per frame, under the cache directory:
+
+    frames/{frame_id}.json           mirror of the frame's lists and items
+    frames/{frame_id}.outbox.jsonl   items waiting to be added to the list
+
+Usage:
+    async with FrameSyncer(load_frames(AUTH_FILE), CACHE_DIR) as syncer:
+        results = await syncer.sync_all()
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import defaultdict, deque
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Deque, Dict, List, Optional, Union
+
+import aiohttp
+
+from lib.skylight_api import BASE_URL, SkylightAPI, SkylightAPIError
+from lib.metrics import LONG_BUCKETS, metrics
+from lib.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SYNC_INTERVAL = 900.0
+
+# Connections shared by all frames
+DEFAULT_MAX_CONNECTIONS = 16
+
+# Longest a single frame sync may run before it is abandoned
+DEFAULT_FRAME_TIMEOUT = 120.0
+
+# First retry delay after a failed sync; doubles per consecutive failure
+RETRY_BASE = 30.0
+
+SYNC_ERRORS = (SkylightAPIError, aiohttp.ClientError, asyncio.TimeoutError)
+
+
+@dataclass
+class FrameConfig:
+    """Credentials and schedule for one frame"""
+    name: str
+    frame_id: str
+    auth_token: str
+    auth_type: str = "Bearer"
+    sync_interval: Optional[float] = None
+
+
+def load_frames(path: Union[str, Path]) -> List[FrameConfig]:
+    """
+    Frames in an auth.json file
+
+    Returns:
+        The configured frames (empty when the file does not exist)
+
+    Raises:
+        ValueError: The file is malformed
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return []
+
+    entries = data['frames'] if 'frames' in data else [data]
+    try:
+        return [
+            FrameConfig(
+                name=entry.get('name') or entry['frame_id'],
+                frame_id=entry['frame_id'],
+                auth_token=entry['auth_token'],
+                auth_type=entry.get('auth_type', "Bearer"),
+                sync_interval=entry.get('sync_interval'),
+            )
+            for entry in entries
+        ]
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Malformed frame entry in {path}: {e}") from e
+
+
+def save_frames(path: Union[str, Path], frames: List[FrameConfig]):
+    """Write frames to auth.json (readable by the owner only)"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump({'frames': [asdict(frame) for frame in frames]}, f, indent=2)
+    tmp.replace(path)
+
+
+def upsert_frame(path: Union[str, Path], frame: FrameConfig) -> List[FrameConfig]:
+    """Add ``frame`` to auth.json, replacing a frame with the same name"""
+    frames = [f for f in load_frames(path) if f.name != frame.name]
+    frames.append(frame)
+    save_frames(path, frames)
+    return frames
+
+
+def remove_frame(path: Union[str, Path], name: str) -> bool:
+    """Drop a frame from auth.json; returns False if it was not configured"""
+    frames = load_frames(path)
+    remaining = [f for f in frames if f.name != name]
+    if len(remaining) == len(frames):
+        return False
+    save_frames(path, remaining)
+    return True
+
+
+class FairScheduler:
+    """
+    Round-robin connection slots shared by several frames
+
+    ``capacity`` requests may be in flight in total. When a slot frees up
+    it goes to the next frame in turn that has a request waiting and
+    fewer than ``per_frame`` in flight, so every busy frame progresses at
+    the same rate regardless of how much work it queued. Only when every
+    waiting frame is at that cap does one go over it, so free slots are
+    not left idle while requests wait.
+    """
+
+    def __init__(self, capacity: int, per_frame: int):
+        self.free = capacity
+        self.per_frame = per_frame
+        self.active: Dict[str, int] = defaultdict(int)
+        self._waiters: Dict[str, Deque[asyncio.Future]] = defaultdict(deque)
+        self._turns: Deque[str] = deque()
+
+    def slot(self, name: str) -> "_Slot":
+        """Async context manager holding one of ``name``'s slots"""
+        return _Slot(self, name)
+
+    async def acquire(self, name: str):
+        future = asyncio.get_running_loop().create_future()
+        waiters = self._waiters[name]
+        waiters.append(future)
+        if name not in self._turns:
+            self._turns.append(name)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(name)  # granted just as we were cancelled
+            elif future in waiters:
+                waiters.remove(future)
+            raise
+
+    def release(self, name: str):
+        self.active[name] -= 1
+        self.free += 1
+        self._dispatch()
+
+    def _dispatch(self):
+        turns = self._turns
+        skipped = 0
+        while self.free > 0 and turns and skipped < len(turns):
+            name = turns.popleft()
+            waiters = self._waiters[name]
+            while waiters and waiters[0].cancelled():
+                waiters.popleft()
+            if not waiters:
+                continue
+            # At its cap: pass the turn on, unless every other waiting frame was passed over too
+            if self.active[name] >= self.per_frame and skipped < len(turns):
+                turns.append(name)
+                skipped += 1
+                continue
+            waiters.popleft().set_result(None)
+            self.active[name] += 1
+            self.free -= 1
+            skipped = 0
+            if waiters:
+                turns.append(name)
+
+
+class _Slot:
+    __slots__ = ("scheduler", "name")
+
+    def __init__(self, scheduler: FairScheduler, name: str):
+        self.scheduler = scheduler
+        self.name = name
+
+    async def __aenter__(self):
+        await self.scheduler.acquire(self.name)
+
+    async def __aexit__(self, *exc):
+        self.scheduler.release(self.name)
+        return False
+
+
+# Per-frame local files
+
+def mirror_path(cache_dir: Path, frame_id: str) -> Path:
+    return cache_dir / "frames" / f"{frame_id}.json"
+
+
+def outbox_path(cache_dir: Path, frame_id: str) -> Path:
+    return cache_dir / "frames" / f"{frame_id}.outbox.jsonl"
+
+
+def rejected_path(cache_dir: Path, frame_id: str) -> Path:
+    """Dead-letter file for outbox lines that are not valid items"""
+    return cache_dir / "frames" / f"{frame_id}.outbox.rejected.jsonl"
+
+
+def queue_items(cache_dir: Path, frame_id: str, items: List[Dict[str, Any]]):
+    """Append items ({"label", "section"}) to a frame's outbox"""
+    path = outbox_path(cache_dir, frame_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for item in items:
+            f.write(json.dumps(item, ensure_ascii=False) + "\n")
+
+
+def _read_outbox(path: Path, rejected: Path) -> List[Dict[str, Any]]:
+    """Items in a claimed outbox; torn or invalid lines are moved to ``rejected``"""
+    items: List[Dict[str, Any]] = []
+    bad: List[bytes] = []
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                # UnicodeDecodeError and JSONDecodeError are both ValueErrors
+                item = json.loads(line)
+                if not isinstance(item, dict) or not isinstance(item.get('label'), str):
+                    raise ValueError("not an item with a label")
+            except ValueError:
+                bad.append(line if line.endswith(b"\n") else line + b"\n")
+            else:
+                items.append(item)
+    if bad:
+        logger.warning(f"Moved {len(bad)} unreadable outbox lines to {rejected}")
+        with open(rejected, "ab") as f:
+            f.writelines(bad)
+    return items
+
+
+async def _bounded(limit, coro):
+    async with limit:
+        return await coro
+
+
+async def push_outbox(api: SkylightAPI, cache_dir: Path, limit) -> Dict[str, int]:
+    """
+    Add a frame's queued items to its grocery list
+
+    ``limit`` is an async context manager held around each request
+    (e.g. FairScheduler.slot() or an asyncio.Semaphore).
+
+    Items that fail, or are still pending when the sync is cancelled,
+    go back to the outbox. Lines that are not valid items are moved to
+    the frame's rejected file. Delivery is at-least-once: an outbox
+    claimed by a run that crashed is resent in full.
+    """
+    path = outbox_path(cache_dir, api.frame_id)
+    sending = path.with_suffix(".sending")
+    if not sending.exists():
+        if not path.exists():
+            return {'pushed': 0, 'failed': 0}
+        # Claim the current outbox so items queued meanwhile land in a fresh file
+        os.replace(path, sending)
+
+    items: Optional[List[Dict[str, Any]]] = None
+    pushed: List[bool] = []
+    try:
+        items = _read_outbox(sending, rejected_path(cache_dir, api.frame_id))
+        pushed = [False] * len(items)
+        grocery_list = await api.get_grocery_list()
+        if grocery_list is None:
+            raise SkylightAPIError(404, f"frame {api.frame_id} has no lists")
+
+        async def push(i: int):
+            item = items[i]
+            try:
+                await api.add_list_item(grocery_list['id'], item['label'], item.get('section'))
+                pushed[i] = True
+            except SYNC_ERRORS as e:
+                logger.warning(f"Could not add '{item['label']}' to frame {api.frame_id}: {e}")
+
+        await asyncio.gather(*(_bounded(limit, push(i)) for i in range(len(items))))
+    finally:
+        # If the claimed file could not even be read it stays claimed and is retried next sync
+        remaining = [item for item, done in zip(items or [], pushed) if not done]
+        if items is not None:
+            if remaining:
+                queue_items(cache_dir, api.frame_id, remaining)
+            sending.unlink()
+
+    return {'pushed': len(items) - len(remaining), 'failed': len(remaining)}
+
+
+async def pull_mirror(api: SkylightAPI, cache_dir: Path, limit) -> Dict[str, int]:
+    """Fetch every list with its items and write the frame's mirror"""
+    async with limit:
+        lists = await api.get_lists()
+    details = await asyncio.gather(*(_bounded(limit, api.get_list(entry['id'])) for entry in lists))
+
+    mirror = {
+        'frame_id': api.frame_id,
+        'synced_at': time.time(),
+        'lists': [dict(entry, **summary, items=items) for entry, (summary, items) in zip(lists, details)],
+    }
+    path = mirror_path(cache_dir, api.frame_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(mirror, ensure_ascii=False))
+    tmp.replace(path)
+    return {'lists': len(lists), 'items': sum(len(items) for _, items in details)}
+
+
+@dataclass
+class FrameState:
+    """Schedule and outcome of one frame in a FrameSyncer"""
+    config: FrameConfig
+    api: SkylightAPI
+    interval: float
+    next_due: float = 0.0
+    failures: int = 0
+    last_result: Dict[str, Any] = field(default_factory=dict)
+
+
+class FrameSyncer:
+    """
+    Concurrent, isolated sync of several frames over one connection pool
+
+    Use as an async context manager; the pool is closed on exit.
+
+    Args:
+        frames: Frames to sync
+        cache_dir: Root of the per-frame mirrors and outboxes
+        base_url: Skylight server
+        max_connections: Size of the shared connection pool
+        per_frame_limit: Requests one frame may have in flight while
+            other frames are waiting (default: half the pool)
+        frame_timeout: Seconds before a frame's sync is abandoned
+        default_interval: Sync interval for frames without their own
+    """
+
+    def __init__(
+        self,
+        frames: List[FrameConfig],
+        cache_dir: Path,
+        base_url: str = BASE_URL,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        per_frame_limit: Optional[int] = None,
+        frame_timeout: float = DEFAULT_FRAME_TIMEOUT,
+        default_interval: float = DEFAULT_SYNC_INTERVAL
+    ):
+        self.frames = frames
+        self.cache_dir = cache_dir
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.scheduler = FairScheduler(max_connections, per_frame_limit or max(1, max_connections // 2))
+        self.frame_timeout = frame_timeout
+        self.default_interval = default_interval
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.states: Dict[str, FrameState] = {}
+
+    async def __aenter__(self) -> "FrameSyncer":
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections))
+        now = time.monotonic()
+        for frame in self.frames:
+            self.states[frame.name] = FrameState(
+                config=frame,
+                api=SkylightAPI(frame.frame_id, frame.auth_token, frame.auth_type,
+                                base_url=self.base_url, session=self.session),
+                interval=frame.sync_interval or self.default_interval,
+                next_due=now,
+            )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    async def sync(self, name: str) -> Dict[str, Any]:
+        """
+        Sync one frame: push its outbox, then refresh its mirror
+
+        Never raises (short of cancellation): Skylight, network and
+        unexpected failures are reported in the result's ``status``
+        ("ok", "error" or "timeout"), so one frame cannot stop the others.
+        """
+        state = self.states[name]
+        api = state.api
+        result: Dict[str, Any] = {'frame': name, 'frame_id': api.frame_id}
+        started = time.perf_counter()
+
+        async def run():
+            slot = self.scheduler.slot(name)
+            result.update(await push_outbox(api, self.cache_dir, slot))
+            result.update(await pull_mirror(api, self.cache_dir, slot))
+
+        with tracer.span("sync.frame", frame=name):
+            try:
+                await asyncio.wait_for(run(), timeout=self.frame_timeout)
+                result['status'] = "ok"
+            except asyncio.TimeoutError:
+                result['status'] = "timeout"
+            except SYNC_ERRORS as e:
+                result['status'] = "error"
+                result['error'] = str(e) or type(e).__name__
+            except Exception as e:
+                logger.exception(f"Unexpected error syncing frame {name}")
+                result['status'] = "error"
+                result['error'] = f"{type(e).__name__}: {e}"
+
+        elapsed = time.perf_counter() - started
+        result['seconds'] = round(elapsed, 3)
+        metrics.counter("sync_runs_total", frame=name, status=result['status']).inc()
+        metrics.histogram("sync_seconds", LONG_BUCKETS, frame=name).observe(elapsed)
+
+        if result['status'] == "ok":
+            state.failures = 0
+            state.next_due = time.monotonic() + state.interval
+        else:
+            state.failures += 1
+            delay = min(state.interval, RETRY_BASE * 2 ** (state.failures - 1))
+            # Jitter so frames failing together (e.g. network down) do not retry in lockstep
+            state.next_due = time.monotonic() + delay * random.uniform(0.8, 1.2)
+            logger.warning(f"Sync of frame {name} failed ({result['status']}); retrying in {delay:.0f}s")
+        state.last_result = result
+        return result
+
+    async def sync_each(self, names: Optional[List[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Sync frames concurrently, yielding each result as its frame finishes"""
+        for future in asyncio.as_completed([self.sync(n) for n in names or list(self.states)]):
+            yield await future
+
+    async def sync_all(self, names: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Sync frames concurrently; results in frame order"""
+        return list(await asyncio.gather(*(self.sync(n) for n in names or list(self.states))))
+
+    async def run(self, stop: asyncio.Event,
+                  on_result: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """
+        Sync every frame on its own schedule until ``stop`` is set
+
+        Each frame starts as soon as it is due, independently of the
+        others, and a frame is never synced twice at once.
+        """
+        running: Dict[str, asyncio.Task] = {}
+        stopping = asyncio.ensure_future(stop.wait())
+        try:
+            while not stop.is_set():
+                now = time.monotonic()
+                for name, state in self.states.items():
+                    if name not in running and state.next_due <= now:
+                        running[name] = asyncio.create_task(self.sync(name))
+
+                idle = [s.next_due for n, s in self.states.items() if n not in running]
+                timeout = max(0.0, min(idle) - time.monotonic()) if idle else None
+                done, _ = await asyncio.wait(
+                    [stopping, *running.values()], timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                for name, task in list(running.items()):
+                    if task in done:
+                        del running[name]
+                        if on_result is not None:
+                            on_result(task.result())
+        finally:
+            stopping.cancel()
+            for task in running.values():
+                task.cancel()
+            await asyncio.gather(*running.values(), return_exceptions=True)
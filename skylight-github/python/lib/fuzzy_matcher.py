@@ -0,0 +1,383 @@
+"""
+Fuzzy Product Name Matcher
+==========================
+
+Matches free-text item names (e.g. the output of CameraScanner.scan_image)
+to products in the local product store without a search_products call
+per name.
+
+Product names are normalized and indexed as trigram postings in CSR
+form (one sorted array of product ids plus offsets per trigram).
+Candidates are gathered by trigram overlap with numpy, reading the
+rarest trigrams' postings first under a fixed budget, and the best
+few are re-ranked with a bit-parallel Levenshtein distance (Myers'
+algorithm) against the best-aligned run of words in each product name,
+so matching costs a handful of array operations per name plus O(len)
+big-int steps per candidate.
+
+Products added after the build go to a small per-trigram delta that is
+searched alongside the CSR arrays and merged into them once it grows
+past a fraction of the index, so keeping the index in step with a
+growing product cache costs O(new products) amortized.
+
+Usage:
+    matcher = FuzzyMatcher.from_product_cache(api.cache)
+    for name, matches in zip(items, matcher.match_many(items, k=3)):
+        best = matches[0] if matches else None
+
+    matcher.add_from_cache(api.cache)  # index products cached since
+"""
+
+import json
+import re
+from array import array
+import unicodedata
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+# Candidates kept from the trigram pass for edit-distance re-ranking, per result
+RERANK_FACTOR = 8
+
+# Postings scanned per query; common trigrams are skipped once this is reached
+MAX_POSTINGS = 200_000
+
+# Delta postings are merged into the CSR arrays past max(MIN, indexed / DELTA_FRACTION)
+DELTA_MERGE_MIN = 4096
+DELTA_FRACTION = 4
+
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+@dataclass
+class FuzzyMatch:
+    """A product matched to a scanned name"""
+    code: str
+    name: str
+    score: float
+
+
+def normalize_name(name: str) -> str:
+    """Lowercase, strip accents and punctuation, collapse whitespace"""
+    decomposed = unicodedata.normalize("NFKD", name.lower())
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return _NON_ALNUM.sub(" ", stripped).strip()
+
+
+def trigrams(normalized: str) -> List[str]:
+    """Distinct padded trigrams of an already normalized name"""
+    padded = f"  {normalized} "
+    return list(dict.fromkeys(padded[i:i + 3] for i in range(len(padded) - 2)))
+
+
+def levenshtein(a: str, b: str) -> int:
+    """Edit distance using Myers' bit-parallel algorithm"""
+    if len(a) > len(b):
+        a, b = b, a
+    m = len(a)
+    if m == 0:
+        return len(b)
+
+    peq: Dict[str, int] = {}
+    for i, c in enumerate(a):
+        peq[c] = peq.get(c, 0) | (1 << i)
+
+    full = (1 << m) - 1
+    high = 1 << (m - 1)
+    pv, mv, score = full, 0, m
+    for c in b:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = (mv | ~(xh | pv)) & full
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        ph = ((ph << 1) | 1) & full
+        mh = (mh << 1) & full
+        pv = (mh | ~(xv | ph)) & full
+        mv = ph & xv
+    return score
+
+
+def similarity(a: str, b: str) -> float:
+    """Normalized edit similarity in [0, 1]"""
+    longest = max(len(a), len(b))
+    return 1.0 - levenshtein(a, b) / longest if longest else 1.0
+
+
+def _window_similarity(query: str, width: int, candidate: str) -> float:
+    """
+    Best edit similarity between ``query`` and any run of ``width``
+    consecutive words in ``candidate`` (or the whole candidate)
+    """
+    words = candidate.split(" ")
+    if len(words) <= width:
+        return similarity(query, candidate)
+    return max(
+        similarity(query, " ".join(words[i:i + width]))
+        for i in range(len(words) - width + 1)
+    )
+
+
+class FuzzyMatcher:
+    """
+    Trigram index over product names
+
+    Args:
+        codes: Barcode of each product
+        names: Display name of each product
+    """
+
+    def __init__(self, codes: List[str], names: List[str]):
+        self.codes = codes
+        self.names = names
+        self.normalized = [normalize_name(n) for n in names]
+        self._vocab: Dict[str, int] = {}
+
+        # array('i') keeps the (trigram, product) pairs compact for large stores
+        gram_ids = array('i')
+        product_ids = array('i')
+        gram_counts = np.zeros(len(names), dtype=np.int32)
+        vocab = self._vocab
+        for pid, norm in enumerate(self.normalized):
+            grams = trigrams(norm) if norm else []
+            gram_counts[pid] = len(grams)
+            for g in grams:
+                gid = vocab.get(g)
+                if gid is None:
+                    gid = vocab[g] = len(vocab)
+                gram_ids.append(gid)
+                product_ids.append(pid)
+
+        gids = np.frombuffer(gram_ids, dtype=np.intc)
+        order = np.argsort(gids, kind="stable")
+        self._postings = np.frombuffer(product_ids, dtype=np.intc)[order]
+        self._offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(gids, minlength=len(vocab)), out=self._offsets[1:])
+        self._gram_counts = gram_counts
+        self._init_delta()
+
+    def _init_delta(self):
+        self._pids = {code: pid for pid, code in enumerate(self.codes)}
+        self._delta: Dict[int, List[int]] = {}  # trigram id -> product ids added since the last merge
+        self._delta_size = 0
+        self.cache_position = 0  # ProductCache.codes_since() cursor
+
+    @classmethod
+    def from_products(cls, products: Iterable[Tuple[str, Optional[str]]]) -> "FuzzyMatcher":
+        """Build from (code, product_name) pairs; unnamed products are skipped"""
+        codes: List[str] = []
+        names: List[str] = []
+        for code, name in products:
+            if name:
+                codes.append(code)
+                names.append(name)
+        return cls(codes, names)
+
+    @classmethod
+    def from_product_cache(cls, cache) -> "FuzzyMatcher":
+        """Build from every product in a product_codec.ProductCache"""
+        codes, position = cache.codes_since(0)
+
+        def pairs():
+            for code in codes:
+                product = cache.get(code)
+                if product is not None:
+                    yield code, product.product_name
+
+        matcher = cls.from_products(pairs())
+        matcher.cache_position = position
+        return matcher
+
+    def add(self, code: str, name: Optional[str]) -> bool:
+        """
+        Index one more product
+
+        Returns:
+            False when the product is unnamed or ``code`` is already indexed
+        """
+        if not name or code in self._pids:
+            return False
+        pid = len(self.codes)
+        norm = normalize_name(name)
+        grams = trigrams(norm) if norm else []
+        self._pids[code] = pid
+        self.codes.append(code)
+        self.names.append(name)
+        self.normalized.append(norm)
+        if pid >= len(self._gram_counts):
+            grown = np.zeros(max(2 * len(self._gram_counts), 1024), dtype=np.int32)
+            grown[:len(self._gram_counts)] = self._gram_counts
+            self._gram_counts = grown
+        self._gram_counts[pid] = len(grams)
+
+        vocab = self._vocab
+        for g in grams:
+            gid = vocab.get(g)
+            if gid is None:
+                gid = vocab[g] = len(vocab)
+            self._delta.setdefault(gid, []).append(pid)
+        self._delta_size += len(grams)
+        if self._delta_size > max(DELTA_MERGE_MIN, len(self._postings) // DELTA_FRACTION):
+            self._merge()
+        return True
+
+    def add_from_cache(self, cache) -> int:
+        """Index products stored in ``cache`` since the last call; returns how many"""
+        codes, self.cache_position = cache.codes_since(self.cache_position)
+        added = 0
+        for code in codes:
+            product = cache.get(code)
+            if product is not None and self.add(code, product.product_name):
+                added += 1
+        return added
+
+    def _merge(self):
+        """Fold the delta into the CSR arrays in O(postings), without sorting"""
+        if not self._delta:
+            return
+        old_offsets = self._offsets
+        old_grams = len(old_offsets) - 1
+        counts = np.zeros(len(self._vocab), dtype=np.int64)
+        counts[:old_grams] = np.diff(old_offsets)
+        delta_gids = np.fromiter(self._delta.keys(), dtype=np.int64, count=len(self._delta))
+        delta_lists = list(self._delta.values())
+        delta_counts = np.fromiter((len(p) for p in delta_lists), dtype=np.int64, count=len(delta_lists))
+        main_counts = counts.copy()
+        counts[delta_gids] += delta_counts
+
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        postings = np.empty(offsets[-1], dtype=np.intc)
+
+        # Existing postings keep their order, shifted to their trigram's new start
+        shift = np.repeat(offsets[:old_grams] - old_offsets[:-1], main_counts[:old_grams])
+        postings[np.arange(len(self._postings)) + shift] = self._postings
+
+        # Delta postings go after them
+        starts = offsets[delta_gids] + main_counts[delta_gids]
+        positions = np.repeat(starts - np.cumsum(delta_counts) + delta_counts, delta_counts)
+        positions += np.arange(len(positions))
+        postings[positions] = np.fromiter(
+            (pid for pids in delta_lists for pid in pids), dtype=np.intc, count=len(positions)
+        )
+
+        self._postings = postings
+        self._offsets = offsets
+        self._delta = {}
+        self._delta_size = 0
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def _candidates(self, grams: List[str], limit: int) -> np.ndarray:
+        """Top ``limit`` product ids by shared trigrams, scanning the rarest trigrams first"""
+        offsets = self._offsets
+        indexed = len(offsets) - 1
+        delta = self._delta
+        spans = sorted(
+            ((int(offsets[gid + 1] - offsets[gid]) if gid < indexed else 0) + len(delta.get(gid, ())), gid)
+            for gid in (self._vocab.get(g) for g in grams) if gid is not None
+        )
+        chosen: List[int] = []
+        total = 0
+        for size, gid in spans:
+            if chosen and total + size > MAX_POSTINGS:
+                break
+            chosen.append(gid)
+            total += size
+        if not chosen:
+            return np.empty(0, dtype=np.intp)
+
+        parts = [self._postings[offsets[g]:offsets[g + 1]] for g in chosen if g < indexed]
+        parts.extend(np.array(delta[g], dtype=np.intc) for g in chosen if g in delta)
+        hits = np.concatenate(parts)
+        if len(hits) * 16 < len(self.codes):
+            candidates, shared = np.unique(hits, return_counts=True)
+        else:
+            shared = np.bincount(hits, minlength=len(self.codes))
+            candidates = np.flatnonzero(shared)
+            shared = shared[candidates]
+
+        if len(candidates) > limit:
+            # Most shared trigrams first; shorter names win ties
+            rank = shared.astype(np.int64) * 4096 - np.minimum(self._gram_counts[candidates], 4095)
+            candidates = candidates[np.argpartition(rank, -limit)[-limit:]]
+        return candidates
+
+    def match(self, name: str, k: int = 5, min_score: float = 0.3) -> List[FuzzyMatch]:
+        """
+        Best products for one name
+
+        Args:
+            name: Free-text item name
+            k: Maximum matches to return
+            min_score: Drop matches whose confidence is below this
+
+        Returns:
+            Matches sorted by descending confidence in [0, 1]
+        """
+        norm = normalize_name(name)
+        if not norm:
+            return []
+
+        grams = trigrams(norm)
+        query_grams = set(grams)
+        width = norm.count(" ") + 1
+        scored = []
+        for pid in self._candidates(grams, max(k * RERANK_FACTOR, 16)).tolist():
+            candidate = self.normalized[pid]
+            shared = len(query_grams.intersection(trigrams(candidate)))
+            dice = 2.0 * shared / (len(query_grams) + int(self._gram_counts[pid]))
+            score = 0.3 * dice + 0.7 * _window_similarity(norm, width, candidate)
+            if score >= min_score:
+                scored.append((score, pid))
+
+        scored.sort(key=lambda s: (-s[0], len(self.normalized[s[1]])))
+        return [FuzzyMatch(self.codes[pid], self.names[pid], round(score, 4)) for score, pid in scored[:k]]
+
+    def match_many(self, names: List[str], k: int = 5, min_score: float = 0.3) -> List[List[FuzzyMatch]]:
+        """Match a batch of names; repeated names are only scored once"""
+        unique: Dict[str, List[FuzzyMatch]] = {}
+        for name in names:
+            if name not in unique:
+                unique[name] = self.match(name, k, min_score)
+        return [unique[name] for name in names]
+
+    # Persistence, so large stores need not be re-indexed on every start
+
+    def save(self, path: Union[str, Path]):
+        """Write the index to an .npz file"""
+        self._merge()
+        np.savez(
+            path,
+            postings=self._postings,
+            offsets=self._offsets,
+            gram_counts=self._gram_counts[:len(self.codes)],
+            meta=np.frombuffer(json.dumps({
+                'codes': self.codes,
+                'names': self.names,
+                'vocab': sorted(self._vocab, key=self._vocab.get),
+            }).encode("utf-8"), dtype=np.uint8),
+        )
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "FuzzyMatcher":
+        """Read an index written by save()"""
+        with np.load(path) as data:
+            meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+            matcher = cls.__new__(cls)
+            matcher.codes = meta['codes']
+            matcher.names = meta['names']
+            matcher.normalized = [normalize_name(n) for n in matcher.names]
+            matcher._vocab = {g: i for i, g in enumerate(meta['vocab'])}
+            matcher._postings = data["postings"]
+            matcher._offsets = data["offsets"]
+            matcher._gram_counts = data["gram_counts"]
+        matcher._init_delta()
+        return matcher
@@ -0,0 +1,299 @@
+"""
+Lightweight Metrics
+===================
+
+Counters, gauges and latency histograms for the app's hot paths, with
+Prometheus text and JSON export. Free of GTK imports so headless tools
+can use it too.
+
+Metrics are disabled unless SKYLIGHT_METRICS=1 is set or enable() is
+called. While disabled every lookup returns a shared no-op metric, so
+instrumented code costs a single method call and no locking.
+
+Usage:
+    from lib.metrics import metrics
+
+    metrics.counter("off_http_requests_total", endpoint="product", status="200").inc()
+    with metrics.histogram("off_http_request_seconds", endpoint="product").time():
+        ...
+    print(metrics.render_prometheus())
+"""
+
+import bisect
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+# Latency buckets in seconds (upper bounds, +Inf implied)
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+# For long-running operations (frame syncs, daemon cycles)
+LONG_BUCKETS: Tuple[float, ...] = (
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+    60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0
+)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def percentile(samples: Sequence[float], pct: float) -> float:
+    """Nearest-rank percentile of raw samples (0.0 when there are none)"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))]
+
+
+class Counter:
+    """Monotonically increasing value"""
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    """Value that can go up and down (queue depths, sizes)"""
+    kind = "gauge"
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+
+class _Timer:
+    """Context manager observing elapsed seconds into a histogram"""
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: "Histogram"):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Histogram:
+    """Bucketed distribution of observed values (seconds)"""
+    kind = "histogram"
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+    @property
+    def overflow(self) -> int:
+        """Observations above the largest bucket"""
+        return self.counts[-1]
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Approximate quantile (bucket upper bound) of the observations
+
+        None when there are no observations or the quantile lies above
+        the largest bucket (see ``overflow``).
+        """
+        if not self.count:
+            return None
+        target = q * self.count
+        running = 0
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            if running >= target:
+                return bound
+        return None
+
+
+class _NoopMetric:
+    """Stand-in returned while metrics are disabled"""
+    __slots__ = ()
+
+    def inc(self, amount: float = 1.0):
+        pass
+
+    def dec(self, amount: float = 1.0):
+        pass
+
+    def set(self, value: float):
+        pass
+
+    def observe(self, value: float):
+        pass
+
+    def time(self) -> "_NoopMetric":
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopMetric()
+
+Metric = Union[Counter, Gauge, Histogram]
+
+
+class MetricsRegistry:
+    """
+    Registry of named, labelled metrics
+
+    Args:
+        enabled: Collect metrics; when False all lookups return a no-op
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._metrics: Dict[str, Dict[LabelKey, Metric]] = {}
+        self._kinds: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        """Drop every recorded metric"""
+        with self._lock:
+            self._metrics.clear()
+            self._kinds.clear()
+
+    def _get(self, cls, name: str, labels: Dict[str, Any], *args: Any):
+        if not self.enabled:
+            return _NOOP
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        family = self._metrics.get(name)
+        metric = family.get(key) if family is not None else None
+        if metric is None:
+            with self._lock:
+                if self._kinds.setdefault(name, cls.kind) != cls.kind:
+                    raise ValueError(f"Metric {name} already registered as {self._kinds[name]}")
+                family = self._metrics.setdefault(name, {})
+                metric = family.get(key)
+                if metric is None:
+                    metric = family[key] = cls(*args)
+        return metric
+
+    def counter(self, name: str, **labels: Any) -> Counter:
+        return self._get(Counter, name, labels)
+
+    def gauge(self, name: str, **labels: Any) -> Gauge:
+        return self._get(Gauge, name, labels)
+
+    def histogram(self, name: str, buckets: Optional[Tuple[float, ...]] = None, **labels: Any) -> Histogram:
+        """A histogram; ``buckets`` applies when the series is first created"""
+        return self._get(Histogram, name, labels, buckets or DEFAULT_BUCKETS)
+
+    # Export
+
+    def to_dict(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Snapshot of every metric as plain data"""
+        out: Dict[str, List[Dict[str, Any]]] = {}
+        with self._lock:
+            families = [(name, list(family.items())) for name, family in sorted(self._metrics.items())]
+        for name, series in families:
+            rows = []
+            for key, metric in series:
+                row: Dict[str, Any] = {'labels': dict(key)}
+                if isinstance(metric, Histogram):
+                    row.update({
+                        'count': metric.count,
+                        'sum': metric.sum,
+                        'p50': metric.quantile(0.5),
+                        'p95': metric.quantile(0.95),
+                        'p99': metric.quantile(0.99),
+                        'overflow': metric.overflow,
+                    })
+                else:
+                    row['value'] = metric.value
+                rows.append(row)
+            out[name] = rows
+        return out
+
+    def render_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=2, allow_nan=False)
+
+    def render_prometheus(self) -> str:
+        """Render in the Prometheus text exposition format"""
+        lines: List[str] = []
+        with self._lock:
+            families = [(name, list(family.items())) for name, family in sorted(self._metrics.items())]
+        for name, series in families:
+            lines.append(f"# TYPE {name} {self._kinds[name]}")
+            for key, metric in series:
+                if isinstance(metric, Histogram):
+                    running = 0
+                    for bound, count in zip(metric.buckets + (float("inf"),), metric.counts):
+                        running += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{_format_labels(key + (('le', le),))} {running}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {metric.sum}")
+                    lines.append(f"{name}_count{_format_labels(key)} {metric.count}")
+                else:
+                    lines.append(f"{name}{_format_labels(key)} {metric.value}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: Union[str, Path]):
+        """Write a snapshot; ``.json`` files get JSON, anything else Prometheus text"""
+        path = Path(path)
+        text = self.render_json() if path.suffix == ".json" else self.render_prometheus()
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text(text)
+        tmp.replace(path)
+
+
+def _format_labels(key: LabelKey) -> str:
+    if not key:
+        return ""
+    body = ",".join(
+        k + '="' + v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for k, v in key
+    )
+    return "{" + body + "}"
+
+
+# Process-wide registry
+metrics = MetricsRegistry(enabled=os.environ.get("SKYLIGHT_METRICS") == "1")
@@ -0,0 +1,247 @@
+"""
+Pantry Nutrition Analytics
+==========================
+
+Columnar, NumPy-backed view of the OFFNutriments of every product in a
+pantry or shopping list. Each product is a row of the ten per-100g
+nutriment fields (NaN when missing) alongside its category, Nutri-Score,
+NOVA group, serving size and package size.
+
+Totals, per-category breakdowns, score distributions and per-serving or
+per-package projections are single vectorized passes over the active
+rows. Products can be added and removed at any time; freed rows are
+reused, so the matrix never needs rebuilding.
+
+Usage:
+    matrix = NutritionMatrix()
+    matrix.add_many(products)
+    matrix.remove("3017620422003")
+    print(matrix.totals(basis="serving"))
+    print(matrix.by_category())
+"""
+
+import re
+from dataclasses import fields
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from lib.openfoodfacts_api import ItemCategory, OFFNutriments, OFFProduct
+from lib.product_codec import as_float
+
+NUTRIMENT_FIELDS = [f.name for f in fields(OFFNutriments)]
+CATEGORIES = list(ItemCategory)
+NUTRISCORE_GRADES = ['a', 'b', 'c', 'd', 'e']
+NOVA_GROUPS = [1, 2, 3, 4]
+
+BASES = ('100g', 'serving', 'package')
+
+_CATEGORY_INDEX = {c: i for i, c in enumerate(CATEGORIES)}
+_GRADE_INDEX = {g: i for i, g in enumerate(NUTRISCORE_GRADES)}
+
+_AMOUNT = re.compile(r'(\d+(?:[.,]\d+)?)\s*(kg|g|mg|l|dl|cl|ml)\b', re.IGNORECASE)
+_MULTIPACK = re.compile(r'(\d+)\s*[x×]\s*(\d+(?:[.,]\d+)?)\s*(kg|g|mg|l|dl|cl|ml)\b', re.IGNORECASE)
+_GRAMS_PER_UNIT = {'kg': 1000.0, 'g': 1.0, 'mg': 0.001, 'l': 1000.0, 'dl': 100.0, 'cl': 10.0, 'ml': 1.0}
+
+
+def parse_grams(text: Optional[str]) -> float:
+    """
+    Grams (or millilitres) in an OFF quantity/serving_size string
+
+    Handles "400 g", "1.5 L", "4 x 125 g" and "2 slices (50 g)".
+
+    Returns:
+        The amount, or NaN when no amount can be found
+    """
+    if not text:
+        return np.nan
+    multi = _MULTIPACK.search(text)
+    if multi:
+        count, amount, unit = multi.groups()
+        return int(count) * float(amount.replace(',', '.')) * _GRAMS_PER_UNIT[unit.lower()]
+    single = _AMOUNT.search(text)
+    if single:
+        amount, unit = single.groups()
+        return float(amount.replace(',', '.')) * _GRAMS_PER_UNIT[unit.lower()]
+    return np.nan
+
+
+class NutritionMatrix:
+    """
+    Incrementally maintained nutriment matrix
+
+    Args:
+        capacity: Initial number of rows (grows by doubling)
+    """
+
+    def __init__(self, capacity: int = 256):
+        capacity = max(1, capacity)
+        self.values = np.full((capacity, len(NUTRIMENT_FIELDS)), np.nan)
+        self.counts = np.zeros(capacity)
+        self.category = np.zeros(capacity, dtype=np.int8)
+        self.nutriscore = np.full(capacity, -1, dtype=np.int8)
+        self.nova = np.full(capacity, -1, dtype=np.int8)
+        self.serving_grams = np.full(capacity, np.nan)
+        self.package_grams = np.full(capacity, np.nan)
+        self.active = np.zeros(capacity, dtype=bool)
+        self._rows: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, code: str) -> bool:
+        return code in self._rows
+
+    def _grow(self):
+        old = len(self.active)
+        new = old * 2
+        self.values = np.vstack([self.values, np.full((new - old, len(NUTRIMENT_FIELDS)), np.nan)])
+        self.counts = np.concatenate([self.counts, np.zeros(new - old)])
+        self.category = np.concatenate([self.category, np.zeros(new - old, dtype=np.int8)])
+        self.nutriscore = np.concatenate([self.nutriscore, np.full(new - old, -1, dtype=np.int8)])
+        self.nova = np.concatenate([self.nova, np.full(new - old, -1, dtype=np.int8)])
+        self.serving_grams = np.concatenate([self.serving_grams, np.full(new - old, np.nan)])
+        self.package_grams = np.concatenate([self.package_grams, np.full(new - old, np.nan)])
+        self.active = np.concatenate([self.active, np.zeros(new - old, dtype=bool)])
+
+    def add(self, product: OFFProduct, count: float = 1.0):
+        """Add a product (or replace it if its barcode is already present)"""
+        row = self._rows.get(product.code)
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+            else:
+                if self._next == len(self.active):
+                    self._grow()
+                row = self._next
+                self._next += 1
+            self._rows[product.code] = row
+
+        nutriments = product.nutriments
+        if nutriments is not None:
+            # OFF sometimes sends numbers as strings ("1,5", ""); unparseable ones become NaN
+            self.values[row] = [
+                np.nan if v is None else v
+                for v in (as_float(getattr(nutriments, name)) for name in NUTRIMENT_FIELDS)
+            ]
+        else:
+            self.values[row] = np.nan
+
+        self.counts[row] = count
+        self.category[row] = _CATEGORY_INDEX[product.categorize()]
+        self.nutriscore[row] = _GRADE_INDEX.get((product.nutriscore_grade or '').lower(), -1)
+        nova = product.nova_group
+        self.nova[row] = nova if isinstance(nova, int) and 1 <= nova <= 4 else -1
+        self.serving_grams[row] = parse_grams(product.serving_size)
+        self.package_grams[row] = parse_grams(product.quantity)
+        self.active[row] = True
+
+    def add_many(self, products: Iterable[OFFProduct]):
+        for product in products:
+            self.add(product)
+
+    def remove(self, code: str) -> bool:
+        """Remove a product; returns False if it was not present"""
+        row = self._rows.pop(code, None)
+        if row is None:
+            return False
+        self.active[row] = False
+        self.counts[row] = 0.0
+        self._free.append(row)
+        return True
+
+    def set_count(self, code: str, count: float):
+        """Change how many units of a product are held"""
+        self.counts[self._rows[code]] = count
+
+    # Aggregates
+
+    def _weighted(self, basis: str) -> np.ndarray:
+        """Active-row matrix scaled to the requested basis and unit counts"""
+        if basis not in BASES:
+            raise ValueError(f"basis must be one of {BASES}")
+        mask = self.active[:self._next]
+        values = self.values[:self._next][mask]
+        scale = self.counts[:self._next][mask]
+        if basis == 'serving':
+            scale = scale * self.serving_grams[:self._next][mask] / 100.0
+        elif basis == 'package':
+            scale = scale * self.package_grams[:self._next][mask] / 100.0
+        return values * scale[:, None]
+
+    def totals(self, basis: str = '100g') -> Dict[str, float]:
+        """
+        Sum of every nutriment across the held products
+
+        Args:
+            basis: '100g' sums the per-100g values, 'serving' projects to
+                one serving of each product, 'package' to the whole package.
+                Every basis is multiplied by the unit count.
+        """
+        sums = np.nansum(self._weighted(basis), axis=0)
+        return dict(zip(NUTRIMENT_FIELDS, sums.tolist()))
+
+    def coverage(self) -> Dict[str, int]:
+        """Number of held products reporting each nutriment"""
+        mask = self.active[:self._next]
+        present = (~np.isnan(self.values[:self._next][mask])).sum(axis=0)
+        return dict(zip(NUTRIMENT_FIELDS, present.tolist()))
+
+    def means(self) -> Dict[str, Optional[float]]:
+        """Mean per-100g value of each nutriment over products reporting it"""
+        mask = self.active[:self._next]
+        values = self.values[:self._next][mask]
+        present = (~np.isnan(values)).sum(axis=0)
+        sums = np.nansum(values, axis=0)
+        return {
+            name: (float(s / n) if n else None)
+            for name, s, n in zip(NUTRIMENT_FIELDS, sums.tolist(), present.tolist())
+        }
+
+    def by_category(self, basis: str = '100g') -> Dict[str, Dict[str, float]]:
+        """Nutriment totals per ItemCategory (categories with no products omitted)"""
+        mask = self.active[:self._next]
+        weighted = np.nan_to_num(self._weighted(basis))
+        categories = self.category[:self._next][mask].astype(np.intp)
+        out = np.zeros((len(CATEGORIES), len(NUTRIMENT_FIELDS)))
+        np.add.at(out, categories, weighted)
+        held = np.bincount(categories, minlength=len(CATEGORIES))
+        return {
+            category.value: dict(zip(NUTRIMENT_FIELDS, out[i].tolist()))
+            for i, category in enumerate(CATEGORIES) if held[i]
+        }
+
+    def category_counts(self) -> Dict[str, int]:
+        mask = self.active[:self._next]
+        counts = np.bincount(self.category[:self._next][mask], minlength=len(CATEGORIES))
+        return {c.value: int(n) for c, n in zip(CATEGORIES, counts) if n}
+
+    def nutriscore_distribution(self) -> Dict[str, int]:
+        """Products per Nutri-Score grade ('unknown' for missing)"""
+        mask = self.active[:self._next]
+        counts = np.bincount(self.nutriscore[:self._next][mask] + 1, minlength=len(NUTRISCORE_GRADES) + 1)
+        return {'unknown': int(counts[0]), **{g: int(n) for g, n in zip(NUTRISCORE_GRADES, counts[1:])}}
+
+    def nova_distribution(self) -> Dict[str, int]:
+        """Products per NOVA group ('unknown' for missing)"""
+        mask = self.active[:self._next]
+        groups = self.nova[:self._next][mask]
+        counts = np.bincount(np.where(groups < 0, 0, groups), minlength=5)
+        return {'unknown': int(counts[0]), **{str(g): int(counts[g]) for g in NOVA_GROUPS}}
+
+    def summary(self) -> Dict[str, object]:
+        """Everything above in one dictionary"""
+        return {
+            'products': len(self),
+            'totals_100g': self.totals('100g'),
+            'totals_serving': self.totals('serving'),
+            'totals_package': self.totals('package'),
+            'means_100g': self.means(),
+            'coverage': self.coverage(),
+            'categories': self.category_counts(),
+            'by_category_100g': self.by_category('100g'),
+            'nutriscore': self.nutriscore_distribution(),
+            'nova': self.nova_distribution(),
+        }
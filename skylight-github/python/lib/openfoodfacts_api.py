@@ -19,11 +19,15 @@ Usage:
 
 import aiohttp
 import asyncio
+import time
 from typing import Optional, List, Dict, Any
 from dataclasses import dataclass, field
 from enum import Enum
 import logging
 
+from lib.metrics import metrics
+from lib.tracing import tracer
+
 logger = logging.getLogger(__name__)
 
 # User-Agent following OpenFoodFacts guidelines
@@ -208,8 +212,18 @@ class OpenFoodFactsAPI:
     - Server: https://github.com/openfoodfacts/openfoodfacts-server
     """
     
-    def __init__(self, base_url: str = BASE_URL):
+    def __init__(self, base_url: str = BASE_URL, cache=None, barcode_index=None):
+        """
+        Args:
+            base_url: OpenFoodFacts server
+            cache: Optional product cache (e.g. product_codec.ProductCache)
+                consulted before, and filled after, barcode lookups
+            barcode_index: Optional barcode_index.BarcodeIndex; barcodes
+                that are invalid or absent from it are rejected locally
+        """
         self.base_url = base_url
+        self.cache = cache
+        self.barcode_index = barcode_index
         self.session: Optional[aiohttp.ClientSession] = None
     
     async def _get_session(self) -> aiohttp.ClientSession:
@@ -240,26 +254,52 @@ class OpenFoodFactsAPI:
         Raises:
             aiohttp.ClientError: Network error
         """
+        if self.barcode_index is not None and not self.barcode_index.contains(barcode):
+            metrics.counter("off_barcode_rejected_total").inc()
+            logger.debug(f"Barcode {barcode} rejected by local index")
+            return None
+        
+        if self.cache is not None:
+            with tracer.span("off.cache_get", barcode=barcode):
+                cached = self.cache.get(barcode)
+            if cached is not None:
+                metrics.counter("off_cache_requests_total", result="hit").inc()
+                return cached
+            metrics.counter("off_cache_requests_total", result="miss").inc()
+        
         url = f"{self.base_url}/api/v2/product/{barcode}"
+        started = time.perf_counter()
         
-        try:
-            session = await self._get_session()
-            async with session.get(url) as response:
-                if response.status == 200:
-                    data = await response.json()
+        with tracer.span("off.get_product", barcode=barcode):
+            try:
+                session = await self._get_session()
+                async with session.get(url) as response:
+                    metrics.counter("off_http_requests_total", endpoint="product", status=response.status).inc()
+                    if response.status == 200:
+                        parse_timer = metrics.histogram("off_parse_seconds", endpoint="product").time()
+                        with parse_timer, tracer.span("off.parse"):
+                            data = await response.json()
+                            product = None
+                            if data.get('status') == 1 and data.get('product'):
+                                product = OFFProduct.from_dict(data['product'])
                     
-                    if data.get('status') == 1 and data.get('product'):
-                        return OFFProduct.from_dict(data['product'])
+                        if product is None:
+                            logger.warning(f"Product {barcode} not found")
+                        elif self.cache is not None:
+                            self.cache.put(product, barcode)
+                        return product
                     else:
-                        logger.warning(f"Product {barcode} not found")
+                        logger.error(f"HTTP {response.status} for barcode {barcode}")
                         return None
-                else:
-                    logger.error(f"HTTP {response.status} for barcode {barcode}")
-                    return None
         
-        except aiohttp.ClientError as e:
-            logger.error(f"Network error fetching product {barcode}: {e}")
-            raise
+            except aiohttp.ClientError as e:
+                metrics.counter("off_http_requests_total", endpoint="product", status="error").inc()
+                logger.error(f"Network error fetching product {barcode}: {e}")
+                raise
+            finally:
+                metrics.histogram("off_http_request_seconds", endpoint="product").observe(
+                    time.perf_counter() - started
+                )
     
     async def search_products(
         self, 
@@ -286,20 +326,31 @@ class OpenFoodFactsAPI:
             'json': 1
         }
         
-        try:
-            session = await self._get_session()
-            async with session.get(url, params=params) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    products = data.get('products', [])
-                    return [OFFProduct.from_dict(p) for p in products]
-                else:
-                    logger.error(f"HTTP {response.status} for search '{query}'")
-                    return []
+        started = time.perf_counter()
         
-        except aiohttp.ClientError as e:
-            logger.error(f"Network error searching '{query}': {e}")
-            return []
+        with tracer.span("off.search_products", query=query):
+            try:
+                session = await self._get_session()
+                async with session.get(url, params=params) as response:
+                    metrics.counter("off_http_requests_total", endpoint="search", status=response.status).inc()
+                    if response.status == 200:
+                        parse_timer = metrics.histogram("off_parse_seconds", endpoint="search").time()
+                        with parse_timer, tracer.span("off.parse"):
+                            data = await response.json()
+                            products = data.get('products', [])
+                            return [OFFProduct.from_dict(p) for p in products]
+                    else:
+                        logger.error(f"HTTP {response.status} for search '{query}'")
+                        return []
+        
+            except aiohttp.ClientError as e:
+                metrics.counter("off_http_requests_total", endpoint="search", status="error").inc()
+                logger.error(f"Network error searching '{query}': {e}")
+                return []
+            finally:
+                metrics.histogram("off_http_request_seconds", endpoint="search").observe(
+                    time.perf_counter() - started
+                )
     
     async def download_image(self, image_url: str) -> Optional[bytes]:
         """
@@ -311,18 +362,27 @@ class OpenFoodFactsAPI:
         Returns:
             Image bytes if successful, None otherwise
         """
-        try:
-            session = await self._get_session()
-            async with session.get(image_url) as response:
-                if response.status == 200:
-                    return await response.read()
-                else:
-                    logger.error(f"HTTP {response.status} downloading image")
-                    return None
+        started = time.perf_counter()
         
-        except aiohttp.ClientError as e:
-            logger.error(f"Error downloading image: {e}")
-            return None
+        with tracer.span("off.download_image"):
+            try:
+                session = await self._get_session()
+                async with session.get(image_url) as response:
+                    metrics.counter("off_http_requests_total", endpoint="image", status=response.status).inc()
+                    if response.status == 200:
+                        return await response.read()
+                    else:
+                        logger.error(f"HTTP {response.status} downloading image")
+                        return None
+        
+            except aiohttp.ClientError as e:
+                metrics.counter("off_http_requests_total", endpoint="image", status="error").inc()
+                logger.error(f"Error downloading image: {e}")
+                return None
+            finally:
+                metrics.histogram("off_http_request_seconds", endpoint="image").observe(
+                    time.perf_counter() - started
+                )
 
 
 # Attribution information
@@ -0,0 +1,333 @@
+"""
+Compact Product Records
+=======================
+
+Fixed-schema binary encoding of OFFProduct for the on-disk cache. Only
+the modeled fields are kept; raw OFF payloads carry hundreds more.
+
+Record layout (little endian, version 1):
+
+    B   version
+    B   flags (reserved, 0)
+    I   field bitmap, bit i set when STRING_FIELDS[i] is present,
+        plus NOVA_BIT and NUTRIMENTS_BIT
+    B   nova_group                      if NOVA_BIT
+    H   nutriment bitmap + d*m values   if NUTRIMENTS_BIT
+    ... present strings as UTF-8, NUL separated, in field order
+
+Records decode straight into OFFProduct/OFFNutriments positional
+arguments. All strings come back from a single UTF-8 decode and split,
+and decode plans are cached per bitmap since most products share a
+handful of field combinations.
+
+Usage:
+    blob = encode_product(product)
+    product = decode_product(blob)
+
+    cache = ProductCache(Path.home() / ".cache" / "skylight-shopping-list" / "products.bin")
+    api = OpenFoodFactsAPI(cache=cache)
+"""
+
+import logging
+import os
+import struct
+import threading
+import time
+from dataclasses import fields
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from lib.openfoodfacts_api import OFFNutriments, OFFProduct
+from lib.barcode_index import normalize_barcode
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+_SEPARATOR = '\x00'
+
+# OFFProduct constructor order; every field except these two is a string
+_PRODUCT_FIELDS = [f.name for f in fields(OFFProduct)]
+STRING_FIELDS = [n for n in _PRODUCT_FIELDS if n not in ('nutriments', 'nova_group')]
+NUTRIMENT_FIELDS = [f.name for f in fields(OFFNutriments)]
+
+NOVA_BIT = 1 << len(STRING_FIELDS)
+NUTRIMENTS_BIT = NOVA_BIT << 1
+
+_STRING_SLOTS = [_PRODUCT_FIELDS.index(n) for n in STRING_FIELDS]
+_NOVA_SLOT = _PRODUCT_FIELDS.index('nova_group')
+_NUTRIMENTS_SLOT = _PRODUCT_FIELDS.index('nutriments')
+
+_HEADER = struct.Struct('<BBI')
+_NUTRI_HEADER = struct.Struct('<H')
+
+
+class CodecError(ValueError):
+    """Raised for records that cannot be decoded"""
+
+
+def encode_product(product: OFFProduct) -> bytes:
+    """Encode a product into a compact record"""
+    bitmap = 0
+    strings: List[str] = []
+    for i, name in enumerate(STRING_FIELDS):
+        value = getattr(product, name)
+        if value is not None:
+            bitmap |= 1 << i
+            # NUL is the separator; it never appears in real OFF text
+            strings.append(str(value).replace(_SEPARATOR, ''))
+
+    tail = b''
+    nova = _as_int(product.nova_group)
+    if nova is not None and 0 <= nova <= 255:
+        bitmap |= NOVA_BIT
+        tail += bytes((nova,))
+
+    if product.nutriments is not None:
+        bitmap |= NUTRIMENTS_BIT
+        nutri_bitmap = 0
+        values: List[float] = []
+        for i, name in enumerate(NUTRIMENT_FIELDS):
+            value = as_float(getattr(product.nutriments, name))
+            if value is not None:
+                nutri_bitmap |= 1 << i
+                values.append(value)
+        tail += _NUTRI_HEADER.pack(nutri_bitmap) + struct.pack(f'<{len(values)}d', *values)
+
+    return b''.join((
+        _HEADER.pack(FORMAT_VERSION, 0, bitmap),
+        tail,
+        _SEPARATOR.join(strings).encode('utf-8'),
+    ))
+
+
+class _Plan:
+    """Precomputed decode steps for one field bitmap"""
+    __slots__ = ('slots', 'has_nova', 'has_nutriments')
+
+    def __init__(self, bitmap: int):
+        self.slots = [_STRING_SLOTS[i] for i in range(len(STRING_FIELDS)) if bitmap & (1 << i)]
+        self.has_nova = bool(bitmap & NOVA_BIT)
+        self.has_nutriments = bool(bitmap & NUTRIMENTS_BIT)
+
+
+_plans: Dict[int, _Plan] = {}
+_nutri_plans: Dict[int, Tuple[struct.Struct, List[int]]] = {}
+
+
+def decode_product(record: Union[bytes, memoryview]) -> OFFProduct:
+    """Decode a record produced by encode_product"""
+    try:
+        version, _flags, bitmap = _HEADER.unpack_from(record, 0)
+    except struct.error as e:
+        raise CodecError(f"Truncated product record: {e}") from e
+    if version != FORMAT_VERSION:
+        raise CodecError(f"Unsupported product record version {version}")
+
+    plan = _plans.get(bitmap)
+    if plan is None:
+        plan = _plans[bitmap] = _Plan(bitmap)
+
+    args: List[object] = [None] * len(_PRODUCT_FIELDS)
+    try:
+        pos = _HEADER.size
+
+        if plan.has_nova:
+            args[_NOVA_SLOT] = record[pos]
+            pos += 1
+
+        if plan.has_nutriments:
+            (nutri_bitmap,) = _NUTRI_HEADER.unpack_from(record, pos)
+            pos += _NUTRI_HEADER.size
+            nutri_plan = _nutri_plans.get(nutri_bitmap)
+            if nutri_plan is None:
+                present = [i for i in range(len(NUTRIMENT_FIELDS)) if nutri_bitmap & (1 << i)]
+                nutri_plan = _nutri_plans[nutri_bitmap] = (struct.Struct(f'<{len(present)}d'), present)
+            values_struct, present = nutri_plan
+            nutri_args: List[Optional[float]] = [None] * len(NUTRIMENT_FIELDS)
+            for i, value in zip(present, values_struct.unpack_from(record, pos)):
+                nutri_args[i] = value
+            pos += values_struct.size
+            args[_NUTRIMENTS_SLOT] = OFFNutriments(*nutri_args)
+
+        if plan.slots:
+            strings = str(record[pos:], 'utf-8').split(_SEPARATOR)
+            if len(strings) != len(plan.slots):
+                raise CodecError(f"Expected {len(plan.slots)} strings, found {len(strings)}")
+            for slot, value in zip(plan.slots, strings):
+                args[slot] = value
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise CodecError(f"Corrupt product record: {e}") from e
+
+    return OFFProduct(*args)
+
+
+def _as_int(value) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def as_float(value) -> Optional[float]:
+    """OFF number that may arrive as a number, a string ("1,5") or junk ("")"""
+    if isinstance(value, str):
+        value = value.strip().replace(',', '.')
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _cache_key(barcode: str) -> str:
+    """Normalized barcode, or the stripped input when it is not a valid EAN/UPC"""
+    return normalize_barcode(barcode) or barcode.strip()
+
+
+class ProductCache:
+    """
+    Append-only on-disk product cache
+
+    Entries are ``<I d H`` (record length, fetched-at, code length), the
+    barcode, then an encode_product record. The index of the newest entry
+    per barcode is rebuilt on open by skipping from header to header, and
+    reads use pread so appends never invalidate a mapping.
+
+    Barcodes are keyed in normalized form (see
+    barcode_index.normalize_barcode), so a UPC-A scan finds the product
+    OFF returned under its EAN-13 code. Entries that fail to decode are
+    dropped and read as misses, so the caller refetches them.
+
+    Args:
+        path: Cache file (created if missing)
+        max_age: Seconds before an entry is treated as stale (None = never)
+    """
+
+    _ENTRY = struct.Struct('<IdH')
+
+    def __init__(self, path: Union[str, Path], max_age: Optional[float] = None):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._index: Dict[str, Tuple[int, int, float]] = {}
+        self._added: List[str] = []  # barcodes in order of first storage, for codes_since()
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._size = self._load_index()
+
+    def _load_index(self) -> int:
+        size = os.fstat(self._fd).st_size
+        pos = 0
+        header = self._ENTRY
+        while pos + header.size <= size:
+            record_len, fetched_at, code_len = header.unpack(os.pread(self._fd, header.size, pos))
+            end = pos + header.size + code_len + record_len
+            if end > size:
+                break  # torn write at the tail
+            try:
+                code = os.pread(self._fd, code_len, pos + header.size).decode('utf-8')
+            except UnicodeDecodeError:
+                logger.warning(f"Skipping damaged entry at offset {pos} in {self.path}")
+            else:
+                key = _cache_key(code)
+                if key not in self._index:
+                    self._added.append(key)
+                self._index[key] = (pos + header.size + code_len, record_len, fetched_at)
+            pos = end
+        if pos != size:
+            os.ftruncate(self._fd, pos)
+        return pos
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, barcode: str) -> bool:
+        return self._fresh_entry(barcode) is not None
+
+    def codes(self) -> Iterator[str]:
+        return iter(list(self._index))
+
+    def codes_since(self, position: int) -> Tuple[List[str], int]:
+        """
+        Barcodes first stored after ``position``
+
+        Returns:
+            (barcodes, position to pass next time); start from 0. May
+            include barcodes whose entry has since been dropped.
+        """
+        added = self._added[position:]
+        return added, position + len(added)
+
+    def _fresh_entry(self, barcode: str) -> Optional[Tuple[int, int, float]]:
+        entry = self._index.get(_cache_key(barcode))
+        if entry is None:
+            return None
+        if self.max_age is not None and time.time() - entry[2] > self.max_age:
+            return None
+        return entry
+
+    def get_record(self, barcode: str) -> Optional[bytes]:
+        """Raw encoded record for ``barcode`` if cached and fresh"""
+        entry = self._fresh_entry(barcode)
+        if entry is None:
+            return None
+        return os.pread(self._fd, entry[1], entry[0])
+
+    def get(self, barcode: str) -> Optional[OFFProduct]:
+        """Cached product for ``barcode`` if present, fresh and readable"""
+        record = self.get_record(barcode)
+        if record is None:
+            return None
+        try:
+            return decode_product(record)
+        except CodecError as e:
+            logger.warning(f"Dropping unreadable cache entry for {barcode}: {e}")
+            with self._lock:
+                self._index.pop(_cache_key(barcode), None)
+            return None
+
+    def put(self, product: OFFProduct, barcode: Optional[str] = None):
+        """
+        Store (or replace) a product
+
+        Args:
+            product: Product to store
+            barcode: Barcode it was requested under, when that may differ
+                from ``product.code`` (default ``product.code``)
+        """
+        record = encode_product(product)
+        key = _cache_key(barcode or product.code)
+        code = key.encode('utf-8')
+        fetched_at = time.time()
+        entry = self._ENTRY.pack(len(record), fetched_at, len(code)) + code + record
+        with self._lock:
+            os.pwrite(self._fd, entry, self._size)
+            if key not in self._index:
+                self._added.append(key)
+            self._index[key] = (self._size + self._ENTRY.size + len(code), len(record), fetched_at)
+            self._size += len(entry)
+
+    def compact(self):
+        """Rewrite the file keeping only the newest entry per barcode"""
+        with self._lock:
+            tmp = self.path.with_suffix(self.path.suffix + '.tmp')
+            index: Dict[str, Tuple[int, int, float]] = {}
+            with open(tmp, 'wb') as out:
+                pos = 0
+                for code, (offset, length, fetched_at) in self._index.items():
+                    raw_code = code.encode('utf-8')
+                    entry = (self._ENTRY.pack(length, fetched_at, len(raw_code)) + raw_code
+                             + os.pread(self._fd, length, offset))
+                    out.write(entry)
+                    index[code] = (pos + self._ENTRY.size + len(raw_code), length, fetched_at)
+                    pos += len(entry)
+            os.replace(tmp, self.path)
+            os.close(self._fd)
+            self._fd = os.open(self.path, os.O_RDWR)
+            self._index = index
+            self._size = pos
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
@@ -0,0 +1,245 @@
+"""
+Restock Predictor
+=================
+
+Estimates how fast each product is used up from the quantities seen in
+successive pantry scans (scan_history.ScanHistory) and suggests what to
+put on the shopping list before it runs out.
+
+For each product the predictor keeps exponentially decayed sums of the
+amount consumed and the time it took, over intervals between scans in
+which the quantity did not go up (an increase is a restock, which hides
+how much was used in that interval). The consumption rate is their
+ratio, so recent habits outweigh old ones with a half-life of
+HALF_LIFE_DAYS. When a scan is known to cover the whole pantry, a
+product that was held and is missing from it has run out; callers
+record that as a quantity of 0 (see held()), otherwise the last
+interval before it ran out is never measured.
+
+The state is a handful of NumPy arrays indexed by product id. update()
+folds in only the events appended since the previous call, grouped per
+product with array operations, and the state can be saved so restarts
+do not rescan the history either.
+
+Usage:
+    predictor = RestockPredictor.load(path) if path.exists() else RestockPredictor()
+    predictor.update(history)
+    for suggestion in predictor.suggest(history):
+        print(suggestion.barcode, suggestion.days_left)
+    predictor.save(path)
+"""
+
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Union
+
+import numpy as np
+
+from lib.scan_history import ScanEvents, ScanHistory
+
+DAY = 86400.0
+
+HALF_LIFE_DAYS = 30.0
+
+# Suggest products expected to run out within this many days
+LEAD_DAYS = 3.0
+
+# Scans of a product needed before its rate is trusted (two give one interval)
+MIN_OBSERVATIONS = 2
+
+
+@dataclass
+class RestockSuggestion:
+    """A product predicted to run out soon"""
+    barcode: str
+    rate_per_day: float
+    estimated_quantity: float
+    days_left: float
+    last_seen: float
+
+
+class RestockPredictor:
+    """
+    Incremental per-product consumption model
+
+    Args:
+        half_life_days: Age at which an interval counts half as much
+    """
+
+    def __init__(self, half_life_days: float = HALF_LIFE_DAYS):
+        self.half_life = half_life_days * DAY
+        self.seq = 0  # history events folded in so far
+        self.last_ts = np.empty(0)
+        self.last_qty = np.empty(0)
+        self.consumed = np.empty(0)
+        self.elapsed = np.empty(0)
+        self.observations = np.empty(0, dtype=np.int64)
+        self.restocks = np.empty(0, dtype=np.int64)
+
+    def _grow(self, size: int):
+        extra = size - len(self.last_ts)
+        if extra <= 0:
+            return
+        self.last_ts = np.concatenate([self.last_ts, np.full(extra, -np.inf)])
+        self.last_qty = np.concatenate([self.last_qty, np.zeros(extra)])
+        self.consumed = np.concatenate([self.consumed, np.zeros(extra)])
+        self.elapsed = np.concatenate([self.elapsed, np.zeros(extra)])
+        self.observations = np.concatenate([self.observations, np.zeros(extra, dtype=np.int64)])
+        self.restocks = np.concatenate([self.restocks, np.zeros(extra, dtype=np.int64)])
+
+    def update(self, history: ScanHistory) -> int:
+        """Fold in events appended since the last update; returns how many"""
+        events = history.events(self.seq)
+        self.apply(events)
+        self.seq = events.start + len(events)
+        return len(events)
+
+    def apply(self, events: ScanEvents):
+        """
+        Fold a batch of events into the model
+
+        An event counts only if it is newer than every event recorded
+        before it for the same product, so late arrivals are ignored and
+        the result does not depend on how the history is batched.
+        """
+        if not len(events):
+            return
+        ids = events.product_ids.astype(np.intp)
+        ts = events.timestamps
+        qty = events.quantities.astype(np.float64)
+        self._grow(int(ids.max()) + 1)
+
+        # Group by product, in recorded order within each group
+        order = np.argsort(ids, kind="stable")
+        ids, ts, qty = ids[order], ts[order], qty[order]
+
+        # Timestamp ranks offset per group rise across groups, so a running
+        # maximum gives the newest earlier event of the same product
+        group = np.cumsum(np.concatenate(([True], ids[1:] != ids[:-1]))) - 1
+        key = group * len(ts) + np.unique(ts, return_inverse=True)[1].ravel()
+        newest_before = np.empty_like(key)
+        newest_before[0] = -1
+        newest_before[1:] = np.maximum.accumulate(key)[:-1]
+        fresh = (key > newest_before) & (ts > self.last_ts[ids])
+        ids, ts, qty = ids[fresh], ts[fresh], qty[fresh]
+        if not len(ids):
+            return
+
+        first = np.ones(len(ids), dtype=bool)
+        first[1:] = ids[1:] != ids[:-1]
+        last = np.ones(len(ids), dtype=bool)
+        last[:-1] = first[1:]
+        group = np.cumsum(first) - 1
+        products = ids[first]
+
+        # Previous observation of the same product (from the state for the first in a group)
+        prev_ts = np.empty_like(ts)
+        prev_ts[1:] = ts[:-1]
+        prev_ts[first] = self.last_ts[products]
+        prev_qty = np.empty_like(qty)
+        prev_qty[1:] = qty[:-1]
+        prev_qty[first] = self.last_qty[products]
+
+        seen = np.isfinite(prev_ts)
+        dt = np.where(seen, ts - np.where(seen, prev_ts, 0.0), 0.0)
+        usable = seen & (dt > 0) & (qty <= prev_qty)
+        restocked = seen & (qty > prev_qty)
+
+        # Decay every interval to its product's newest timestamp
+        end_ts = ts[last]
+        weight = np.exp2(-(end_ts[group] - ts) / self.half_life)
+        consumed = np.bincount(group, weights=np.where(usable, prev_qty - qty, 0.0) * weight)
+        elapsed = np.bincount(group, weights=np.where(usable, dt, 0.0) * weight)
+
+        had_state = np.isfinite(self.last_ts[products])
+        carry = np.where(
+            had_state,
+            np.exp2(-(end_ts - np.where(had_state, self.last_ts[products], 0.0)) / self.half_life),
+            0.0,
+        )
+        self.consumed[products] = self.consumed[products] * carry + consumed
+        self.elapsed[products] = self.elapsed[products] * carry + elapsed
+        self.last_ts[products] = end_ts
+        self.last_qty[products] = qty[last]
+        self.observations[products] += np.bincount(group)
+        self.restocks[products] += np.bincount(group, weights=restocked).astype(np.int64)
+
+    def rates_per_day(self) -> np.ndarray:
+        """Estimated consumption per day for every product id (0 if unknown)"""
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rates = np.where(self.elapsed > 0, self.consumed / self.elapsed, 0.0)
+        return rates * DAY
+
+    def held(self, history: ScanHistory) -> List[str]:
+        """Barcodes whose latest observed quantity is above zero"""
+        return [history.barcodes[i] for i in np.flatnonzero(self.last_qty > 0).tolist()]
+
+    def suggest(
+        self,
+        history: ScanHistory,
+        now: Optional[float] = None,
+        lead_days: float = LEAD_DAYS,
+        min_observations: int = MIN_OBSERVATIONS
+    ) -> List[RestockSuggestion]:
+        """
+        Products expected to run out within ``lead_days``
+
+        Returns:
+            Suggestions, soonest to run out first
+        """
+        now = time.time() if now is None else now
+        rates = self.rates_per_day()
+        since = np.where(np.isfinite(self.last_ts), now - self.last_ts, 0.0) / DAY
+        remaining = np.maximum(self.last_qty - rates * since, 0.0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            days_left = np.where(rates > 0, remaining / rates, np.inf)
+
+        candidates = np.flatnonzero(
+            (self.observations >= min_observations) & (rates > 0) & (days_left <= lead_days)
+        )
+        candidates = candidates[np.argsort(days_left[candidates], kind="stable")]
+        return [
+            RestockSuggestion(
+                barcode=history.barcodes[i],
+                rate_per_day=round(float(rates[i]), 3),
+                estimated_quantity=round(float(remaining[i]), 2),
+                days_left=round(float(days_left[i]), 1),
+                last_seen=float(self.last_ts[i]),
+            )
+            for i in candidates.tolist()
+        ]
+
+    # Persistence
+
+    def save(self, path: Union[str, Path]):
+        """Write the model state to an .npz file"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp,
+            half_life=self.half_life,
+            seq=self.seq,
+            last_ts=self.last_ts,
+            last_qty=self.last_qty,
+            consumed=self.consumed,
+            elapsed=self.elapsed,
+            observations=self.observations,
+            restocks=self.restocks,
+        )
+        tmp.replace(path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "RestockPredictor":
+        """Read a state written by save()"""
+        with np.load(path) as data:
+            predictor = cls(float(data["half_life"]) / DAY)
+            predictor.seq = int(data["seq"])
+            predictor.last_ts = data["last_ts"]
+            predictor.last_qty = data["last_qty"]
+            predictor.consumed = data["consumed"]
+            predictor.elapsed = data["elapsed"]
+            predictor.observations = data["observations"]
+            predictor.restocks = data["restocks"]
+        return predictor
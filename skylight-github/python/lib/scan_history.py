@@ -0,0 +1,246 @@
+"""
+Pantry Scan History
+===================
+
+Append-only record of what each pantry scan saw: barcode, timestamp
+and quantity on hand. Events are stored column-wise in fixed-size
+chunks so years of daily scans stay small and any suffix of the
+history can be read back as NumPy arrays without touching the rest.
+
+Directory layout:
+
+    barcodes.txt     one barcode per line; line number = product id
+    chunk-NNNNNN.bin sealed chunk (little endian):
+                         8s  magic b"SKYSCAN1"
+                         Q   event count
+                         ... uint32 product ids
+                         ... float64 timestamps (Unix seconds)
+                         ... float32 quantities
+    tail.bin         events of the chunk being filled:
+                         Q   index of that chunk
+                         ... <I d f> records
+
+Appends go to tail.bin with a single write per scan; once it holds
+CHUNK_SIZE events it is rewritten as the next sealed chunk. Torn
+writes at the end of tail.bin or barcodes.txt are dropped on open.
+
+Usage:
+    history = ScanHistory(Path.home() / ".local" / "share" / "skylight-shopping-list" / "scan-history")
+    history.append_scan({"3017620422003": 2, "5449000000996": 6})
+    events = history.events(start=last_seen)
+"""
+
+import os
+import struct
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Union
+
+import numpy as np
+
+# Events per sealed chunk
+CHUNK_SIZE = 65536
+
+MAGIC = b"SKYSCAN1"
+_CHUNK_HEADER = struct.Struct("<8sQ")
+_TAIL_HEADER = struct.Struct("<Q")
+_RECORD = struct.Struct("<Idf")
+
+
+@dataclass
+class ScanEvents:
+    """A run of events as parallel arrays"""
+    start: int
+    product_ids: np.ndarray
+    timestamps: np.ndarray
+    quantities: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.product_ids)
+
+
+class ScanHistory:
+    """
+    Append-only, chunked scan event store
+
+    Args:
+        directory: Where the history lives (created if missing)
+        chunk_size: Events per sealed chunk (fixed once data is written)
+    """
+
+    def __init__(self, directory: Union[str, Path], chunk_size: int = CHUNK_SIZE):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+
+        self.barcodes: List[str] = self._load_barcodes()
+        self._ids: Dict[str, int] = {code: i for i, code in enumerate(self.barcodes)}
+        self._barcode_file = open(self.directory / "barcodes.txt", "a", encoding="utf-8")
+
+        self._sealed = 0
+        while self._chunk_path(self._sealed).exists():
+            self._sealed += 1
+
+        self._tail_ids = array("I")
+        self._tail_ts = array("d")
+        self._tail_qty = array("f")
+        self._tail_fd = os.open(self.directory / "tail.bin", os.O_RDWR | os.O_CREAT, 0o644)
+        self._load_tail()
+
+    def _chunk_path(self, index: int) -> Path:
+        return self.directory / f"chunk-{index:06d}.bin"
+
+    def _load_barcodes(self) -> List[str]:
+        path = self.directory / "barcodes.txt"
+        if not path.exists():
+            return []
+        data = path.read_bytes()
+        complete = data[:data.rfind(b"\n") + 1]
+        if len(complete) != len(data):
+            with open(path, "r+b") as f:
+                f.truncate(len(complete))  # torn barcode line
+        return complete.decode("utf-8").splitlines()
+
+    def _load_tail(self):
+        fd = self._tail_fd
+        size = os.fstat(fd).st_size
+        if size < _TAIL_HEADER.size:
+            self._reset_tail()
+            return
+        (chunk_index,) = _TAIL_HEADER.unpack(os.pread(fd, _TAIL_HEADER.size, 0))
+        if chunk_index != self._sealed:
+            # Sealed, but the tail was not truncated before a crash
+            self._reset_tail()
+            return
+
+        count = (size - _TAIL_HEADER.size) // _RECORD.size
+        body = os.pread(fd, count * _RECORD.size, _TAIL_HEADER.size)
+        for product_id, ts, qty in _RECORD.iter_unpack(body):
+            self._tail_ids.append(product_id)
+            self._tail_ts.append(ts)
+            self._tail_qty.append(qty)
+        if size != _TAIL_HEADER.size + len(body):
+            os.ftruncate(fd, _TAIL_HEADER.size + len(body))  # torn record
+
+    def _reset_tail(self):
+        os.ftruncate(self._tail_fd, 0)
+        os.pwrite(self._tail_fd, _TAIL_HEADER.pack(self._sealed), 0)
+        del self._tail_ids[:], self._tail_ts[:], self._tail_qty[:]
+
+    def __len__(self) -> int:
+        return self._sealed * self.chunk_size + len(self._tail_ids)
+
+    def product_id(self, barcode: str) -> Optional[int]:
+        return self._ids.get(barcode)
+
+    def _intern(self, barcode: str) -> int:
+        product_id = self._ids.get(barcode)
+        if product_id is None:
+            product_id = self._ids[barcode] = len(self.barcodes)
+            self.barcodes.append(barcode)
+            # Must reach disk before any event that refers to it
+            self._barcode_file.write(barcode + "\n")
+            self._barcode_file.flush()
+        return product_id
+
+    def append_scan(self, counts: Mapping[str, float], timestamp: Optional[float] = None) -> int:
+        """
+        Record one scan
+
+        Args:
+            counts: Quantity on hand per barcode seen in the scan
+            timestamp: When the scan was taken (default now)
+
+        Returns:
+            Total number of events after the append
+        """
+        if not counts:
+            return len(self)
+        ts = time.time() if timestamp is None else float(timestamp)
+        with self._lock:
+            records = [(self._intern(code), ts, float(qty)) for code, qty in counts.items()]
+            while records:
+                room = self.chunk_size - len(self._tail_ids)
+                batch, records = records[:room], records[room:]
+                offset = _TAIL_HEADER.size + len(self._tail_ids) * _RECORD.size
+                os.pwrite(self._tail_fd, b"".join(_RECORD.pack(*r) for r in batch), offset)
+                for product_id, event_ts, qty in batch:
+                    self._tail_ids.append(product_id)
+                    self._tail_ts.append(event_ts)
+                    self._tail_qty.append(qty)
+                if len(self._tail_ids) == self.chunk_size:
+                    self._seal()
+            return len(self)
+
+    def append(self, barcode: str, quantity: float = 1.0, timestamp: Optional[float] = None) -> int:
+        """Record a single observation"""
+        return self.append_scan({barcode: quantity}, timestamp)
+
+    def _seal(self):
+        """Write the full tail out as the next columnar chunk"""
+        path = self._chunk_path(self._sealed)
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, "wb") as f:
+            f.write(_CHUNK_HEADER.pack(MAGIC, len(self._tail_ids)))
+            f.write(self._tail_ids.tobytes())
+            f.write(self._tail_ts.tobytes())
+            f.write(self._tail_qty.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        tmp.replace(path)
+        self._sealed += 1
+        self._reset_tail()
+
+    def _read_chunk(self, index: int, start: int) -> ScanEvents:
+        """Events ``start``.. of sealed chunk ``index``"""
+        data = self._chunk_path(index).read_bytes()
+        magic, count = _CHUNK_HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self._chunk_path(index)} is not a scan history chunk")
+        offset = _CHUNK_HEADER.size
+        return ScanEvents(
+            index * self.chunk_size + start,
+            np.frombuffer(data, dtype="<u4", count=count, offset=offset)[start:],
+            np.frombuffer(data, dtype="<f8", count=count, offset=offset + 4 * count)[start:],
+            np.frombuffer(data, dtype="<f4", count=count, offset=offset + 12 * count)[start:],
+        )
+
+    def events(self, start: int = 0) -> ScanEvents:
+        """
+        Every event from sequence number ``start`` on
+
+        Only the chunks holding those events are read, so callers that
+        remember how far they got pay for new events only.
+        """
+        with self._lock:
+            start = max(0, min(start, len(self)))
+            parts: List[ScanEvents] = []
+            first_chunk = start // self.chunk_size
+            for index in range(first_chunk, self._sealed):
+                parts.append(self._read_chunk(index, start - index * self.chunk_size if index == first_chunk else 0))
+            tail_start = max(0, start - self._sealed * self.chunk_size)
+            parts.append(ScanEvents(
+                self._sealed * self.chunk_size + tail_start,
+                np.frombuffer(self._tail_ids, dtype=np.uint32)[tail_start:].copy(),
+                np.frombuffer(self._tail_ts, dtype=np.float64)[tail_start:].copy(),
+                np.frombuffer(self._tail_qty, dtype=np.float32)[tail_start:].copy(),
+            ))
+
+        if len(parts) == 1:
+            return parts[0]
+        return ScanEvents(
+            start,
+            np.concatenate([p.product_ids for p in parts]),
+            np.concatenate([p.timestamps for p in parts]),
+            np.concatenate([p.quantities for p in parts]),
+        )
+
+    def close(self):
+        if self._tail_fd >= 0:
+            os.close(self._tail_fd)
+            self._tail_fd = -1
+            self._barcode_file.close()
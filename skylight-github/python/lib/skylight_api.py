@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Skylight API Client for Linux
+=============================
+
+Async client for the Skylight frame list endpoints, mirroring the
+Android (ApiService.kt) and iOS (SkylightAPIService.swift) clients:
+
+- GET  /api/frames/{frame_id}/lists
+- GET  /api/frames/{frame_id}/lists/{list_id}
+- POST /api/frames/{frame_id}/lists/{list_id}/list_items
+
+Responses are JSON:API documents; lists and items are returned as
+plain dictionaries of their attributes plus ``id``.
+
+Usage:
+    api = SkylightAPI(frame_id, auth_token, "Bearer")
+    lists = await api.get_lists()
+    await api.add_list_item(lists[0]['id'], "Milk")
+"""
+
+import aiohttp
+import time
+from typing import Optional, List, Dict, Any, Tuple
+import logging
+
+from lib.metrics import metrics
+from lib.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = "https://app.ourskylight.com"
+
+
+class SkylightAPIError(Exception):
+    """Raised when Skylight answers with a non-success status"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"HTTP {status}: {message}")
+        self.status = status
+
+
+def _flatten(resource: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON:API resource -> attributes dict with its id"""
+    return {'id': resource.get('id'), **(resource.get('attributes') or {})}
+
+
+class SkylightAPI:
+    """
+    Skylight frame client
+
+    Args:
+        frame_id: Frame whose lists are managed
+        auth_token: Token copied from the Skylight app
+        auth_type: "Bearer" or "Basic"
+        base_url: Skylight server
+        session: Shared aiohttp session (connection pool) to use instead
+            of a private one; it is left open by close()
+    """
+
+    def __init__(self, frame_id: str, auth_token: str, auth_type: str = "Bearer",
+                 base_url: str = BASE_URL, session: Optional[aiohttp.ClientSession] = None):
+        self.frame_id = frame_id
+        self.auth_token = auth_token
+        self.auth_type = auth_type
+        self.base_url = base_url
+        self.session = session
+        self._owns_session = session is None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Get or create aiohttp session"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession()
+            self._owns_session = True
+        return self.session
+
+    async def close(self):
+        """Close the session unless it is shared"""
+        if self._owns_session and self.session and not self.session.closed:
+            await self.session.close()
+
+    def _headers(self) -> Dict[str, str]:
+        return {
+            'Authorization': f"{self.auth_type} {self.auth_token}",
+            'Accept': 'application/json',
+        }
+
+    async def _request(self, method: str, endpoint: str, path: str,
+                       json_body: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        url = f"{self.base_url}/api/frames/{self.frame_id}{path}"
+        started = time.perf_counter()
+
+        with tracer.span(f"skylight.{endpoint}", frame_id=self.frame_id):
+            try:
+                session = await self._get_session()
+                async with session.request(method, url, headers=self._headers(), json=json_body) as response:
+                    metrics.counter("skylight_http_requests_total", endpoint=endpoint,
+                                    status=response.status).inc()
+                    if response.status >= 300:
+                        text = await response.text()
+                        logger.error(f"HTTP {response.status} for {method} {path} on frame {self.frame_id}")
+                        raise SkylightAPIError(response.status, text[:200])
+                    return await response.json()
+
+            except aiohttp.ClientError as e:
+                metrics.counter("skylight_http_requests_total", endpoint=endpoint, status="error").inc()
+                logger.error(f"Network error for {method} {path} on frame {self.frame_id}: {e}")
+                raise
+            finally:
+                metrics.histogram("skylight_http_request_seconds", endpoint=endpoint).observe(
+                    time.perf_counter() - started
+                )
+
+    async def get_lists(self) -> List[Dict[str, Any]]:
+        """
+        Lists on the frame
+
+        Returns:
+            One dict per list (id, label, kind, default_grocery_list)
+
+        Raises:
+            SkylightAPIError: Non-success response
+            aiohttp.ClientError: Network error
+        """
+        data = await self._request("GET", "lists", "/lists")
+        return [_flatten(r) for r in data.get('data', [])]
+
+    async def get_list(self, list_id: str) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        A list and its items
+
+        Returns:
+            (list, items) with items as dicts (id, label, status, section, position)
+        """
+        data = await self._request("GET", "list_detail", f"/lists/{list_id}")
+        items = [_flatten(r) for r in data.get('included') or [] if r.get('type') == 'list_item']
+        return _flatten(data.get('data') or {}), items
+
+    async def get_grocery_list(self) -> Optional[Dict[str, Any]]:
+        """The frame's default grocery list, or its first list"""
+        lists = await self.get_lists()
+        for entry in lists:
+            if entry.get('default_grocery_list'):
+                return entry
+        return lists[0] if lists else None
+
+    async def add_list_item(self, list_id: str, label: str,
+                            section: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Add an item to a list
+
+        Returns:
+            The created item
+        """
+        body: Dict[str, Any] = {'label': label}
+        if section:
+            body['section'] = section
+        data = await self._request("POST", "add_list_item", f"/lists/{list_id}/list_items", body)
+        return _flatten(data.get('data') or {})
@@ -0,0 +1,239 @@
+"""
+Span Tracing
+============
+
+Parent/child spans for the scan-to-list pipeline, exported as Chrome
+trace JSON that opens in chrome://tracing or https://ui.perfetto.dev
+as a flame timeline.
+
+The current span lives in a contextvar, so asyncio tasks inherit it
+automatically. Threads and GLib callbacks do not; wrap their targets
+with tracer.wrap() to carry the span across:
+
+    with tracer.span("sync"):
+        threading.Thread(target=tracer.wrap(sync_thread)).start()
+
+    GLib.idle_add(tracer.wrap(self.on_scan_complete), items)
+
+A span only measures what runs inside its ``with`` block, so a root
+span for work handed to a thread belongs in that thread (as the scan
+pipeline in main.py does), not around ``Thread.start()``.
+
+Spans whose parent ran on another thread are linked with flow arrows.
+Spans opened inside asyncio tasks are exported as async events, since
+concurrent requests overlap on the same thread.
+
+Tracing is off unless SKYLIGHT_TRACE=<path.json> is set or enable() is
+called; disabled spans are a shared no-op context manager.
+"""
+
+import asyncio
+import contextvars
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, List, Optional, Union
+
+# Finished spans kept in memory before the oldest are dropped
+MAX_SPANS = 100_000
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar(
+    "skylight_current_span", default=None
+)
+
+
+@dataclass
+class Span:
+    """A timed operation with an optional parent"""
+    name: str
+    span_id: int
+    parent: Optional["Span"] = None
+    start_ns: int = 0
+    end_ns: int = 0
+    thread_id: int = 0
+    thread_name: str = ""
+    in_task: bool = False
+    args: Dict[str, Any] = field(default_factory=dict)
+
+    def set(self, **args: Any):
+        """Attach attributes shown in the trace viewer"""
+        self.args.update(args)
+
+
+class _ActiveSpan:
+    """Context manager that records a span on exit"""
+    __slots__ = ("tracer", "span", "token")
+
+    def __init__(self, tracer: "Tracer", span: Span):
+        self.tracer = tracer
+        self.span = span
+
+    def __enter__(self) -> Span:
+        self.token = _current_span.set(self.span)
+        self.span.start_ns = time.perf_counter_ns()
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.end_ns = time.perf_counter_ns()
+        if exc_type is not None:
+            self.span.args["error"] = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self.token)
+        self.tracer._finished.append(self.span)
+        return False
+
+
+class _NoopSpan:
+    """Stand-in used while tracing is disabled"""
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args: Any):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """
+    Collects spans and exports them as a Chrome trace
+
+    Args:
+        enabled: Record spans; when False span() is a no-op
+        max_spans: Finished spans retained in memory
+    """
+
+    def __init__(self, enabled: bool = False, max_spans: int = MAX_SPANS):
+        self.enabled = enabled
+        self._finished: Deque[Span] = deque(maxlen=max_spans)
+        self._ids = itertools.count(1)
+        self._origin_ns = time.perf_counter_ns()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        self._finished.clear()
+
+    def span(self, name: str, **args: Any) -> Union[_ActiveSpan, _NoopSpan]:
+        """Start a child of the current span"""
+        if not self.enabled:
+            return _NOOP_SPAN
+        thread = threading.current_thread()
+        try:
+            in_task = asyncio.current_task() is not None
+        except RuntimeError:
+            in_task = False
+        return _ActiveSpan(self, Span(
+            name=name,
+            span_id=next(self._ids),
+            parent=_current_span.get(),
+            thread_id=thread.ident or 0,
+            thread_name=thread.name,
+            in_task=in_task,
+            args=args,
+        ))
+
+    def current(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def wrap(self, fn: Callable[..., Any]) -> Callable[..., Any]:
+        """Bind ``fn`` to the caller's context so spans it opens get the current parent"""
+        if not self.enabled:
+            return fn
+        context = contextvars.copy_context()
+
+        @functools.wraps(fn)
+        def run(*args, **kwargs):
+            return context.copy().run(fn, *args, **kwargs)
+
+        return run
+
+    # Export
+
+    def to_chrome_trace(self) -> Dict[str, Any]:
+        """Build a Chrome trace event document from the finished spans"""
+        pid = os.getpid()
+        spans: List[Span] = list(self._finished)
+        events: List[Dict[str, Any]] = []
+        threads: Dict[int, str] = {}
+
+        def us(ns: int) -> float:
+            return (ns - self._origin_ns) / 1000
+
+        for span in spans:
+            threads[span.thread_id] = span.thread_name
+            args = dict(span.args, span_id=span.span_id)
+            if span.parent is not None:
+                args["parent_id"] = span.parent.span_id
+            cat = span.name.split(".", 1)[0]
+            if span.in_task:
+                # Concurrent tasks overlap on one thread; async events get their own tracks
+                events.append({
+                    "name": span.name, "cat": cat, "ph": "b", "id": span.span_id,
+                    "ts": us(span.start_ns), "pid": pid, "tid": span.thread_id, "args": args,
+                })
+                events.append({
+                    "name": span.name, "cat": cat, "ph": "e", "id": span.span_id,
+                    "ts": us(span.end_ns), "pid": pid, "tid": span.thread_id,
+                })
+            else:
+                events.append({
+                    "name": span.name,
+                    "cat": cat,
+                    "ph": "X",
+                    "ts": us(span.start_ns),
+                    "dur": (span.end_ns - span.start_ns) / 1000,
+                    "pid": pid,
+                    "tid": span.thread_id,
+                    "args": args,
+                })
+
+            # Cross-thread parent: draw a flow arrow from parent to child
+            parent = span.parent
+            if parent is not None and parent.thread_id != span.thread_id:
+                events.append({
+                    "name": "handoff", "cat": "flow", "ph": "s", "id": span.span_id,
+                    "ts": us(parent.start_ns), "pid": pid, "tid": parent.thread_id,
+                })
+                events.append({
+                    "name": "handoff", "cat": "flow", "ph": "f", "bp": "e", "id": span.span_id,
+                    "ts": us(span.start_ns), "pid": pid, "tid": span.thread_id,
+                })
+
+        for tid, name in threads.items():
+            events.append({
+                "name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                "args": {"name": name},
+            })
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path: Union[str, Path]):
+        """Write the finished spans to a Chrome trace / Perfetto JSON file"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        tmp.write_text(json.dumps(self.to_chrome_trace()))
+        tmp.replace(path)
+
+
+# Where to write the trace on exit, if tracing was requested
+TRACE_FILE = os.environ.get("SKYLIGHT_TRACE")
+
+# Process-wide tracer
+tracer = Tracer(enabled=bool(TRACE_FILE))
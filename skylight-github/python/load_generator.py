@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+OpenFoodFacts Load Generator
+============================
+
+Drives OpenFoodFactsAPI.get_product at a fixed request rate (open loop,
+so a slow server does not slow down the arrival rate) and reports the
+achieved throughput, latency percentiles and error behaviour.
+
+By default an in-process stand-in from mock_servers is started, which
+also lets the report include the HTTP statuses the server returned.
+
+Usage:
+    python load_generator.py --rate 200 --duration 10 --latency-ms 30
+    python load_generator.py --base-url http://127.0.0.1:8080 --rate 50
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from lib.metrics import percentile
+from lib.openfoodfacts_api import OpenFoodFactsAPI
+from mock_servers import add_config_arguments, config_from_args, load_products, start_mock_server
+
+
+@dataclass
+class LoadReport:
+    """Outcome of a load run"""
+    target_rate: float
+    duration: float
+    latencies: List[float] = field(default_factory=list)
+    outcomes: Counter = field(default_factory=Counter)
+    server_statuses: Optional[Dict[str, Dict[str, int]]] = None
+    wall_time: float = 0.0
+
+    def percentile(self, pct: float) -> float:
+        """Nearest-rank latency percentile in milliseconds"""
+        return percentile(self.latencies, pct) * 1000
+
+    def to_dict(self) -> Dict[str, object]:
+        completed = sum(c for k, c in self.outcomes.items() if k != 'dropped')
+        return {
+            'target_rate': self.target_rate,
+            'achieved_rate': completed / self.wall_time if self.wall_time else 0.0,
+            'requests': completed,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'outcomes': dict(self.outcomes),
+            'server_statuses': self.server_statuses,
+        }
+
+
+async def generate_load(
+    api: OpenFoodFactsAPI,
+    barcodes: List[str],
+    rate: float,
+    duration: float,
+    max_in_flight: int = 1000
+) -> LoadReport:
+    """
+    Issue get_product calls at ``rate`` per second for ``duration`` seconds
+
+    Requests that would exceed ``max_in_flight`` are counted as
+    ``dropped`` rather than queued, so an overloaded client shows up in
+    the report instead of silently lowering the rate.
+    """
+    report = LoadReport(target_rate=rate, duration=duration)
+    in_flight = set()
+    clock = time.perf_counter
+
+    async def one(barcode: str):
+        t0 = clock()
+        try:
+            product = await api.get_product(barcode)
+            report.outcomes['found' if product else 'none'] += 1
+        except Exception as e:
+            report.outcomes[f'error:{type(e).__name__}'] += 1
+        report.latencies.append(clock() - t0)
+
+    total = int(rate * duration)
+    start = clock()
+    for i in range(total):
+        delay = start + i / rate - clock()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(in_flight) >= max_in_flight:
+            report.outcomes['dropped'] += 1
+            continue
+        task = asyncio.create_task(one(barcodes[i % len(barcodes)]))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+    if in_flight:
+        await asyncio.gather(*in_flight)
+    report.wall_time = clock() - start
+    return report
+
+
+async def run(args: argparse.Namespace) -> LoadReport:
+    runner = None
+    base_url = args.base_url
+    if base_url is None:
+        runner, base_url = await start_mock_server(config_from_args(args))
+
+    rng = random.Random(args.seed)
+    known = [p['code'] for p in load_products() if p.get('product_name')]
+    barcodes = [
+        rng.choice(known) if rng.random() < args.known_ratio else str(rng.randrange(10**12, 10**13))
+        for _ in range(max(1, args.unique))
+    ]
+
+    api = OpenFoodFactsAPI(base_url=base_url)
+    try:
+        report = await generate_load(api, barcodes, args.rate, args.duration, args.max_in_flight)
+    finally:
+        await api.close()
+        if runner is not None:
+            report_stats = runner.app['stats'].to_dict()
+            await runner.cleanup()
+
+    if runner is not None:
+        report.server_statuses = report_stats
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Drive OpenFoodFactsAPI at a fixed request rate")
+    parser.add_argument("--base-url", help="target server (default: start an in-process stand-in)")
+    parser.add_argument("--rate", type=float, default=100.0, help="requests per second")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds")
+    parser.add_argument("--unique", type=int, default=500, help="distinct barcodes to cycle through")
+    parser.add_argument("--known-ratio", type=float, default=0.8,
+                        help="fraction of barcodes taken from the fixtures")
+    parser.add_argument("--max-in-flight", type=int, default=1000)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+    # Errors are tallied in the report instead of logged one by one
+    logging.getLogger("lib.openfoodfacts_api").setLevel(logging.CRITICAL)
+
+    report = asyncio.run(run(args)).to_dict()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+
+    print(f"Target rate:   {report['target_rate']:.1f} req/s")
+    print(f"Achieved rate: {report['achieved_rate']:.1f} req/s ({report['requests']} requests)")
+    print(f"Latency:       p50 {report['p50_ms']:.1f} ms  p95 {report['p95_ms']:.1f} ms  p99 {report['p99_ms']:.1f} ms")
+    print("Outcomes:")
+    for outcome, count in sorted(report['outcomes'].items()):
+        print(f"  {outcome:<24}{count}")
+    if report['server_statuses']:
+        print("Server responses:")
+        for route, statuses in report['server_statuses'].items():
+            print(f"  {route}: " + ", ".join(f"{s}={c}" for s, c in statuses.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+Shared Local Lookup Service
+===========================
+
+Optional aiohttp server that lets every client in the household (Linux,
+Android, iOS, Windows) share one warm product cache and one set of
+OpenFoodFacts rate limits. The product and search routes answer in the
+OpenFoodFacts response format, so clients only need their base URL
+pointed at the service.
+
+Routes:
+- GET  /api/v2/product/{barcode}       cached lookup (OFF format)
+- POST /api/v2/products                batch lookup, {"barcodes": [...]}
+- GET  /cgi/search.pl?search_terms=    confident fuzzy matches among cached
+                                       products, topped up from OFF when they
+                                       do not fill the page
+- GET  /thumbnails/{barcode}.jpg       front image thumbnail (?size=200)
+- GET  /metrics                        Prometheus text, per-client counters
+- GET  /healthz
+
+Concurrent requests for the same barcode, query or thumbnail are
+coalesced into one upstream call. Clients identify themselves with an
+``X-Skylight-Client`` header (e.g. "android-kitchen"); otherwise their
+address is used. Only the first MAX_CLIENT_LABELS clients get their own
+metrics label; later ones are counted as "other".
+
+Usage:
+    python lookup_service.py --host 0.0.0.0 --port 8765
+
+    # or alongside the daemon
+    python skylight_cli.py daemon --listen 0.0.0.0:8765
+"""
+
+import argparse
+import asyncio
+import io
+import logging
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+from aiohttp import web
+
+from lib.openfoodfacts_api import OFFProduct, OpenFoodFactsAPI
+from lib.product_codec import ProductCache, NUTRIMENT_FIELDS, STRING_FIELDS
+from lib.barcode_index import BarcodeIndex
+from lib.fuzzy_matcher import FuzzyMatcher
+from lib.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = Path.home() / ".cache" / "skylight-shopping-list"
+
+# Upper bound on barcodes accepted by one batch request
+MAX_BATCH = 500
+
+DEFAULT_THUMBNAIL_SIZE = 200
+MAX_THUMBNAIL_SIZE = 800
+
+# Cached products matching a search below this confidence are left to OFF
+SEARCH_MIN_SCORE = 0.6
+
+# Distinct client names kept as metrics labels
+MAX_CLIENT_LABELS = 32
+MAX_CLIENT_NAME = 64
+
+# OFF spells a few nutriment keys with hyphens (see OFFNutriments.from_dict)
+_OFF_NUTRIMENT_KEYS = {
+    'energy_kcal_100g': 'energy-kcal_100g',
+    'saturated_fat_100g': 'saturated-fat_100g',
+}
+
+
+def product_payload(product: OFFProduct) -> Dict[str, Any]:
+    """Inverse of OFFProduct.from_dict, omitting missing fields"""
+    data: Dict[str, Any] = {'code': product.code}
+    for name in STRING_FIELDS:
+        value = getattr(product, name)
+        if value is not None:
+            data[name] = value
+    if product.nova_group is not None:
+        data['nova_group'] = product.nova_group
+    if product.nutriments is not None:
+        data['nutriments'] = {
+            _OFF_NUTRIMENT_KEYS.get(name, name): getattr(product.nutriments, name)
+            for name in NUTRIMENT_FIELDS
+            if getattr(product.nutriments, name) is not None
+        }
+    return data
+
+
+class Coalescer:
+    """
+    Shares one in-flight call among concurrent callers with the same key
+
+    Callers that arrive while a call is running await its result instead
+    of starting their own; a caller being cancelled does not cancel the
+    shared call.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Any, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def run(self, key: Any, factory: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._inflight.get(key)
+        if future is not None:
+            metrics.counter("service_coalesced_total", kind=self.name).inc()
+            return await asyncio.shield(future)
+
+        future = asyncio.ensure_future(factory())
+        self._inflight[key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+
+class LookupService:
+    """
+    Request handlers backed by an OpenFoodFactsAPI with a product cache
+
+    Args:
+        api: Client used for cache misses; its ``cache`` is shared
+        thumbnail_dir: Where rendered thumbnails are kept
+    """
+
+    def __init__(self, api: OpenFoodFactsAPI, thumbnail_dir: Path):
+        if api.cache is None:
+            raise ValueError("the lookup service needs an API with a product cache")
+        self.api = api
+        self.cache: ProductCache = api.cache
+        self.thumbnail_dir = thumbnail_dir
+        self.thumbnail_dir.mkdir(parents=True, exist_ok=True)
+        self._products = Coalescer("product")
+        self._searches = Coalescer("search")
+        self._thumbnails = Coalescer("thumbnail")
+        self._matcher: Optional[FuzzyMatcher] = None
+        self._matcher_lock = asyncio.Lock()
+
+    # Lookups
+
+    async def lookup(self, barcode: str) -> Optional[OFFProduct]:
+        """Cached product, fetching (once) on a miss"""
+        cached = self.cache.get(barcode)
+        if cached is not None:
+            return cached
+        return await self._products.run(barcode, lambda: self.api.get_product(barcode))
+
+    async def handle_product(self, request: web.Request) -> web.Response:
+        barcode = request.match_info['barcode']
+        try:
+            product = await self.lookup(barcode)
+        except asyncio.TimeoutError:
+            return web.json_response({'status': 0, 'code': barcode, 'status_verbose': "upstream timeout"},
+                                     status=504)
+        except aiohttp.ClientError as e:
+            return web.json_response({'status': 0, 'code': barcode, 'status_verbose': f"upstream error: {e}"},
+                                     status=502)
+        if product is None:
+            return web.json_response({'status': 0, 'code': barcode, 'status_verbose': "product not found"})
+        return web.json_response({'status': 1, 'code': barcode, 'product': product_payload(product)})
+
+    async def handle_batch(self, request: web.Request) -> web.Response:
+        try:
+            body = await request.json()
+            barcodes = [str(b) for b in body['barcodes']]
+        except (ValueError, KeyError, TypeError):
+            return web.json_response({'error': 'expected {"barcodes": [...]}'}, status=400)
+        if len(barcodes) > MAX_BATCH:
+            return web.json_response({'error': f"at most {MAX_BATCH} barcodes per batch"}, status=413)
+
+        unique = list(dict.fromkeys(barcodes))
+        results = await asyncio.gather(*(self.lookup(b) for b in unique), return_exceptions=True)
+        products: Dict[str, Optional[Dict[str, Any]]] = {}
+        for barcode, result in zip(unique, results):
+            if isinstance(result, BaseException):
+                logger.warning(f"Batch lookup of {barcode} failed: {result}")
+                result = None
+            products[barcode] = product_payload(result) if result is not None else None
+        return web.json_response({'products': products})
+
+    # Search
+
+    async def _get_matcher(self) -> FuzzyMatcher:
+        """Fuzzy index over the cache: built once off the loop, then extended with new products"""
+        async with self._matcher_lock:
+            if self._matcher is None:
+                loop = asyncio.get_running_loop()
+                self._matcher = await loop.run_in_executor(None, FuzzyMatcher.from_product_cache, self.cache)
+            else:
+                self._matcher.add_from_cache(self.cache)
+            return self._matcher
+
+    async def search(self, query: str, page_size: int) -> Tuple[str, List[OFFProduct]]:
+        """
+        (source, products): confident local matches first, then OFF results
+
+        OFF is only asked when the cache has fewer than ``page_size``
+        matches scoring SEARCH_MIN_SCORE or more. The source is "local"
+        or "remote" when every product came from one side, else "mixed".
+        """
+        matcher = await self._get_matcher()
+        matches = matcher.match(query, k=page_size, min_score=SEARCH_MIN_SCORE)
+        local = [p for p in (self.cache.get(m.code) for m in matches) if p is not None]
+        if len(local) >= page_size:
+            return "local", local
+
+        async def remote() -> List[OFFProduct]:
+            found = await self.api.search_products(query, page_size=page_size)
+            for product in found:
+                if product.code:
+                    self.cache.put(product)
+            return found
+
+        found = await self._searches.run((query.lower(), page_size), remote)
+        seen = {p.code for p in local}
+        extra = []
+        for product in found:
+            if len(local) + len(extra) == page_size:
+                break
+            if product.code not in seen:
+                seen.add(product.code)
+                extra.append(product)
+        if not local:
+            return "remote", extra
+        return ("mixed" if extra else "local"), local + extra
+
+    async def handle_search(self, request: web.Request) -> web.Response:
+        query = request.query.get('search_terms', '').strip()
+        if not query:
+            return web.json_response({'error': "search_terms is required"}, status=400)
+        try:
+            page_size = max(1, min(100, int(request.query.get('page_size', 20))))
+        except ValueError:
+            return web.json_response({'error': "page_size must be an integer"}, status=400)
+
+        source, products = await self.search(query, page_size)
+        metrics.counter("service_search_total", source=source).inc()
+        return web.json_response({
+            'count': len(products),
+            'page': 1,
+            'page_size': page_size,
+            'products': [product_payload(p) for p in products],
+        })
+
+    # Thumbnails
+
+    async def thumbnail(self, barcode: str, size: int) -> Optional[Path]:
+        path = self.thumbnail_dir / f"{barcode}-{size}.jpg"
+        if path.exists():
+            return path
+
+        async def render() -> Optional[Path]:
+            product = await self.lookup(barcode)
+            image_url = product and (product.image_front_url or product.image_url)
+            if not image_url:
+                return None
+            data = await self.api.download_image(image_url)
+            if data is None:
+                return None
+            loop = asyncio.get_running_loop()
+            if not await loop.run_in_executor(None, _write_thumbnail, data, size, path):
+                return None
+            return path
+
+        return await self._thumbnails.run((barcode, size), render)
+
+    async def handle_thumbnail(self, request: web.Request) -> web.StreamResponse:
+        try:
+            size = max(16, min(MAX_THUMBNAIL_SIZE, int(request.query.get('size', DEFAULT_THUMBNAIL_SIZE))))
+        except ValueError:
+            return web.json_response({'error': "size must be an integer"}, status=400)
+        path = await self.thumbnail(request.match_info['barcode'], size)
+        if path is None:
+            return web.json_response({'error': "no image for this product"}, status=404)
+        return web.FileResponse(path, headers={'Content-Type': 'image/jpeg', 'Cache-Control': 'max-age=86400'})
+
+    # Operations
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        metrics.gauge("service_cached_products").set(len(self.cache))
+        metrics.gauge("service_inflight", kind="product").set(len(self._products))
+        return web.Response(text=metrics.render_prometheus(), content_type="text/plain")
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({'status': "ok", 'cached_products': len(self.cache)})
+
+
+def _write_thumbnail(data: bytes, size: int, path: Path) -> bool:
+    """
+    Downscale to fit ``size`` px and write a JPEG (original bytes without Pillow)
+
+    Returns:
+        False when the image cannot be decoded
+    """
+    tmp = path.with_suffix(".tmp")
+    try:
+        try:
+            from PIL import Image
+        except ImportError:
+            tmp.write_bytes(data)
+        else:
+            with Image.open(io.BytesIO(data)) as image:
+                image = image.convert("RGB")
+                image.thumbnail((size, size))
+                image.save(tmp, "JPEG", quality=85)
+        tmp.replace(path)
+        return True
+    except (OSError, ValueError) as e:
+        # UnidentifiedImageError is an OSError, DecompressionBombError a ValueError
+        logger.warning(f"Cannot render thumbnail {path.name}: {e}")
+        return False
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+_client_labels: set = set()
+
+
+def client_label(request: web.Request) -> str:
+    """Metrics label for the caller, bounded to MAX_CLIENT_LABELS distinct values"""
+    client = (request.headers.get('X-Skylight-Client') or request.remote or "unknown")[:MAX_CLIENT_NAME]
+    if client not in _client_labels:
+        if len(_client_labels) >= MAX_CLIENT_LABELS:
+            return "other"
+        _client_labels.add(client)
+    return client
+
+
+@web.middleware
+async def client_metrics(request: web.Request, handler):
+    """Count requests and latency per client and route"""
+    client = client_label(request)
+    route = request.match_info.route.name or "unknown"
+    started = time.perf_counter()
+    status: Any = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        metrics.counter("service_requests_total", client=client, route=route, status=status).inc()
+        metrics.histogram("service_request_seconds", route=route).observe(time.perf_counter() - started)
+
+
+def build_service_app(api: OpenFoodFactsAPI, thumbnail_dir: Path = CACHE_DIR / "thumbnails") -> web.Application:
+    """
+    Create the service application
+
+    Args:
+        api: OpenFoodFactsAPI with a product cache; shared with the caller
+        thumbnail_dir: Where rendered thumbnails are kept
+
+    Returns:
+        aiohttp application; its LookupService is available as app['service']
+    """
+    service = LookupService(api, thumbnail_dir)
+    app = web.Application(middlewares=[client_metrics])
+    app['service'] = service
+    app.router.add_get("/api/v2/product/{barcode}", service.handle_product, name="product")
+    app.router.add_post("/api/v2/products", service.handle_batch, name="batch")
+    app.router.add_get("/cgi/search.pl", service.handle_search, name="search")
+    app.router.add_get("/thumbnails/{barcode}.jpg", service.handle_thumbnail, name="thumbnail")
+    app.router.add_get("/metrics", service.handle_metrics, name="metrics")
+    app.router.add_get("/healthz", service.handle_health, name="health")
+    return app
+
+
+async def start_lookup_service(
+    api: OpenFoodFactsAPI,
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    thumbnail_dir: Path = CACHE_DIR / "thumbnails"
+) -> Tuple[web.AppRunner, str]:
+    """
+    Start the service in the running event loop
+
+    Returns:
+        The runner (call ``cleanup()`` when done) and the base URL
+    """
+    # Per-client counters are the point of /metrics, so always record them
+    metrics.enable()
+    runner = web.AppRunner(build_service_app(api, thumbnail_dir), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = runner.addresses[0][1]
+    return runner, f"http://{host}:{bound_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve cached product lookups to household clients")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cache-dir", type=Path, default=CACHE_DIR)
+    parser.add_argument("--max-age", type=float, help="seconds before cached products are refetched")
+    parser.add_argument("--off-url", help="OpenFoodFacts server (default: the public one)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    metrics.enable()
+
+    index_path = args.cache_dir / "barcodes.idx"
+    api_args: Dict[str, Any] = {
+        'cache': ProductCache(args.cache_dir / "products.bin", max_age=args.max_age),
+        'barcode_index': BarcodeIndex.open(index_path) if index_path.exists() else None,
+    }
+    if args.off_url:
+        api_args['base_url'] = args.off_url
+    api = OpenFoodFactsAPI(**api_args)
+
+    async def close_api(app: web.Application):
+        await api.close()
+        api.cache.close()
+        if api.barcode_index is not None:
+            api.barcode_index.close()
+
+    app = build_service_app(api, args.cache_dir / "thumbnails")
+    app.on_cleanup.append(close_api)
+    web.run_app(app, host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -20,22 +20,81 @@ from gi.repository import Gtk, Adw, GLib, Gio, GdkPixbuf
 import sys
 import os
 import json
+import asyncio
 import requests
 from pathlib import Path
-from typing import Optional, List, Dict
+from typing import Any, Callable, Optional, List, Dict
 import threading
+import time
 
 # Import local modules
 from lib.skylight_api import SkylightAPI
+from lib.frame_sync import FrameConfig, FrameSyncer, load_frames, queue_items, remove_frame, upsert_frame
 from lib.openfoodfacts_api import OpenFoodFactsAPI
 from lib.camera_scanner import CameraScanner
 from lib.barcode_scanner import BarcodeScanner
 from lib.pantry_manager import PantryManager
+from lib.product_codec import ProductCache
+from lib.barcode_index import BarcodeIndex
+from lib.fuzzy_matcher import FuzzyMatch, FuzzyMatcher
+from lib.scan_history import ScanHistory
+from lib.restock import RestockPredictor, RestockSuggestion
+from lib.metrics import LONG_BUCKETS, metrics
+from lib.tracing import tracer, TRACE_FILE
 
 APP_ID = "com.skylight.shoppinglist"
 APP_NAME = "Skylight Shopping List"
 VERSION = "1.0.0"
 
+CACHE_DIR = Path.home() / ".cache" / "skylight-shopping-list"
+AUTH_FILE = Path.home() / ".config" / "skylight-shopping-list" / "auth.json"
+HISTORY_DIR = Path.home() / ".local" / "share" / "skylight-shopping-list" / "scan-history"
+RESTOCK_MODEL_PATH = HISTORY_DIR / "restock.npz"
+
+# Best matches below this confidence are not recorded as pantry scans
+SCAN_RECORD_MIN_SCORE = 0.6
+
+# Optional index of known OFF barcodes (see python -m lib.barcode_index build)
+BARCODE_INDEX_PATH = CACHE_DIR / "barcodes.idx"
+
+# Where to write a metrics snapshot on exit (.json or Prometheus text)
+METRICS_FILE = os.environ.get("SKYLIGHT_METRICS_FILE")
+
+
+class MainLoopStallMonitor:
+    """
+    Detects GTK main loop stalls
+    
+    A heartbeat is scheduled every ``interval_ms``; when it fires late
+    the main loop was blocked for the difference.
+    """
+    
+    def __init__(self, interval_ms: int = 100, stall_threshold_ms: int = 50):
+        self.interval = interval_ms / 1000
+        self.stall_threshold = stall_threshold_ms / 1000
+        self.interval_ms = interval_ms
+        self.last_tick = None
+        self.source_id = None
+    
+    def start(self):
+        self.last_tick = time.monotonic()
+        self.source_id = GLib.timeout_add(self.interval_ms, self.on_tick)
+    
+    def stop(self):
+        if self.source_id is not None:
+            GLib.source_remove(self.source_id)
+            self.source_id = None
+    
+    def on_tick(self) -> bool:
+        now = time.monotonic()
+        lag = max(0.0, now - self.last_tick - self.interval)
+        self.last_tick = now
+        metrics.histogram("gtk_main_loop_lag_seconds").observe(lag)
+        if lag >= self.stall_threshold:
+            metrics.counter("gtk_main_loop_stalls_total").inc()
+        return GLib.SOURCE_CONTINUE
+
+
 class SkylightShoppingListApp(Adw.Application):
     """Main application class"""
     
@@ -46,22 +105,140 @@ class SkylightShoppingListApp(Adw.Application):
         )
         
         # Services
-        self.skylight_api: Optional[SkylightAPI] = None
-        self.openfoodfacts_api = OpenFoodFactsAPI()
+        self.skylight_api: Optional[SkylightAPI] = None  # active frame
+        self.active_frame: Optional[str] = None
+        self.frames: Dict[str, SkylightAPI] = {}
+        self.openfoodfacts_api = OpenFoodFactsAPI(
+            cache=ProductCache(CACHE_DIR / "products.bin"),
+            barcode_index=BarcodeIndex.open(BARCODE_INDEX_PATH) if BARCODE_INDEX_PATH.exists() else None
+        )
         self.camera_scanner = CameraScanner()
         self.barcode_scanner = BarcodeScanner()
         self.pantry_manager = PantryManager()
         
+        # Name -> product matching over the local product cache
+        self.fuzzy_matcher: Optional[FuzzyMatcher] = None
+        self.fuzzy_matcher_lock = threading.RLock()
+        
+        # Pantry scan history and the restock model built from it
+        self.scan_history = ScanHistory(HISTORY_DIR)
+        self.restock_predictor = (
+            RestockPredictor.load(RESTOCK_MODEL_PATH) if RESTOCK_MODEL_PATH.exists() else RestockPredictor()
+        )
+        
         # State
         self.is_authenticated = False
         self.current_list = None
         
+        # One frame sync at a time; a second would resend the outbox being pushed
+        self.sync_lock = threading.Lock()
+        
+        # Diagnostics
+        self.stall_monitor = MainLoopStallMonitor() if metrics.enabled else None
+        
     def do_activate(self):
         """Called when the application is activated"""
         win = self.props.active_window
         if not win:
             win = MainWindow(application=self)
+            if self.stall_monitor:
+                self.stall_monitor.start()
+            # Index the product cache before the first scan needs it
+            threading.Thread(target=self.refresh_fuzzy_matcher, daemon=True).start()
         win.present()
+    
+    def set_active_frame(self, name: Optional[str]):
+        """Make ``name`` the frame scans and suggestions go to (None: no frame)"""
+        self.active_frame = name
+        self.skylight_api = self.frames[name] if name is not None else None
+        self.is_authenticated = name is not None
+    
+    def match_scanned_items(self, items: List[str]) -> List[List[FuzzyMatch]]:
+        """Match detected item names to cached products (top 3 each)"""
+        with self.fuzzy_matcher_lock:
+            return self.refresh_fuzzy_matcher().match_many(items, k=3)
+    
+    def refresh_fuzzy_matcher(self) -> FuzzyMatcher:
+        """Build the matcher once, then index only products cached since"""
+        with self.fuzzy_matcher_lock:
+            cache = self.openfoodfacts_api.cache
+            if self.fuzzy_matcher is None:
+                self.fuzzy_matcher = FuzzyMatcher.from_product_cache(cache)
+            else:
+                self.fuzzy_matcher.add_from_cache(cache)
+            return self.fuzzy_matcher
+    
+    def record_scan(self, matches: List[List[FuzzyMatch]], full_pantry: bool = False) -> List[RestockSuggestion]:
+        """
+        Record what a pantry scan saw and return restock suggestions
+        
+        Each confidently matched item counts as one unit of its product.
+        Only when the user marked the photo as showing the whole pantry
+        are products held at the previous scan but missing from this one
+        recorded as 0 (run out); a photo of one shelf says nothing about
+        the rest. Only events since the last scan are folded into the model.
+        """
+        counts: Dict[str, float] = {}
+        for candidates in matches:
+            if candidates and candidates[0].score >= SCAN_RECORD_MIN_SCORE:
+                code = candidates[0].code
+                counts[code] = counts.get(code, 0.0) + 1
+        if full_pantry and counts:
+            # A scan that recognised nothing says more about the photo than the pantry
+            self.restock_predictor.update(self.scan_history)
+            for code in self.restock_predictor.held(self.scan_history):
+                counts.setdefault(code, 0.0)
+        self.scan_history.append_scan(counts)
+        self.restock_predictor.update(self.scan_history)
+        return self.restock_predictor.suggest(self.scan_history)
+    
+    def sync_active_frame(self, on_done: Callable[[Dict[str, Any]], None]):
+        """
+        Sync the active frame (outbox, then list mirror) in the background
+        
+        ``on_done`` gets the FrameSyncer result on the main loop.
+        """
+        name = self.active_frame
+        
+        async def sync(frames: List[FrameConfig]) -> Dict[str, Any]:
+            async with FrameSyncer(frames, CACHE_DIR) as syncer:
+                return await syncer.sync(name)
+        
+        def sync_thread():
+            with self.sync_lock:
+                try:
+                    frames = [f for f in load_frames(AUTH_FILE) if f.name == name]
+                    if frames:
+                        result = asyncio.run(sync(frames))
+                    else:
+                        result = {'frame': name, 'status': "error", 'error': "frame is no longer configured"}
+                except (OSError, ValueError) as e:
+                    result = {'frame': name, 'status': "error", 'error': str(e)}
+            GLib.idle_add(on_done, result)
+        
+        threading.Thread(target=tracer.wrap(sync_thread), daemon=True).start()
+    
+    def do_shutdown(self):
+        """Called when the application exits"""
+        if self.stall_monitor:
+            self.stall_monitor.stop()
+        try:
+            self.restock_predictor.update(self.scan_history)
+            self.restock_predictor.save(RESTOCK_MODEL_PATH)
+        except OSError as e:
+            print(f"Failed to save restock model: {e}")
+        self.scan_history.close()
+        if metrics.enabled and METRICS_FILE:
+            try:
+                metrics.write(METRICS_FILE)
+            except OSError as e:
+                print(f"Failed to write metrics: {e}")
+        if tracer.enabled and TRACE_FILE:
+            try:
+                tracer.export_chrome_trace(TRACE_FILE)
+            except OSError as e:
+                print(f"Failed to write trace: {e}")
+        Adw.Application.do_shutdown(self)
 
 
 class MainWindow(Adw.ApplicationWindow):
@@ -84,23 +261,22 @@ class MainWindow(Adw.ApplicationWindow):
     
     def check_auth(self) -> bool:
         """Check if user is authenticated"""
-        config_path = Path.home() / ".config" / "skylight-shopping-list" / "auth.json"
-        
-        if config_path.exists():
-            try:
-                with open(config_path) as f:
-                    auth_data = json.load(f)
-                    self.app.skylight_api = SkylightAPI(
-                        frame_id=auth_data['frame_id'],
-                        auth_token=auth_data['auth_token'],
-                        auth_type=auth_data['auth_type']
-                    )
-                    self.app.is_authenticated = True
-                    return True
-            except Exception as e:
-                print(f"Auth check failed: {e}")
-        
-        return False
+        try:
+            frames = load_frames(AUTH_FILE)
+        except (OSError, ValueError) as e:
+            print(f"Auth check failed: {e}")
+            return False
+        
+        if not frames:
+            return False
+        
+        # One client per frame; the first configured frame is shown
+        self.app.frames = {
+            frame.name: SkylightAPI(frame.frame_id, frame.auth_token, frame.auth_type)
+            for frame in frames
+        }
+        self.app.set_active_frame(frames[0].name)
+        return True
     
     def build_login_ui(self):
         """Build login interface"""
@@ -326,6 +502,11 @@ class MainWindow(Adw.ApplicationWindow):
         self.scan_image_btn.connect("clicked", self.on_scan_image)
         button_box.append(self.scan_image_btn)
         
+        # Lets the restock model treat products missing from the photo as run out
+        self.full_pantry_check = Gtk.CheckButton(label="Photo shows the whole pantry")
+        self.full_pantry_check.set_tooltip_text("Products not seen in this photo are recorded as used up")
+        button_box.append(self.full_pantry_check)
+        
         box.append(button_box)
         
         scrolled.set_child(box)
@@ -380,15 +561,24 @@ class MainWindow(Adw.ApplicationWindow):
         prefs_group = Adw.PreferencesGroup()
         prefs_group.set_title("Connection")
         
-        frame_id_row = Adw.ActionRow()
-        frame_id_row.set_title("Frame ID")
-        if self.app.skylight_api:
-            frame_id_row.set_subtitle(self.app.skylight_api.frame_id)
-        prefs_group.add(frame_id_row)
+        # Every configured frame; scans and suggestions go to the selected one
+        names = list(self.app.frames)
+        frame_row = Adw.ComboRow()
+        frame_row.set_title("Active Frame")
+        frame_row.set_model(Gtk.StringList.new(names))
+        if self.app.active_frame in names:
+            frame_row.set_selected(names.index(self.app.active_frame))
+        frame_row.set_subtitle(f"Frame ID {self.app.skylight_api.frame_id}")
+        frame_row.connect("notify::selected", self.on_active_frame_changed, names)
+        prefs_group.add(frame_row)
         
         box.append(prefs_group)
         
-        # Logout button
+        # Diagnostics (only when metrics are enabled)
+        if metrics.enabled:
+            box.append(self.build_metrics_panel())
+        
+        # Logout button (forgets only the active frame)
         logout_btn = Gtk.Button(label="Logout")
         logout_btn.add_css_class("destructive-action")
         logout_btn.connect("clicked", self.on_logout)
@@ -397,6 +587,40 @@ class MainWindow(Adw.ApplicationWindow):
         scrolled.set_child(box)
         return scrolled
     
+    def build_metrics_panel(self) -> Gtk.Widget:
+        """Build the debug panel showing live metrics"""
+        group = Adw.PreferencesGroup()
+        group.set_title("Diagnostics")
+        group.set_description("Request, scan and main loop metrics")
+        
+        text_view = Gtk.TextView()
+        text_view.set_editable(False)
+        text_view.set_monospace(True)
+        text_view.set_wrap_mode(Gtk.WrapMode.NONE)
+        
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.set_min_content_height(240)
+        scrolled.set_child(text_view)
+        group.add(scrolled)
+        
+        def refresh(*_):
+            text_view.get_buffer().set_text(metrics.render_prometheus())
+        
+        button_box = Gtk.Box(spacing=12)
+        button_box.set_margin_top(12)
+        
+        refresh_btn = Gtk.Button(label="Refresh")
+        refresh_btn.connect("clicked", refresh)
+        button_box.append(refresh_btn)
+        
+        export_btn = Gtk.Button(label="Export")
+        export_btn.connect("clicked", self.on_export_metrics)
+        button_box.append(export_btn)
+        group.add(button_box)
+        
+        refresh()
+        return group
+    
     # Event handlers
     
     def on_login(self, button, frame_id_entry, auth_type_row, token_entry):
@@ -409,22 +633,17 @@ class MainWindow(Adw.ApplicationWindow):
             self.show_error_dialog("Please fill in all fields")
             return
         
-        # Save credentials
-        config_dir = Path.home() / ".config" / "skylight-shopping-list"
-        config_dir.mkdir(parents=True, exist_ok=True)
-        
-        auth_data = {
-            'frame_id': frame_id,
-            'auth_token': token,
-            'auth_type': auth_type
-        }
-        
-        with open(config_dir / "auth.json", 'w') as f:
-            json.dump(auth_data, f)
+        # Save credentials alongside any frames already configured
+        upsert_frame(AUTH_FILE, FrameConfig(
+            name=frame_id,
+            frame_id=frame_id,
+            auth_token=token,
+            auth_type=auth_type
+        ))
         
         # Initialize API
-        self.app.skylight_api = SkylightAPI(frame_id, token, auth_type)
-        self.app.is_authenticated = True
+        self.app.frames[frame_id] = SkylightAPI(frame_id, token, auth_type)
+        self.app.set_active_frame(frame_id)
         
         # Rebuild UI
         self.build_main_ui()
@@ -487,33 +706,90 @@ class MainWindow(Adw.ApplicationWindow):
         button.set_sensitive(False)
         button.set_label("Scanning...")
         
+        queue_depth = metrics.gauge("scan_queue_depth")
+        queue_depth.inc()
+        full_pantry = self.full_pantry_check.get_active()
+        
         def scan_thread():
-            try:
-                items = self.app.camera_scanner.scan_image(self.current_image_path)
-                GLib.idle_add(self.on_scan_complete, items)
-            except Exception as e:
-                GLib.idle_add(self.show_error_dialog, f"Scan failed: {e}")
-            finally:
-                GLib.idle_add(button.set_sensitive, True)
-                GLib.idle_add(button.set_label, "🔍 Scan for Items")
-        
-        thread = threading.Thread(target=scan_thread)
+            # Root span of the pipeline: covers decoding through the results dialog
+            with tracer.span("scan", image=self.current_image_path), metrics.histogram("scan_seconds", LONG_BUCKETS).time():
+                try:
+                    with metrics.histogram("scan_decode_seconds").time(), tracer.span("scan.decode"):
+                        items = self.app.camera_scanner.scan_image(self.current_image_path)
+                    metrics.counter("scan_items_detected_total").inc(len(items))
+                    with metrics.histogram("scan_match_seconds").time(), tracer.span("scan.match"):
+                        matches = self.app.match_scanned_items(items)
+                    suggestions: List[RestockSuggestion] = []
+                    try:
+                        with tracer.span("scan.restock"):
+                            suggestions = self.app.record_scan(matches, full_pantry)
+                    except Exception as e:
+                        # The scan worked; history and model trouble must not hide its results
+                        metrics.counter("scan_record_failures_total").inc()
+                        print(f"Failed to record scan: {e}")
+                    
+                    shown = threading.Event()
+                    
+                    def show_results():
+                        try:
+                            self.on_scan_complete(items, matches, suggestions)
+                        finally:
+                            shown.set()
+                    
+                    GLib.idle_add(tracer.wrap(show_results))
+                    shown.wait()
+                except Exception as e:
+                    metrics.counter("scan_failures_total").inc()
+                    GLib.idle_add(self.show_error_dialog, f"Scan failed: {e}")
+                finally:
+                    queue_depth.dec()
+                    GLib.idle_add(button.set_sensitive, True)
+                    GLib.idle_add(button.set_label, "🔍 Scan for Items")
+        
+        # Daemon: the worker waits for the main loop, which may already be gone at exit
+        thread = threading.Thread(target=scan_thread, daemon=True)
         thread.start()
     
-    def on_scan_complete(self, items: List[str]):
+    def on_scan_complete(self, items: List[str], matches: Optional[List[List[FuzzyMatch]]] = None,
+                         suggestions: Optional[List[RestockSuggestion]] = None):
         """Handle scan completion"""
         # Show results dialog
-        dialog = ResultsDialog(self, items, self.current_image_path)
-        dialog.present()
+        with tracer.span("scan.results_dialog", items=len(items)):
+            dialog = ResultsDialog(self, items, self.current_image_path, matches, suggestions)
+            dialog.present()
+    
+    def on_export_metrics(self, button):
+        """Write a metrics snapshot to the cache directory"""
+        path = METRICS_FILE or str(CACHE_DIR / "metrics.prom")
+        try:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            metrics.write(path)
+        except OSError as e:
+            self.show_error_dialog(f"Failed to export metrics: {e}")
+    
+    def on_active_frame_changed(self, row, _pspec, names: List[str]):
+        """Switch the frame scans and suggestions go to"""
+        name = names[row.get_selected()]
+        self.app.set_active_frame(name)
+        row.set_subtitle(f"Frame ID {self.app.skylight_api.frame_id}")
     
     def on_logout(self, button):
-        """Handle logout"""
-        config_path = Path.home() / ".config" / "skylight-shopping-list" / "auth.json"
-        if config_path.exists():
-            config_path.unlink()
-        
-        self.app.is_authenticated = False
-        self.build_login_ui()
+        """Forget the active frame, keeping any other configured frames"""
+        name = self.app.active_frame
+        if name is not None:
+            try:
+                remove_frame(AUTH_FILE, name)
+            except (OSError, ValueError) as e:
+                self.show_error_dialog(f"Failed to log out of {name}: {e}")
+                return
+            self.app.frames.pop(name, None)
+        
+        if self.app.frames:
+            self.app.set_active_frame(next(iter(self.app.frames)))
+            self.build_main_ui()
+        else:
+            self.app.set_active_frame(None)
+            self.build_login_ui()
     
     def show_error_dialog(self, message: str):
         """Show error dialog"""
@@ -527,16 +803,122 @@ class MainWindow(Adw.ApplicationWindow):
 class ResultsDialog(Adw.Window):
     """Dialog to show scan results"""
     
-    def __init__(self, parent, items: List[str], image_path: str):
+    def __init__(self, parent, items: List[str], image_path: str,
+                 matches: Optional[List[List[FuzzyMatch]]] = None,
+                 suggestions: Optional[List[RestockSuggestion]] = None):
         super().__init__()
         
+        # Candidate products per detected item, best first
+        self.items = items
+        self.matches = matches or [[] for _ in items]
+        # Products predicted to run out soon, to offer for the shopping list
+        self.suggestions = suggestions or []
+        
+        self.parent = parent
+        
         self.set_title("Scan Results")
         self.set_default_size(600, 500)
         self.set_transient_for(parent)
         self.set_modal(True)
         
         # Build UI
-        # ... (implementation details)
+        content = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=12)
+        content.set_margin_top(12)
+        content.set_margin_bottom(12)
+        content.set_margin_start(12)
+        content.set_margin_end(12)
+        
+        # Detected items and their matches
+        content.append(self.build_items_group())
+        
+        if self.suggestions:
+            content.append(self.build_suggestions_group())
+        
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.set_vexpand(True)
+        scrolled.set_child(content)
+        
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        box.append(Adw.HeaderBar())
+        box.append(scrolled)
+        self.set_content(box)
+    
+    def build_items_group(self) -> Gtk.Widget:
+        """One row per detected item with its best cached match"""
+        group = Adw.PreferencesGroup()
+        group.set_title("Detected Items")
+        if not self.items:
+            group.set_description("No items were recognised in this photo")
+        
+        for item, candidates in zip(self.items, self.matches):
+            row = Adw.ActionRow()
+            row.set_title(GLib.markup_escape_text(item))
+            if candidates:
+                best = candidates[0]
+                row.set_subtitle(GLib.markup_escape_text(best.name))
+                confidence = Gtk.Label(label=f"{best.score:.0%}")
+                if best.score < SCAN_RECORD_MIN_SCORE:
+                    # Too uncertain to count towards the pantry history
+                    confidence.add_css_class("dim-label")
+                row.add_suffix(confidence)
+            else:
+                row.set_subtitle("No matching product")
+            group.add(row)
+        return group
+    
+    def build_suggestions_group(self) -> Gtk.Widget:
+        """Products running low, each with a button to put it on the list"""
+        group = Adw.PreferencesGroup()
+        group.set_title("Running Low")
+        group.set_description("Based on how fast earlier scans saw these go")
+        
+        cache = self.parent.app.openfoodfacts_api.cache
+        for suggestion in self.suggestions:
+            product = cache.get(suggestion.barcode) if cache else None
+            name = (product.product_name if product else None) or suggestion.barcode
+            
+            row = Adw.ActionRow()
+            row.set_title(GLib.markup_escape_text(name))
+            if suggestion.days_left <= 0:
+                row.set_subtitle("Probably run out")
+            else:
+                row.set_subtitle(f"About {suggestion.days_left:g} days left")
+            
+            add_btn = Gtk.Button(label="Add to List")
+            add_btn.set_valign(Gtk.Align.CENTER)
+            add_btn.connect("clicked", self.on_add_suggestion, product, name)
+            row.add_suffix(add_btn)
+            group.add(row)
+        return group
+    
+    def on_add_suggestion(self, button, product, name: str):
+        """Queue a suggested product and sync it to the active frame's list"""
+        api = self.parent.app.skylight_api
+        if api is None:
+            self.parent.show_error_dialog("Log in to a frame to add items")
+            return
+        item = {"label": name}
+        if product is not None:
+            item["section"] = product.categorize().value
+            item["barcode"] = product.code
+        try:
+            queue_items(CACHE_DIR, api.frame_id, [item])
+        except OSError as e:
+            self.parent.show_error_dialog(f"Failed to queue {name}: {e}")
+            return
+        button.set_label("Adding...")
+        button.set_sensitive(False)
+        self.parent.app.sync_active_frame(lambda result: self.on_suggestion_synced(button, result))
+    
+    def on_suggestion_synced(self, button, result: Dict[str, Any]):
+        """Report whether the sync got the queued suggestion onto the list"""
+        if result['status'] == "ok" and not result.get('failed'):
+            button.set_label("Added")
+            return
+        # Still in the outbox; the next sync (GUI or CLI) retries it
+        button.set_label("Queued")
+        button.set_tooltip_text(f"Not on the list yet ({result.get('error', 'sync failed')}); "
+                                "it will be sent with the next sync")
 
 
 def main():
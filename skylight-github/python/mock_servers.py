@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Local OpenFoodFacts & Skylight Stand-in Servers
+===============================================
+
+aiohttp application implementing the routes the app talks to, so
+throughput features can be exercised in CI without network access.
+
+OpenFoodFacts routes:
+- GET /api/v2/product/{barcode}
+- GET /cgi/search.pl
+- GET /images/products/{path}
+
+Skylight routes:
+- GET  /api/frames/{frame_id}/lists
+- GET  /api/frames/{frame_id}/lists/{list_id}
+- POST /api/frames/{frame_id}/lists/{list_id}/list_items
+
+Latency, jitter, error rates, 429 responses and payload sizes are
+configurable through MockConfig.
+
+Usage:
+    runner, base_url = await start_mock_server(MockConfig(latency_ms=40))
+    api = OpenFoodFactsAPI(base_url=base_url)
+
+    # or standalone
+    python mock_servers.py --port 8080 --latency-ms 40 --error-rate 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import zlib
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+FIXTURES_PATH = Path(__file__).resolve().parent / "benchmarks" / "fixtures" / "products.json"
+
+
+@dataclass
+class MockConfig:
+    """
+    Behaviour of the stand-in servers
+
+    Rates are probabilities in [0, 1] applied per request.
+    """
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    rate_limit_rps: Optional[float] = None
+    retry_after: int = 1
+    not_found_rate: float = 0.0
+    payload_padding: int = 0
+    image_size: int = 48 * 1024
+    seed: Optional[int] = None
+
+
+@dataclass
+class MockStats:
+    """Requests seen by the stand-in, keyed by (route, status)"""
+    responses: Counter = field(default_factory=Counter)
+
+    def record(self, route: str, status: int):
+        self.responses[(route, status)] += 1
+
+    def to_dict(self) -> Dict[str, Dict[str, int]]:
+        out: Dict[str, Dict[str, int]] = {}
+        for (route, status), count in sorted(self.responses.items()):
+            out.setdefault(route, {})[str(status)] = count
+        return out
+
+
+def load_products(path: Path = FIXTURES_PATH) -> List[Dict[str, Any]]:
+    """Load recorded OFF product payloads"""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class _TokenBucket:
+    """Simple token bucket used to emit 429s above a request rate"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+def build_mock_app(
+    config: Optional[MockConfig] = None,
+    products: Optional[List[Dict[str, Any]]] = None
+) -> web.Application:
+    """
+    Create the stand-in application
+
+    Args:
+        config: Latency/error behaviour
+        products: OFF product payloads to serve (defaults to the fixtures).
+            Unknown barcodes get a synthesized product cloned from these.
+
+    Returns:
+        aiohttp application; its MockStats is available as app['stats']
+    """
+    config = config or MockConfig()
+    products = products if products is not None else load_products()
+    by_code = {p["code"]: p for p in products}
+    templates = [p for p in products if p.get("product_name")] or [{"code": ""}]
+    rng = random.Random(config.seed)
+    bucket = _TokenBucket(config.rate_limit_rps) if config.rate_limit_rps else None
+    image = bytes(range(256)) * (config.image_size // 256 + 1)
+    image = image[:config.image_size]
+    padding = "x" * config.payload_padding
+    stats = MockStats()
+
+    # Per-frame Skylight lists, created lazily
+    frames: Dict[str, Dict[str, Any]] = {}
+
+    def product_payload(barcode: str) -> Dict[str, Any]:
+        data = by_code.get(barcode)
+        if data is None:
+            template = templates[zlib.crc32(barcode.encode()) % len(templates)]
+            data = dict(template, code=barcode)
+        if padding:
+            data = dict(data, _padding=padding)
+        return data
+
+    def frame_state(frame_id: str) -> Dict[str, Any]:
+        if frame_id not in frames:
+            frames[frame_id] = {
+                "lists": {
+                    "1": {"label": "Groceries", "kind": "shopping", "default_grocery_list": True, "items": []},
+                    "2": {"label": "Hardware", "kind": "shopping", "default_grocery_list": False, "items": []},
+                },
+                "next_item_id": 1,
+            }
+        return frames[frame_id]
+
+    @web.middleware
+    async def behaviour(request: web.Request, handler):
+        route = request.match_info.route.resource.canonical if request.match_info.route.resource else "unknown"
+
+        delay = config.latency_ms + (rng.uniform(-config.jitter_ms, config.jitter_ms) if config.jitter_ms else 0)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+        if (bucket and not bucket.take()) or (config.rate_limit_rate and rng.random() < config.rate_limit_rate):
+            stats.record(route, 429)
+            return web.json_response(
+                {"error": "Too Many Requests"}, status=429,
+                headers={"Retry-After": str(config.retry_after)}
+            )
+        if config.error_rate and rng.random() < config.error_rate:
+            stats.record(route, 500)
+            return web.json_response({"error": "Internal Server Error"}, status=500)
+
+        response = await handler(request)
+        stats.record(route, response.status)
+        return response
+
+    # OpenFoodFacts
+
+    async def get_product(request: web.Request) -> web.Response:
+        barcode = request.match_info["barcode"]
+        if barcode == "0" * len(barcode) or (config.not_found_rate and rng.random() < config.not_found_rate):
+            return web.json_response({"status": 0, "code": barcode, "status_verbose": "product not found"})
+        return web.json_response({"status": 1, "code": barcode, "product": product_payload(barcode)})
+
+    async def search(request: web.Request) -> web.Response:
+        page_size = int(request.query.get("page_size", 20))
+        terms = request.query.get("search_terms", "").lower()
+        matches = [p for p in templates if terms in (p.get("product_name") or "").lower()] or templates
+        page = [product_payload(matches[i % len(matches)]["code"]) for i in range(page_size)]
+        return web.json_response({"count": len(page), "page": 1, "page_size": page_size, "products": page})
+
+    async def get_image(request: web.Request) -> web.Response:
+        return web.Response(body=image, content_type="image/jpeg")
+
+    # Skylight
+
+    def authorized(request: web.Request) -> bool:
+        return bool(request.headers.get("Authorization", "").strip())
+
+    def list_resource(list_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "type": "list",
+            "id": list_id,
+            "attributes": {
+                "label": data["label"],
+                "kind": data["kind"],
+                "default_grocery_list": data["default_grocery_list"],
+            },
+            "relationships": {
+                "list_items": {"data": [{"type": "list_item", "id": i["id"]} for i in data["items"]]}
+            },
+        }
+
+    async def get_lists(request: web.Request) -> web.Response:
+        if not authorized(request):
+            return web.json_response({"error": "Unauthorized"}, status=401)
+        state = frame_state(request.match_info["frame_id"])
+        return web.json_response({"data": [list_resource(k, v) for k, v in state["lists"].items()]})
+
+    async def get_list_detail(request: web.Request) -> web.Response:
+        if not authorized(request):
+            return web.json_response({"error": "Unauthorized"}, status=401)
+        state = frame_state(request.match_info["frame_id"])
+        list_id = request.match_info["list_id"]
+        data = state["lists"].get(list_id)
+        if data is None:
+            return web.json_response({"error": "Not Found"}, status=404)
+        return web.json_response({
+            "data": list_resource(list_id, data),
+            "included": [
+                {"type": "list_item", "id": item["id"], "attributes": item["attributes"]}
+                for item in data["items"]
+            ],
+        })
+
+    async def add_list_item(request: web.Request) -> web.Response:
+        if not authorized(request):
+            return web.json_response({"error": "Unauthorized"}, status=401)
+        state = frame_state(request.match_info["frame_id"])
+        data = state["lists"].get(request.match_info["list_id"])
+        if data is None:
+            return web.json_response({"error": "Not Found"}, status=404)
+        body = await request.json()
+        item = {
+            "id": str(state["next_item_id"]),
+            "attributes": {
+                "label": body.get("label", ""),
+                "status": "pending",
+                "section": body.get("section"),
+                "position": len(data["items"]),
+            },
+        }
+        state["next_item_id"] += 1
+        data["items"].append(item)
+        return web.json_response({"data": {"type": "list_item", **item}}, status=201)
+
+    app = web.Application(middlewares=[behaviour])
+    app["stats"] = stats
+    app["config"] = config
+    app.router.add_get("/api/v2/product/{barcode}", get_product)
+    app.router.add_get("/cgi/search.pl", search)
+    app.router.add_get("/images/products/{path:.*}", get_image)
+    app.router.add_get("/api/frames/{frame_id}/lists", get_lists)
+    app.router.add_get("/api/frames/{frame_id}/lists/{list_id}", get_list_detail)
+    app.router.add_post("/api/frames/{frame_id}/lists/{list_id}/list_items", add_list_item)
+    return app
+
+
+async def start_mock_server(
+    config: Optional[MockConfig] = None,
+    products: Optional[List[Dict[str, Any]]] = None,
+    host: str = "127.0.0.1",
+    port: int = 0
+) -> Tuple[web.AppRunner, str]:
+    """
+    Start the stand-in servers
+
+    Args:
+        config: Latency/error behaviour
+        products: OFF product payloads to serve
+        host: Interface to bind
+        port: Port to bind (0 picks a free port)
+
+    Returns:
+        The runner (call ``cleanup()`` when done) and the base URL
+    """
+    runner = web.AppRunner(build_mock_app(config, products), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = runner.addresses[0][1]
+    return runner, f"http://{host}:{bound_port}"
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    """Add MockConfig options to a command line parser"""
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 500 responses")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of 429 responses")
+    parser.add_argument("--rate-limit-rps", type=float, help="answer 429 above this request rate")
+    parser.add_argument("--not-found-rate", type=float, default=0.0)
+    parser.add_argument("--payload-padding", type=int, default=0, help="extra bytes per product")
+    parser.add_argument("--image-size", type=int, default=48 * 1024)
+    parser.add_argument("--seed", type=int)
+
+
+def config_from_args(args: argparse.Namespace) -> MockConfig:
+    """Build a MockConfig from parsed add_config_arguments options"""
+    return MockConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        rate_limit_rps=args.rate_limit_rps,
+        not_found_rate=args.not_found_rate,
+        payload_padding=args.payload_padding,
+        image_size=args.image_size,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the OpenFoodFacts/Skylight stand-in servers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    web.run_app(build_mock_app(config_from_args(args)), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,620 @@
+#!/usr/bin/env python3
+"""
+Skylight Shopping List - Headless CLI
+=====================================
+
+Batch lookups and syncs without GTK, for servers and cron. Uses the
+same OpenFoodFactsAPI, SkylightAPI, product cache and barcode index as
+the desktop app, and never imports gi.
+
+Commands:
+    lookup [FILE]         barcodes (one per line, stdin by default) ->
+                          JSONL on stdout, streamed as results arrive
+    search QUERY          OFF product search -> JSONL
+    nutrition [FILE]      nutrition summary of a pantry or list given as
+                          barcodes (one per line, repeats count as units)
+    import-photos DIR     decode barcodes in every photo, look them up,
+                          optionally queue found products for the list
+                          and record each photo as a pantry scan
+    restock               products predicted to run out soon, from the
+                          recorded pantry scans
+    sync                  for every frame, concurrently: push queued items
+                          to its grocery list and refresh its list mirror
+    frames [add|remove]   manage the Skylight frames in auth.json
+    warm-cache [FILE]     fetch every barcode not yet in the product cache
+    daemon                keep the cache warm and sync each frame on its
+                          own interval, optionally serving the shared
+                          lookup service
+
+Usage:
+    cat barcodes.txt | python skylight_cli.py lookup --concurrency 16
+    python skylight_cli.py import-photos ~/Pictures/pantry --add-to-list
+    python skylight_cli.py restock --lead-days 5 --add-to-list
+    python skylight_cli.py daemon --interval 600 --warm watchlist.txt
+
+Credentials are read from the desktop app's auth.json.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+
+from lib.openfoodfacts_api import BASE_URL as OFF_BASE_URL, OFFProduct, OpenFoodFactsAPI
+from lib.skylight_api import BASE_URL as SKYLIGHT_BASE_URL
+from lib.frame_sync import (
+    DEFAULT_FRAME_TIMEOUT, DEFAULT_SYNC_INTERVAL, FrameConfig, FrameSyncer,
+    load_frames, queue_items, remove_frame, upsert_frame,
+)
+from lib.product_codec import ProductCache
+from lib.nutrition_analytics import NutritionMatrix
+from lib.scan_history import ScanHistory
+from lib.restock import LEAD_DAYS, MIN_OBSERVATIONS, RestockPredictor
+from lib.barcode_index import BarcodeIndex, read_dump_barcodes
+from lookup_service import start_lookup_service
+from lib.metrics import LONG_BUCKETS, metrics
+from lib.tracing import tracer, TRACE_FILE
+
+logger = logging.getLogger("skylight_cli")
+
+CONFIG_DIR = Path.home() / ".config" / "skylight-shopping-list"
+AUTH_FILE = CONFIG_DIR / "auth.json"
+CACHE_DIR = Path.home() / ".cache" / "skylight-shopping-list"
+HISTORY_DIR = Path.home() / ".local" / "share" / "skylight-shopping-list" / "scan-history"
+
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".tif", ".tiff"}
+
+_DONE = object()
+
+
+# Plumbing shared by the commands
+
+def emit(record: Dict[str, Any]):
+    """Write one JSONL record and flush so consumers see it immediately"""
+    sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+
+def product_record(product: OFFProduct, full: bool) -> Dict[str, Any]:
+    return asdict(product) if full else product.to_pantry_item()
+
+
+async def read_lines(path: Optional[Path]) -> AsyncIterator[str]:
+    """Non-empty, non-comment lines of a file or stdin, read off the event loop"""
+    loop = asyncio.get_running_loop()
+    f = open(path, encoding="utf-8") if path and str(path) != "-" else sys.stdin
+    try:
+        while True:
+            line = await loop.run_in_executor(None, f.readline)
+            if not line:
+                break
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+async def iterate(values: Iterable[Any]) -> AsyncIterator[Any]:
+    for value in values:
+        yield value
+
+
+async def drain(source: AsyncIterator[Any], handle: Callable[[Any], Awaitable[None]], concurrency: int):
+    """
+    Run ``handle`` over ``source`` with at most ``concurrency`` in flight
+
+    The bounded queue applies backpressure to the source, so arbitrarily
+    long inputs are streamed rather than loaded up front.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is _DONE:
+                return
+            try:
+                await handle(item)
+            except BrokenPipeError:
+                raise
+            except Exception:
+                logger.exception(f"Failed to process {item!r}")
+
+    async def produce():
+        async for item in source:
+            await queue.put(item)
+        for _ in workers:
+            await queue.put(_DONE)
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, concurrency))]
+    tasks = [asyncio.create_task(produce()), *workers]
+    try:
+        # A failing worker (e.g. stdout closed) surfaces here instead of stalling the producer
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def lookup_barcode(api: OpenFoodFactsAPI, barcode: str) -> Tuple[str, Optional[OFFProduct]]:
+    """(status, product) where status is found, not_found or error"""
+    try:
+        product = await api.get_product(barcode)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.debug(f"Lookup of {barcode} failed: {e}")
+        return "error", None
+    return ("found", product) if product is not None else ("not_found", None)
+
+
+def open_off_api(args: argparse.Namespace) -> OpenFoodFactsAPI:
+    cache_dir: Path = args.cache_dir
+    cache = None if args.no_cache else ProductCache(cache_dir / "products.bin", max_age=args.max_age)
+    index_path = cache_dir / "barcodes.idx"
+    barcode_index = BarcodeIndex.open(index_path) if index_path.exists() else None
+    return OpenFoodFactsAPI(base_url=args.off_url, cache=cache, barcode_index=barcode_index)
+
+
+async def close_off_api(api: OpenFoodFactsAPI):
+    await api.close()
+    if api.cache is not None:
+        api.cache.close()
+    if api.barcode_index is not None:
+        api.barcode_index.close()
+
+
+def load_frame_configs(args: argparse.Namespace) -> List[FrameConfig]:
+    """Frames from auth.json, narrowed to --frame when given"""
+    try:
+        frames = load_frames(args.auth_file)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    if args.frame:
+        unknown = set(args.frame) - {f.name for f in frames}
+        if unknown:
+            raise SystemExit(f"Unknown frame(s): {', '.join(sorted(unknown))}")
+        frames = [f for f in frames if f.name in args.frame]
+    return frames
+
+
+def open_frame_syncer(args: argparse.Namespace, frames: List[FrameConfig]) -> FrameSyncer:
+    return FrameSyncer(
+        frames, args.cache_dir,
+        base_url=args.skylight_url,
+        max_connections=args.concurrency,
+        frame_timeout=args.frame_timeout,
+        default_interval=getattr(args, 'interval', DEFAULT_SYNC_INTERVAL),
+    )
+
+
+# Commands
+
+async def cmd_lookup(args: argparse.Namespace) -> int:
+    api = open_off_api(args)
+    counter = iter(range(sys.maxsize))
+
+    async def indexed() -> AsyncIterator[Tuple[int, str]]:
+        async for barcode in read_lines(args.file):
+            yield next(counter), barcode
+
+    async def handle(entry: Tuple[int, str]):
+        index, barcode = entry
+        status, product = await lookup_barcode(api, barcode)
+        record: Dict[str, Any] = {'index': index, 'barcode': barcode, 'status': status}
+        if product is not None:
+            record['product'] = product_record(product, args.full)
+        emit(record)
+
+    try:
+        await drain(indexed(), handle, args.concurrency)
+    finally:
+        await close_off_api(api)
+    return 0
+
+
+async def cmd_search(args: argparse.Namespace) -> int:
+    api = open_off_api(args)
+    try:
+        products = await api.search_products(args.query, page=args.page, page_size=args.page_size)
+        for product in products:
+            emit(product_record(product, args.full))
+    finally:
+        await close_off_api(api)
+    return 0
+
+
+async def cmd_nutrition(args: argparse.Namespace) -> int:
+    counts: Counter = Counter()
+    async for barcode in read_lines(args.file):
+        counts[barcode] += 1
+
+    api = open_off_api(args)
+    matrix = NutritionMatrix(len(counts))
+    missing: List[str] = []
+
+    async def handle(barcode: str):
+        status, product = await lookup_barcode(api, barcode)
+        if product is None:
+            missing.append(barcode)
+        else:
+            matrix.add(product, counts[barcode])
+
+    try:
+        await drain(iterate(counts), handle, args.concurrency)
+    finally:
+        await close_off_api(api)
+
+    emit({**matrix.summary(), 'missing': sorted(missing)})
+    return 0
+
+
+def decode_photo(path: Path) -> Tuple[Path, List[str]]:
+    """Barcodes found in one photo (runs in a worker thread)"""
+    from PIL import Image
+    from pyzbar import pyzbar
+
+    try:
+        with Image.open(path) as image:
+            decoded = pyzbar.decode(image.convert("L"))
+    except OSError as e:
+        logger.warning(f"Cannot read {path}: {e}")
+        return path, []
+    return path, [d.data.decode("ascii", "replace") for d in decoded]
+
+
+async def cmd_import_photos(args: argparse.Namespace) -> int:
+    try:
+        import pyzbar.pyzbar  # noqa: F401
+    except ImportError:
+        print("import-photos needs pyzbar (pip install pyzbar)", file=sys.stderr)
+        return 2
+
+    photos = sorted(p for p in args.directory.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+    api = open_off_api(args)
+    found: List[Dict[str, Any]] = []
+    scans: List[Tuple[float, str, List[str]]] = []
+
+    async def decoded() -> AsyncIterator[Tuple[Path, str]]:
+        # Decoding is CPU bound; workers overlap it with the lookups below
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(args.workers) as pool:
+            futures = [loop.run_in_executor(pool, decode_photo, p) for p in photos]
+            for future in asyncio.as_completed(futures):
+                path, barcodes = await future
+                if not barcodes:
+                    emit({'photo': str(path), 'status': "no_barcode"})
+                if args.record:
+                    scans.append((path.stat().st_mtime, str(path), barcodes))
+                for barcode in dict.fromkeys(barcodes):
+                    yield path, barcode
+
+    async def handle(entry: Tuple[Path, str]):
+        path, barcode = entry
+        status, product = await lookup_barcode(api, barcode)
+        record: Dict[str, Any] = {'photo': str(path), 'barcode': barcode, 'status': status}
+        if product is not None:
+            record['product'] = product_record(product, args.full)
+            found.append({
+                'label': product.product_name or barcode,
+                'section': product.categorize().value,
+                'barcode': barcode,
+            })
+        emit(record)
+
+    try:
+        await drain(decoded(), handle, args.concurrency)
+    finally:
+        await close_off_api(api)
+
+    if scans:
+        # One scan per photo, taken when the photo was. Photos finish decoding
+        # in any order, but the restock model ignores observations older than
+        # the newest one it has, so record them oldest first.
+        history = ScanHistory(args.history_dir)
+        try:
+            for mtime, _, barcodes in sorted(scans):
+                history.append_scan(Counter(barcodes), mtime)
+        finally:
+            history.close()
+
+    if args.add_to_list and found:
+        # Items go to one frame: the first --frame, else the first configured
+        frame = next(iter(load_frame_configs(args)), None)
+        if frame is None:
+            print(f"Not logged in ({args.auth_file} has no frames); nothing queued", file=sys.stderr)
+            return 2
+        queue_items(args.cache_dir, frame.frame_id, found)
+        logger.info(f"Queued {len(found)} items for frame {frame.name}; run 'sync' to add them")
+    return 0
+
+
+async def cmd_restock(args: argparse.Namespace) -> int:
+    history = ScanHistory(args.history_dir)
+    model_path = args.history_dir / "restock.npz"
+    try:
+        predictor = RestockPredictor.load(model_path) if model_path.exists() else RestockPredictor()
+        added = predictor.update(history)
+        predictor.save(model_path)
+        suggestions = predictor.suggest(history, lead_days=args.lead_days,
+                                        min_observations=args.min_observations)
+    finally:
+        history.close()
+    logger.info(f"Folded {added} new scan events into the restock model")
+
+    api = open_off_api(args)
+    found: List[Dict[str, Any]] = []
+
+    async def handle(suggestion):
+        status, product = await lookup_barcode(api, suggestion.barcode)
+        record = asdict(suggestion)
+        record['status'] = status
+        if product is not None:
+            record['product'] = product_record(product, args.full)
+            found.append({
+                'label': product.product_name or suggestion.barcode,
+                'section': product.categorize().value,
+                'barcode': suggestion.barcode,
+            })
+        emit(record)
+
+    try:
+        await drain(iterate(suggestions), handle, args.concurrency)
+    finally:
+        await close_off_api(api)
+
+    if args.add_to_list and found:
+        frame = next(iter(load_frame_configs(args)), None)
+        if frame is None:
+            print(f"Not logged in ({args.auth_file} has no frames); nothing queued", file=sys.stderr)
+            return 2
+        queue_items(args.cache_dir, frame.frame_id, found)
+        logger.info(f"Queued {len(found)} restock items for frame {frame.name}; run 'sync' to add them")
+    return 0
+
+
+async def cmd_sync(args: argparse.Namespace) -> int:
+    frames = load_frame_configs(args)
+    if not frames:
+        print(f"Not logged in ({args.auth_file} has no frames)", file=sys.stderr)
+        return 2
+    ok = True
+    async with open_frame_syncer(args, frames) as syncer:
+        async for result in syncer.sync_each():
+            emit(result)
+            ok = ok and result['status'] == "ok"
+    return 0 if ok else 1
+
+
+async def cmd_frames(args: argparse.Namespace) -> int:
+    if args.action == "add":
+        upsert_frame(args.auth_file, FrameConfig(
+            name=args.name,
+            frame_id=args.frame_id,
+            auth_token=args.token,
+            auth_type=args.auth_type,
+            sync_interval=args.sync_interval,
+        ))
+    elif args.action == "remove":
+        if not remove_frame(args.auth_file, args.name):
+            print(f"No frame named {args.name}", file=sys.stderr)
+            return 1
+    for frame in load_frames(args.auth_file):
+        emit({'name': frame.name, 'frame_id': frame.frame_id, 'sync_interval': frame.sync_interval})
+    return 0
+
+
+async def warm_cache(api: OpenFoodFactsAPI, barcodes: AsyncIterator[str], concurrency: int) -> Dict[str, Any]:
+    """Fetch every barcode that is not already cached and fresh"""
+    counts = {'cached': 0, 'found': 0, 'not_found': 0, 'error': 0}
+    started = time.perf_counter()
+
+    async def missing() -> AsyncIterator[str]:
+        async for barcode in barcodes:
+            if api.cache is not None and barcode in api.cache:
+                counts['cached'] += 1
+            else:
+                yield barcode
+
+    async def handle(barcode: str):
+        status, _ = await lookup_barcode(api, barcode)
+        counts[status] += 1
+
+    await drain(missing(), handle, concurrency)
+    return dict(counts, seconds=round(time.perf_counter() - started, 3))
+
+
+def barcode_source(args: argparse.Namespace) -> AsyncIterator[str]:
+    if args.dump:
+        return iterate(read_dump_barcodes(args.dump))
+    return read_lines(args.file)
+
+
+async def cmd_warm_cache(args: argparse.Namespace) -> int:
+    if args.no_cache:
+        print("warm-cache needs the product cache", file=sys.stderr)
+        return 2
+    api = open_off_api(args)
+    try:
+        emit(await warm_cache(api, barcode_source(args), args.concurrency))
+    finally:
+        await close_off_api(api)
+    return 0
+
+
+async def cmd_daemon(args: argparse.Namespace) -> int:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    # One OFF client (and cache mapping) for the daemon's lifetime
+    off_api = open_off_api(args)
+    service = None
+    try:
+        if args.listen:
+            if off_api.cache is None:
+                print("--listen needs the product cache", file=sys.stderr)
+                return 2
+            host, _, port = args.listen.rpartition(":")
+            service, url = await start_lookup_service(off_api, host or "127.0.0.1", int(port),
+                                                      args.cache_dir / "thumbnails")
+            logger.info(f"Lookup service listening on {url}")
+
+        async def warm_loop():
+            while not stop.is_set():
+                cycle_started = time.perf_counter()
+                if args.warm:
+                    result = await warm_cache(off_api, read_lines(args.warm), args.concurrency)
+                    logger.info(f"Cache warm: {result}")
+                metrics.histogram("daemon_cycle_seconds", LONG_BUCKETS).observe(time.perf_counter() - cycle_started)
+                if args.metrics_file:
+                    metrics.write(args.metrics_file)
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=args.interval)
+                except asyncio.TimeoutError:
+                    pass
+
+        # Frames sync on their own schedules, independently of the cache warming
+        frames = load_frame_configs(args)
+        async with open_frame_syncer(args, frames) as syncer:
+            await asyncio.gather(
+                warm_loop(),
+                syncer.run(stop, on_result=lambda result: logger.info(f"Sync: {result}")),
+            )
+    finally:
+        if service is not None:
+            await service.cleanup()
+        if off_api.cache is not None:
+            off_api.cache.compact()
+        await close_off_api(off_api)
+    return 0
+
+
+COMMANDS = {
+    'lookup': cmd_lookup,
+    'search': cmd_search,
+    'nutrition': cmd_nutrition,
+    'import-photos': cmd_import_photos,
+    'restock': cmd_restock,
+    'sync': cmd_sync,
+    'frames': cmd_frames,
+    'warm-cache': cmd_warm_cache,
+    'daemon': cmd_daemon,
+}
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Skylight Shopping List without the GUI")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight")
+    parser.add_argument("--cache-dir", type=Path, default=CACHE_DIR)
+    parser.add_argument("--history-dir", type=Path, default=HISTORY_DIR, help="pantry scan history")
+    parser.add_argument("--no-cache", action="store_true", help="bypass the product cache")
+    parser.add_argument("--max-age", type=float, help="seconds before cached products are refetched")
+    parser.add_argument("--auth-file", type=Path, default=AUTH_FILE)
+    parser.add_argument("--off-url", default=OFF_BASE_URL)
+    parser.add_argument("--skylight-url", default=SKYLIGHT_BASE_URL)
+    parser.add_argument("--frame", action="append", default=[],
+                        help="limit sync/import to this frame name (repeatable)")
+    parser.add_argument("--frame-timeout", type=float, default=DEFAULT_FRAME_TIMEOUT,
+                        help="seconds before one frame's sync is abandoned")
+    parser.add_argument("--metrics-file", help="write metrics here on exit (.json or Prometheus text)")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    lookup = sub.add_parser("lookup", help="look up barcodes, one per line")
+    lookup.add_argument("file", type=Path, nargs="?", help="barcode file (default stdin)")
+    lookup.add_argument("--full", action="store_true", help="emit every product field")
+
+    search = sub.add_parser("search", help="search OpenFoodFacts by name")
+    search.add_argument("query")
+    search.add_argument("--page", type=int, default=1)
+    search.add_argument("--page-size", type=int, default=20)
+    search.add_argument("--full", action="store_true", help="emit every product field")
+
+    nutrition = sub.add_parser("nutrition", help="nutrition summary of a list of barcodes")
+    nutrition.add_argument("file", type=Path, nargs="?", help="barcode file (default stdin)")
+
+    photos = sub.add_parser("import-photos", help="decode and look up barcodes in a photo directory")
+    photos.add_argument("directory", type=Path)
+    photos.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="decode threads")
+    photos.add_argument("--add-to-list", action="store_true", help="queue found products for the next sync")
+    photos.add_argument("--record", action="store_true", help="record each photo as a pantry scan")
+    photos.add_argument("--full", action="store_true", help="emit every product field")
+
+    restock = sub.add_parser("restock", help="suggest products about to run out")
+    restock.add_argument("--lead-days", type=float, default=LEAD_DAYS,
+                         help="suggest what runs out within this many days")
+    restock.add_argument("--min-observations", type=int, default=MIN_OBSERVATIONS,
+                         help="scans of a product needed before it is suggested")
+    restock.add_argument("--add-to-list", action="store_true", help="queue suggestions for the next sync")
+    restock.add_argument("--full", action="store_true", help="emit every product field")
+
+    sub.add_parser("sync", help="sync every frame concurrently (outbox, then list mirror)")
+
+    frames = sub.add_parser("frames", help="list, add or remove Skylight frames")
+    frame_actions = frames.add_subparsers(dest="action")
+    add = frame_actions.add_parser("add")
+    add.add_argument("name", help="e.g. kitchen")
+    add.add_argument("frame_id")
+    add.add_argument("token")
+    add.add_argument("--auth-type", choices=["Bearer", "Basic"], default="Bearer")
+    add.add_argument("--sync-interval", type=float, help="seconds between daemon syncs")
+    remove = frame_actions.add_parser("remove")
+    remove.add_argument("name")
+
+    warm = sub.add_parser("warm-cache", help="prefetch barcodes into the product cache")
+    warm.add_argument("file", type=Path, nargs="?", help="barcode file (default stdin)")
+    warm.add_argument("--dump", type=Path, help="read barcodes from an OFF CSV export instead")
+
+    daemon = sub.add_parser("daemon", help="warm the cache and sync on an interval")
+    daemon.add_argument("--interval", type=float, default=DEFAULT_SYNC_INTERVAL,
+                        help="seconds between cache warms and default frame sync interval")
+    daemon.add_argument("--warm", type=Path, help="barcode watchlist kept in the cache")
+    daemon.add_argument("--listen", metavar="HOST:PORT",
+                        help="also serve the shared lookup service (see lookup_service.py)")
+
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+        stream=sys.stderr,
+    )
+    if not args.verbose:
+        # Not-found and HTTP errors are reported in the JSONL output
+        logging.getLogger("lib.openfoodfacts_api").setLevel(logging.CRITICAL)
+    if args.metrics_file:
+        metrics.enable()
+
+    try:
+        return asyncio.run(COMMANDS[args.command](args))
+    except KeyboardInterrupt:
+        return 130
+    except BrokenPipeError:
+        # Consumer (e.g. head) went away
+        sys.stderr.close()
+        return 0
+    finally:
+        if args.metrics_file:
+            metrics.write(args.metrics_file)
+        if TRACE_FILE:
+            tracer.export_chrome_trace(TRACE_FILE)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
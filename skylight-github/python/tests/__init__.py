@@ -0,0 +1 @@
+"""Tests for the app modules, command line tools and services"""
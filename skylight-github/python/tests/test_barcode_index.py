@@ -0,0 +1,90 @@
+"""Barcode normalization and BarcodeIndex"""
+
+import random
+
+import pytest
+
+from lib.barcode_index import BarcodeIndex, check_digit, normalize_barcode
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("3017620422003", "3017620422003"),      # EAN-13
+    (" 3017620422003\n", "3017620422003"),   # scanner whitespace
+    ("049000000443", "0049000000443"),       # UPC-A
+    ("00049000000443", "0049000000443"),     # GTIN-14, empty packaging indicator
+    ("96385074", "96385074"),                # EAN-8
+    ("3017620422004", None),                 # bad check digit
+    ("10049000000443", None),                # GTIN-14 with a packaging indicator
+    ("301762042200", None),                  # UPC-A length, bad check digit
+    ("12345", None),
+    ("30176204220O3", None),
+    ("３０１７６２０４２２００３", None),       # full-width digits
+    ("", None),
+])
+def test_normalize_barcode(raw, expected):
+    assert normalize_barcode(raw) == expected
+
+
+def test_check_digit_agrees_with_normalize():
+    for payload in ("301762042200", "00490000004", "9638507"):
+        code = payload + str(check_digit(payload))
+        assert normalize_barcode(code) is not None
+
+
+def _random_barcodes(rng, n):
+    payloads = (f"{rng.randrange(10 ** 12):012d}" for _ in range(n))
+    return [p + str(check_digit(p)) for p in payloads]
+
+
+def test_build_and_query(tmp_path):
+    rng = random.Random(7)
+    codes = _random_barcodes(rng, 5000)
+    index = BarcodeIndex.build(codes + ["not a barcode", "3017620422004"], tmp_path / "barcodes.idx")
+    try:
+        assert len(index) == len(set(codes))
+        assert all(code in index for code in codes)
+        absent = set(_random_barcodes(rng, 5000)) - set(codes)
+        assert not any(index.contains(code) for code in absent)
+        assert not index.contains("3017620422004")
+        assert not index.contains("garbage")
+    finally:
+        index.close()
+
+
+def test_variants_collapse_and_match(tmp_path):
+    index = BarcodeIndex.build(["049000000443", "0049000000443", "96385074"], tmp_path / "barcodes.idx")
+    try:
+        assert len(index) == 2
+        assert index.contains("0049000000443")
+        assert index.contains(" 049000000443")
+        assert index.contains("00049000000443")
+        assert index.contains("96385074")
+    finally:
+        index.close()
+
+
+def test_open_existing(tmp_path):
+    path = tmp_path / "barcodes.idx"
+    BarcodeIndex.build(["3017620422003"], path).close()
+    index = BarcodeIndex.open(path)
+    try:
+        assert "3017620422003" in index
+        assert "5449000000996" not in index
+    finally:
+        index.close()
+
+
+def test_empty_index(tmp_path):
+    index = BarcodeIndex.build([], tmp_path / "barcodes.idx")
+    try:
+        assert len(index) == 0
+        assert not index.contains("3017620422003")
+    finally:
+        index.close()
+
+
+def test_open_rejects_other_files(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"\x00" * 64)
+    with pytest.raises(ValueError):
+        BarcodeIndex.open(path)
@@ -0,0 +1,185 @@
+"""FairScheduler and outbox delivery"""
+
+import asyncio
+import json
+from collections import Counter
+
+import pytest
+
+from lib.frame_sync import FairScheduler, outbox_path, push_outbox, queue_items, rejected_path
+from lib.skylight_api import SkylightAPIError
+
+
+def test_scheduler_alternates_busy_frames():
+    async def run():
+        scheduler = FairScheduler(capacity=1, per_frame=1)
+        grants = []
+
+        async def request(name):
+            async with scheduler.slot(name):
+                grants.append(name)
+                await asyncio.sleep(0)
+
+        # "a" queues far more work, and queues it first
+        await asyncio.gather(*[request("a") for _ in range(12)], *[request("b") for _ in range(4)])
+        return grants
+
+    grants = asyncio.run(run())
+    assert Counter(grants) == {"a": 12, "b": 4}
+    # b's requests interleave with a's instead of waiting behind all of them
+    # (the first "a" is granted before "b" has queued anything)
+    assert grants[:9] == ["a"] + ["a", "b"] * 4
+
+
+def test_scheduler_respects_limits():
+    async def run():
+        scheduler = FairScheduler(capacity=4, per_frame=2)
+        active = Counter()
+        peak_total = 0
+        over_cap = []
+
+        async def request(name):
+            nonlocal peak_total
+            async with scheduler.slot(name):
+                active[name] += 1
+                peak_total = max(peak_total, sum(active.values()))
+                if active[name] > 2:
+                    # Only allowed when no other frame is left waiting
+                    over_cap.append(any(scheduler._waiters[other] for other in "abc" if other != name))
+                await asyncio.sleep(0.001)
+                active[name] -= 1
+
+        await asyncio.gather(*(request(name) for name in "abc" * 10))
+        return peak_total, over_cap, scheduler
+
+    peak_total, over_cap, scheduler = asyncio.run(run())
+    assert peak_total == 4
+    assert not any(over_cap)
+    assert scheduler.free == 4
+    assert not any(scheduler.active.values())
+
+
+def test_scheduler_lends_idle_slots_to_a_lone_frame():
+    async def run():
+        scheduler = FairScheduler(capacity=4, per_frame=2)
+        for _ in range(4):
+            await asyncio.wait_for(scheduler.acquire("a"), timeout=1)
+        assert scheduler.free == 0
+
+        # Once another frame waits, freed slots go to it rather than back over the cap
+        late_a = asyncio.create_task(scheduler.acquire("a"))
+        b = asyncio.create_task(scheduler.acquire("b"))
+        await asyncio.sleep(0)
+        scheduler.release("a")
+        await asyncio.sleep(0)
+        granted = (b.done(), late_a.done())
+        scheduler.release("a")
+        await asyncio.sleep(0)
+        return granted, late_a.done(), dict(scheduler.active)
+
+    granted, late_a_granted, active = asyncio.run(run())
+    assert granted == (True, False)
+    # b is below its cap but has nothing more queued, so a may exceed its own again
+    assert late_a_granted
+    assert active == {"a": 3, "b": 1}
+
+
+def test_scheduler_cancelled_waiter_frees_nothing():
+    async def run():
+        scheduler = FairScheduler(capacity=1, per_frame=1)
+        await scheduler.acquire("a")
+        waiter = asyncio.create_task(scheduler.acquire("b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        scheduler.release("a")
+        # The slot is free again and goes to the next request
+        await asyncio.wait_for(scheduler.acquire("c"), timeout=1)
+        return scheduler
+
+    scheduler = asyncio.run(run())
+    assert scheduler.free == 0
+    assert scheduler.active["b"] == 0
+
+
+class FakeFrame:
+    """In-memory stand-in for SkylightAPI's list endpoints"""
+
+    def __init__(self, frame_id="frame1", fail_labels=(), has_list=True):
+        self.frame_id = frame_id
+        self.fail_labels = set(fail_labels)
+        self.has_list = has_list
+        self.added = []
+
+    async def get_grocery_list(self):
+        return {'id': "list1", 'kind': "shopping"} if self.has_list else None
+
+    async def add_list_item(self, list_id, label, section=None):
+        if label in self.fail_labels:
+            raise SkylightAPIError(500, "server error")
+        self.added.append((list_id, label, section))
+        return {'id': label}
+
+
+def _outbox_labels(tmp_path, frame_id="frame1"):
+    path = outbox_path(tmp_path, frame_id)
+    if not path.exists():
+        return []
+    return [json.loads(line)['label'] for line in path.read_text().splitlines()]
+
+
+def _push(api, tmp_path):
+    return asyncio.run(push_outbox(api, tmp_path, asyncio.Semaphore(4)))
+
+
+def test_push_outbox(tmp_path):
+    queue_items(tmp_path, "frame1", [{'label': "Milk", 'section': "dairy"}, {'label': "Bread"}])
+    api = FakeFrame()
+    assert _push(api, tmp_path) == {'pushed': 2, 'failed': 0}
+    assert sorted(label for _, label, _ in api.added) == ["Bread", "Milk"]
+    assert not outbox_path(tmp_path, "frame1").exists()
+    assert not outbox_path(tmp_path, "frame1").with_suffix(".sending").exists()
+    assert _push(api, tmp_path) == {'pushed': 0, 'failed': 0}
+
+
+def test_push_outbox_requeues_failures(tmp_path):
+    queue_items(tmp_path, "frame1", [{'label': "Milk"}, {'label': "Bread"}])
+    assert _push(FakeFrame(fail_labels={"Bread"}), tmp_path) == {'pushed': 1, 'failed': 1}
+    assert _outbox_labels(tmp_path) == ["Bread"]
+
+
+def test_push_outbox_moves_corrupt_lines_aside(tmp_path):
+    queue_items(tmp_path, "frame1", [{'label': "Milk"}])
+    path = outbox_path(tmp_path, "frame1")
+    with open(path, "ab") as f:
+        f.write(b'["not", "an", "item"]\n{"section": "dairy"}\n\xff\xfe\n{"label": "Bread"}\n{"label": "Egg')
+    api = FakeFrame()
+    assert _push(api, tmp_path) == {'pushed': 2, 'failed': 0}
+    assert sorted(label for _, label, _ in api.added) == ["Bread", "Milk"]
+    assert not path.exists()
+    rejected = rejected_path(tmp_path, "frame1").read_bytes().splitlines()
+    assert rejected == [b'["not", "an", "item"]', b'{"section": "dairy"}', b"\xff\xfe", b'{"label": "Egg']
+
+
+def test_push_outbox_restores_items_when_the_frame_fails(tmp_path):
+    queue_items(tmp_path, "frame1", [{'label': "Milk"}, {'label': "Bread"}])
+    with pytest.raises(SkylightAPIError):
+        _push(FakeFrame(has_list=False), tmp_path)
+    assert _outbox_labels(tmp_path) == ["Milk", "Bread"]
+    assert not outbox_path(tmp_path, "frame1").with_suffix(".sending").exists()
+
+
+def test_push_outbox_resends_a_claimed_outbox(tmp_path):
+    # A previous run crashed after claiming the outbox; newer items are queued separately
+    queue_items(tmp_path, "frame1", [{'label': "Milk"}])
+    path = outbox_path(tmp_path, "frame1")
+    path.replace(path.with_suffix(".sending"))
+    queue_items(tmp_path, "frame1", [{'label': "Bread"}])
+
+    api = FakeFrame()
+    assert _push(api, tmp_path) == {'pushed': 1, 'failed': 0}
+    assert [label for _, label, _ in api.added] == ["Milk"]
+    assert _outbox_labels(tmp_path) == ["Bread"]
+    assert _push(api, tmp_path) == {'pushed': 1, 'failed': 0}
+    assert _outbox_labels(tmp_path) == []
@@ -0,0 +1,133 @@
+"""Edit distance and the trigram FuzzyMatcher"""
+
+import random
+
+import pytest
+
+from lib.fuzzy_matcher import FuzzyMatcher, levenshtein, normalize_name, similarity
+
+
+def reference_levenshtein(a: str, b: str) -> int:
+    """Textbook dynamic-programming edit distance"""
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+@pytest.mark.parametrize("a, b", [
+    ("", ""), ("", "abc"), ("kitten", "sitting"), ("flaw", "lawn"),
+    ("peanut butter", "butter peanut"), ("a" * 70, "a" * 69 + "b"),
+])
+def test_levenshtein_examples(a, b):
+    assert levenshtein(a, b) == reference_levenshtein(a, b)
+
+
+def test_levenshtein_matches_reference():
+    rng = random.Random(3)
+    for _ in range(2000):
+        # Short alphabet so strings share characters; lengths cross the 64-bit word size
+        a = "".join(rng.choice("abc ") for _ in range(rng.randrange(0, 90)))
+        b = "".join(rng.choice("abc ") for _ in range(rng.randrange(0, 90)))
+        assert levenshtein(a, b) == reference_levenshtein(a, b), (a, b)
+
+
+def test_similarity_bounds():
+    assert similarity("", "") == 1.0
+    assert similarity("milk", "milk") == 1.0
+    assert similarity("abc", "xyz") == 0.0
+
+
+def test_normalize_name():
+    assert normalize_name("  Crème-Fraîche (30%) ") == "creme fraiche 30"
+
+
+PRODUCTS = [
+    ("1", "Whole Milk"),
+    ("2", "Semi-Skimmed Milk"),
+    ("3", "Peanut Butter Crunchy"),
+    ("4", "Crème Fraîche"),
+    ("5", "Spaghetti"),
+    ("6", None),
+    ("7", "Orange Juice"),
+]
+
+
+def _codes(matches):
+    return [m.code for m in matches]
+
+
+def test_match():
+    matcher = FuzzyMatcher.from_products(PRODUCTS)
+    assert len(matcher.codes) == 6
+    assert matcher.match("whole milk")[0].code == "1"
+    assert matcher.match("peanut buter")[0].code == "3"
+    assert matcher.match("creme fraiche")[0].code == "4"
+    assert matcher.match("spagetti")[0].code == "5"
+    assert matcher.match("???") == []
+    scores = [m.score for m in matcher.match("milk")]
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_match_many_repeats():
+    matcher = FuzzyMatcher.from_products(PRODUCTS)
+    results = matcher.match_many(["milk", "orange juice", "milk"], k=2)
+    assert results[0] == results[2]
+    assert results[1][0].code == "7"
+
+
+def _catalogue(rng, n):
+    words = ["milk", "bread", "cheese", "apple", "juice", "butter", "yogurt", "pasta",
+             "tomato", "rice", "organic", "light", "extra", "family", "pack"]
+    return [(str(i), " ".join(rng.choice(words) for _ in range(rng.randrange(1, 4))) + f" {i % 97}")
+            for i in range(n)]
+
+
+def test_incremental_add_matches_full_build(monkeypatch):
+    # Merge often so both the delta lists and merged postings are exercised
+    monkeypatch.setattr("lib.fuzzy_matcher.DELTA_MERGE_MIN", 50)
+    rng = random.Random(5)
+    products = _catalogue(rng, 1500)
+    full = FuzzyMatcher.from_products(products)
+    incremental = FuzzyMatcher.from_products(products[:200])
+    for code, name in products[200:]:
+        assert incremental.add(code, name)
+    assert not incremental.add("0", "duplicate code")
+    assert not incremental.add("new", None)
+
+    for query in ["milk bread", "organic juice 5", "tomato rice", "extra light butter 12"]:
+        assert incremental.match(query, k=10) == full.match(query, k=10)
+
+
+def test_add_from_cache(tmp_path):
+    from lib.openfoodfacts_api import OFFProduct
+    from lib.product_codec import ProductCache
+
+    cache = ProductCache(tmp_path / "products.bin")
+    cache.put(OFFProduct(code="3017620422003", product_name="Nutella"))
+    matcher = FuzzyMatcher.from_product_cache(cache)
+    assert _codes(matcher.match("nutella")) == ["3017620422003"]
+
+    cache.put(OFFProduct(code="5449000000996", product_name="Coca-Cola"))
+    assert matcher.add_from_cache(cache) == 1
+    assert matcher.add_from_cache(cache) == 0
+    assert _codes(matcher.match("coca cola")) == ["5449000000996"]
+    cache.close()
+
+
+def test_save_load(tmp_path):
+    rng = random.Random(9)
+    products = _catalogue(rng, 300)
+    matcher = FuzzyMatcher.from_products(products[:250])
+    for code, name in products[250:]:
+        matcher.add(code, name)
+    matcher.save(tmp_path / "names.npz")
+
+    loaded = FuzzyMatcher.load(tmp_path / "names.npz")
+    for query in ["cheese pasta", "family pack 3", "yogurt"]:
+        assert loaded.match(query, k=5) == matcher.match(query, k=5)
+    assert loaded.add("new", "cheese pasta deluxe")
+    assert "new" in _codes(loaded.match("cheese pasta deluxe"))
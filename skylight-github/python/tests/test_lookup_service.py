@@ -0,0 +1,204 @@
+"""Shared lookup service against the stand-in OFF server"""
+
+import asyncio
+import contextlib
+import io
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+import lookup_service
+from lib.metrics import metrics
+from lib.openfoodfacts_api import OpenFoodFactsAPI
+from lib.product_codec import ProductCache
+from lookup_service import MAX_CLIENT_LABELS, Coalescer, _write_thumbnail, build_service_app
+from mock_servers import MockConfig, load_products, start_mock_server
+
+PRODUCTS = {p["product_name"]: p for p in load_products() if p.get("product_name")}
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics(monkeypatch):
+    was_enabled = metrics.enabled
+    metrics.reset()
+    metrics.enable()
+    monkeypatch.setattr(lookup_service, "_client_labels", set())
+    yield
+    metrics.reset()
+    metrics.enabled = was_enabled
+
+
+@contextlib.asynccontextmanager
+async def serve(tmp_path, config=None, off_url=None, timeout=None):
+    """Yield (service URL, stand-in stats, api) for a service in front of the stand-in"""
+    off_runner, mock_url = await start_mock_server(config)
+    api = OpenFoodFactsAPI(base_url=off_url or mock_url, cache=ProductCache(tmp_path / "products.bin"))
+    if timeout is not None:
+        api.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout))
+    runner = web.AppRunner(build_service_app(api, tmp_path / "thumbnails"))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    try:
+        yield f"http://127.0.0.1:{runner.addresses[0][1]}", off_runner.app["stats"], api
+    finally:
+        await runner.cleanup()
+        await api.close()
+        api.cache.close()
+        await off_runner.cleanup()
+
+
+async def get(session, url, **kwargs):
+    async with session.get(url, **kwargs) as response:
+        body = await response.json() if response.content_type == "application/json" else await response.read()
+        return response.status, body
+
+
+def test_concurrent_lookups_share_one_upstream_request(tmp_path):
+    async def run():
+        async with serve(tmp_path, MockConfig(latency_ms=100)) as (url, stats, _):
+            async with aiohttp.ClientSession() as session:
+                results = await asyncio.gather(
+                    *(get(session, f"{url}/api/v2/product/4006381333931") for _ in range(10))
+                )
+                # Later lookups come from the cache
+                again = await get(session, f"{url}/api/v2/product/4006381333931")
+            return results + [again], stats.to_dict()
+
+    results, upstream = asyncio.run(run())
+    assert {status for status, _ in results} == {200}
+    assert all(body["status"] == 1 and body["code"] == "4006381333931" for _, body in results)
+    assert upstream == {"/api/v2/product/{barcode}": {"200": 1}}
+    assert metrics.to_dict()["service_coalesced_total"][0]["value"] == 9
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_call():
+    async def run():
+        coalescer = Coalescer("test")
+        release = asyncio.Event()
+        calls = []
+
+        async def factory():
+            calls.append(1)
+            await release.wait()
+            return 42
+
+        first = asyncio.create_task(coalescer.run("key", factory))
+        second = asyncio.create_task(coalescer.run("key", factory))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        result = await second
+        await asyncio.sleep(0)
+        return result, calls, len(coalescer), first.cancelled()
+
+    assert asyncio.run(run()) == (42, [1], 0, True)
+
+
+def test_unreachable_upstream_is_502(tmp_path):
+    async def run():
+        # A port nothing listens on: bind one, then let it go
+        dead_runner, dead_url = await start_mock_server()
+        await dead_runner.cleanup()
+        async with serve(tmp_path, off_url=dead_url) as (url, _, _):
+            async with aiohttp.ClientSession() as session:
+                return await get(session, f"{url}/api/v2/product/4006381333931")
+
+    status, body = asyncio.run(run())
+    assert status == 502
+    assert body["status"] == 0 and body["status_verbose"].startswith("upstream error")
+
+
+def test_slow_upstream_is_504(tmp_path):
+    async def run():
+        async with serve(tmp_path, MockConfig(latency_ms=500), timeout=0.05) as (url, _, _):
+            async with aiohttp.ClientSession() as session:
+                return await get(session, f"{url}/api/v2/product/4006381333931")
+
+    status, body = asyncio.run(run())
+    assert status == 504
+    assert body["status_verbose"] == "upstream timeout"
+
+
+def test_client_labels_are_capped(tmp_path):
+    async def run():
+        async with serve(tmp_path) as (url, _, _):
+            async with aiohttp.ClientSession() as session:
+                for i in range(MAX_CLIENT_LABELS + 5):
+                    await get(session, f"{url}/healthz", headers={"X-Skylight-Client": f"client-{i}"})
+                await get(session, f"{url}/healthz", headers={"X-Skylight-Client": "client-0"})
+
+    asyncio.run(run())
+    counts = {row["labels"]["client"]: row["value"] for row in metrics.to_dict()["service_requests_total"]}
+    assert len(counts) == MAX_CLIENT_LABELS + 1
+    assert counts["other"] == 5
+    assert counts["client-0"] == 2
+    assert f"client-{MAX_CLIENT_LABELS}" not in counts
+
+
+def test_search_answers_locally_only_with_confident_matches(tmp_path):
+    nutella = PRODUCTS["Nutella"]["code"]
+
+    async def run():
+        async with serve(tmp_path) as (url, stats, _):
+            async with aiohttp.ClientSession() as session:
+                # "chocolate" is a weak (~0.4) fuzzy match for Coca-Cola
+                for code in (nutella, PRODUCTS["Coca-Cola"]["code"]):
+                    await get(session, f"{url}/api/v2/product/{code}")
+                exact = await get(session, f"{url}/cgi/search.pl",
+                                  params={"search_terms": "nutella", "page_size": "1"})
+                searches_after_exact = stats.to_dict().get("/cgi/search.pl")
+                unrelated = await get(session, f"{url}/cgi/search.pl",
+                                      params={"search_terms": "chocolate", "page_size": "3"})
+            return exact, searches_after_exact, unrelated
+
+    (_, exact), searches_after_exact, (_, unrelated) = asyncio.run(run())
+    assert [p["code"] for p in exact["products"]] == [nutella]
+    assert searches_after_exact is None
+    assert unrelated["count"] == 3
+    sources = {row["labels"]["source"]: row["value"] for row in metrics.to_dict()["service_search_total"]}
+    assert sources == {"local": 1, "remote": 1}
+
+
+def test_search_tops_up_a_short_local_page_from_off(tmp_path):
+    coca_cola = PRODUCTS["Coca-Cola"]["code"]
+
+    async def run():
+        async with serve(tmp_path) as (url, _, _):
+            async with aiohttp.ClientSession() as session:
+                await get(session, f"{url}/api/v2/product/{coca_cola}")
+                return await get(session, f"{url}/cgi/search.pl",
+                                 params={"search_terms": "coca cola", "page_size": "3"})
+
+    _, body = asyncio.run(run())
+    codes = [p["code"] for p in body["products"]]
+    assert codes[0] == coca_cola
+    assert len(codes) == len(set(codes)) == 3
+    assert metrics.to_dict()["service_search_total"][0]["labels"] == {"source": "mixed"}
+
+
+def test_undecodable_image_leaves_no_thumbnail_files(tmp_path):
+    pytest.importorskip("PIL")
+
+    async def run():
+        async with serve(tmp_path) as (url, _, _):
+            async with aiohttp.ClientSession() as session:
+                return await get(session, f"{url}/thumbnails/{PRODUCTS['Nutella']['code']}.jpg")
+
+    status, _ = asyncio.run(run())
+    assert status == 404
+    assert list((tmp_path / "thumbnails").iterdir()) == []
+
+
+def test_write_thumbnail_downscales(tmp_path):
+    Image = pytest.importorskip("PIL.Image")
+    buffer = io.BytesIO()
+    Image.new("RGB", (640, 320), "red").save(buffer, "PNG")
+
+    path = tmp_path / "123-200.jpg"
+    assert _write_thumbnail(buffer.getvalue(), 200, path)
+    with Image.open(path) as image:
+        assert image.format == "JPEG" and image.size == (200, 100)
+    assert not _write_thumbnail(b"not an image", 200, tmp_path / "456-200.jpg")
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["123-200.jpg"]
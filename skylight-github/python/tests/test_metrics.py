@@ -0,0 +1,133 @@
+"""MetricsRegistry, histogram quantiles and exports"""
+
+import asyncio
+import json
+
+import pytest
+
+from lib.metrics import MetricsRegistry, Histogram, metrics, percentile
+from lib.openfoodfacts_api import OpenFoodFactsAPI
+from mock_servers import load_products, start_mock_server
+
+
+def test_disabled_registry_records_nothing():
+    registry = MetricsRegistry()
+    registry.counter("requests_total").inc()
+    with registry.histogram("request_seconds").time():
+        pass
+    assert registry.to_dict() == {}
+
+
+def test_counters_and_gauges_are_keyed_by_labels():
+    registry = MetricsRegistry(enabled=True)
+    registry.counter("requests_total", status=200).inc()
+    registry.counter("requests_total", status="200").inc(2)
+    registry.counter("requests_total", status=404).inc()
+    gauge = registry.gauge("queue_depth")
+    gauge.inc(3)
+    gauge.dec()
+
+    data = registry.to_dict()
+    assert sorted((row["labels"]["status"], row["value"]) for row in data["requests_total"]) == [
+        ("200", 3.0), ("404", 1.0)
+    ]
+    assert data["queue_depth"] == [{"labels": {}, "value": 2.0}]
+
+
+def test_kind_mismatch_is_rejected():
+    registry = MetricsRegistry(enabled=True)
+    registry.counter("things")
+    with pytest.raises(ValueError):
+        registry.gauge("things", other="label")
+
+
+def test_histogram_quantiles_are_bucket_upper_bounds():
+    histogram = Histogram(buckets=(0.1, 0.5, 1.0))
+    for value in (0.05, 0.05, 0.3, 0.3, 0.3, 0.3, 0.3, 0.3, 0.9, 1.0):
+        histogram.observe(value)
+    assert histogram.count == 10
+    assert histogram.sum == pytest.approx(3.8)
+    assert histogram.quantile(0.2) == 0.1
+    assert histogram.quantile(0.5) == 0.5
+    assert histogram.quantile(1.0) == 1.0
+    assert histogram.overflow == 0
+
+
+def test_histogram_quantile_above_largest_bucket_is_none():
+    histogram = Histogram(buckets=(0.1, 0.5))
+    histogram.observe(0.05)
+    for _ in range(9):
+        histogram.observe(30.0)
+    assert histogram.overflow == 9
+    assert histogram.quantile(0.1) == 0.1
+    assert histogram.quantile(0.5) is None
+    assert Histogram().quantile(0.5) is None
+
+
+def test_render_json_is_valid_with_overflowing_histograms():
+    registry = MetricsRegistry(enabled=True)
+    registry.histogram("sync_seconds", buckets=(1.0,)).observe(5.0)
+    data = json.loads(registry.render_json())
+    assert data["sync_seconds"] == [{
+        "labels": {}, "count": 1, "sum": 5.0, "p50": None, "p95": None, "p99": None, "overflow": 1,
+    }]
+
+
+def test_render_prometheus_has_cumulative_buckets():
+    registry = MetricsRegistry(enabled=True)
+    histogram = registry.histogram("request_seconds", buckets=(0.1, 1.0), endpoint="product")
+    for value in (0.05, 0.5, 2.0):
+        histogram.observe(value)
+    registry.counter("errors_total", reason='say "hi"\n').inc()
+
+    lines = registry.render_prometheus().splitlines()
+    assert "# TYPE request_seconds histogram" in lines
+    assert 'request_seconds_bucket{endpoint="product",le="0.1"} 1' in lines
+    assert 'request_seconds_bucket{endpoint="product",le="1.0"} 2' in lines
+    assert 'request_seconds_bucket{endpoint="product",le="+Inf"} 3' in lines
+    assert 'request_seconds_count{endpoint="product"} 3' in lines
+    assert 'errors_total{reason="say \\"hi\\"\\n"} 1.0' in lines
+
+
+def test_write_picks_format_from_suffix(tmp_path):
+    registry = MetricsRegistry(enabled=True)
+    registry.counter("scans_total").inc()
+    registry.write(tmp_path / "metrics.json")
+    registry.write(tmp_path / "metrics.prom")
+    assert json.loads((tmp_path / "metrics.json").read_text())["scans_total"][0]["value"] == 1.0
+    assert "scans_total 1.0" in (tmp_path / "metrics.prom").read_text()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["metrics.json", "metrics.prom"]
+
+
+def test_percentile_nearest_rank():
+    samples = [5, 1, 4, 2, 3]
+    assert percentile(samples, 50) == 3
+    assert percentile(samples, 0) == 1
+    assert percentile(samples, 100) == 5
+    assert percentile([], 50) == 0.0
+
+
+def test_off_client_records_request_metrics():
+    code = load_products()[0]["code"]
+
+    async def run():
+        runner, base_url = await start_mock_server()
+        api = OpenFoodFactsAPI(base_url=base_url)
+        try:
+            await api.get_product(code)
+        finally:
+            await api.close()
+            await runner.cleanup()
+
+    was_enabled = metrics.enabled
+    metrics.reset()
+    metrics.enable()
+    try:
+        asyncio.run(run())
+        data = metrics.to_dict()
+    finally:
+        metrics.reset()
+        metrics.enabled = was_enabled
+
+    assert data["off_http_requests_total"] == [{"labels": {"endpoint": "product", "status": "200"}, "value": 1.0}]
+    assert data["off_http_request_seconds"][0]["count"] == 1
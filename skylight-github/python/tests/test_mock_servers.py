@@ -0,0 +1,69 @@
+"""Stand-in servers and the load generator report"""
+
+import asyncio
+from collections import Counter
+
+import aiohttp
+
+from lib.openfoodfacts_api import OpenFoodFactsAPI
+from load_generator import LoadReport, generate_load
+from mock_servers import MockConfig, load_products, start_mock_server
+
+
+def test_start_mock_server_binds_a_free_port():
+    code = load_products()[0]["code"]
+
+    async def run():
+        runner, base_url = await start_mock_server()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{base_url}/api/v2/product/{code}") as response:
+                    return base_url, response.status, await response.json()
+        finally:
+            await runner.cleanup()
+
+    base_url, status, data = asyncio.run(run())
+    assert not base_url.endswith(":0")
+    assert status == 200
+    assert data["status"] == 1 and data["code"] == code
+
+
+def test_rate_limited_responses_carry_retry_after():
+    async def run():
+        runner, base_url = await start_mock_server(MockConfig(rate_limit_rate=1.0, retry_after=7))
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"{base_url}/api/v2/product/123") as response:
+                    return response.status, response.headers.get("Retry-After"), runner.app["stats"].to_dict()
+        finally:
+            await runner.cleanup()
+
+    status, retry_after, stats = asyncio.run(run())
+    assert (status, retry_after) == (429, "7")
+    assert stats == {"/api/v2/product/{barcode}": {"429": 1}}
+
+
+def test_load_report_percentiles_in_milliseconds():
+    report = LoadReport(target_rate=10, duration=1, latencies=[i / 1000 for i in range(1, 101)])
+    assert report.percentile(50) == 50.0
+    assert report.percentile(99) == 99.0
+    assert report.percentile(100) == 100.0
+    assert LoadReport(target_rate=10, duration=1).percentile(50) == 0.0
+
+
+def test_generate_load_counts_every_request():
+    codes = [p["code"] for p in load_products() if p.get("product_name")][:5]
+
+    async def run():
+        runner, base_url = await start_mock_server()
+        api = OpenFoodFactsAPI(base_url=base_url)
+        try:
+            return await generate_load(api, codes, rate=200, duration=0.1)
+        finally:
+            await api.close()
+            await runner.cleanup()
+
+    report = asyncio.run(run())
+    assert report.outcomes == Counter(found=20)
+    assert len(report.latencies) == 20
+    assert 0 < report.to_dict()["p50_ms"] <= report.to_dict()["p99_ms"]
@@ -0,0 +1,116 @@
+"""NutritionMatrix and quantity parsing"""
+
+import math
+
+import pytest
+
+from lib.nutrition_analytics import NutritionMatrix, parse_grams
+from lib.openfoodfacts_api import OFFNutriments, OFFProduct
+
+
+def product(code, kcal=None, sugars=None, categories=None, grade=None, nova=None,
+            serving_size=None, quantity=None):
+    return OFFProduct(
+        code=code,
+        categories=categories,
+        serving_size=serving_size,
+        quantity=quantity,
+        nutriments=OFFNutriments(energy_kcal_100g=kcal, sugars_100g=sugars),
+        nutriscore_grade=grade,
+        nova_group=nova,
+    )
+
+
+@pytest.mark.parametrize("text, grams", [
+    ("400 g", 400.0),
+    ("1.5 L", 1500.0),
+    ("1,5 l", 1500.0),
+    ("33 cl", 330.0),
+    ("250mg", 0.25),
+    ("0.5 kg", 500.0),
+    ("4 x 125 g", 500.0),
+    ("6×33cl", 1980.0),
+    ("2 slices (50 g)", 50.0),
+])
+def test_parse_grams(text, grams):
+    assert parse_grams(text) == pytest.approx(grams)
+
+
+@pytest.mark.parametrize("text", [None, "", "1 jar", "12 pieces"])
+def test_parse_grams_without_an_amount_is_nan(text):
+    assert math.isnan(parse_grams(text))
+
+
+def test_totals_on_each_basis():
+    matrix = NutritionMatrix()
+    matrix.add(product("1", kcal=500, sugars=50, serving_size="15 g", quantity="400 g"))
+    matrix.add(product("2", kcal=40, sugars=None, serving_size="330 ml", quantity="6 x 330 ml"), count=2)
+
+    assert matrix.totals()["energy_kcal_100g"] == pytest.approx(500 + 2 * 40)
+    assert matrix.totals()["sugars_100g"] == pytest.approx(50)
+    assert matrix.totals("serving")["energy_kcal_100g"] == pytest.approx(75 + 2 * 132)
+    assert matrix.totals("package")["energy_kcal_100g"] == pytest.approx(2000 + 2 * 792)
+    assert matrix.coverage()["sugars_100g"] == 1
+    assert matrix.means()["energy_kcal_100g"] == pytest.approx(270)
+    assert matrix.means()["fat_100g"] is None
+    with pytest.raises(ValueError):
+        matrix.totals("cup")
+
+
+def test_remove_and_row_reuse():
+    matrix = NutritionMatrix(capacity=2)
+    matrix.add(product("1", kcal=100))
+    matrix.add(product("2", kcal=200))
+    assert matrix.remove("1")
+    assert not matrix.remove("1")
+    assert "1" not in matrix and len(matrix) == 1
+    assert matrix.totals()["energy_kcal_100g"] == pytest.approx(200)
+
+    # The freed row is reused instead of growing the arrays
+    matrix.add(product("3", kcal=300))
+    assert len(matrix.active) == 2
+    assert matrix.totals()["energy_kcal_100g"] == pytest.approx(500)
+
+    # Re-adding a barcode replaces its row
+    matrix.add(product("3", kcal=30))
+    assert len(matrix) == 2
+    assert matrix.totals()["energy_kcal_100g"] == pytest.approx(230)
+
+
+def test_grows_past_capacity():
+    matrix = NutritionMatrix(capacity=1)
+    matrix.add_many(product(str(i), kcal=i) for i in range(10))
+    assert len(matrix) == 10
+    assert len(matrix.active) >= 10
+    assert matrix.totals()["energy_kcal_100g"] == pytest.approx(sum(range(10)))
+
+
+def test_set_count():
+    matrix = NutritionMatrix()
+    matrix.add(product("1", kcal=100))
+    matrix.set_count("1", 3)
+    assert matrix.totals()["energy_kcal_100g"] == pytest.approx(300)
+
+
+def test_string_nutriments_are_parsed_or_ignored():
+    matrix = NutritionMatrix()
+    matrix.add(OFFProduct(code="1", nutriments=OFFNutriments(energy_kcal_100g="1,5", sugars_100g="")))
+    matrix.add(OFFProduct(code="2"))
+    totals = matrix.totals()
+    assert totals["energy_kcal_100g"] == pytest.approx(1.5)
+    assert totals["sugars_100g"] == 0.0
+    assert matrix.coverage()["sugars_100g"] == 0
+
+
+def test_categories_and_score_distributions():
+    matrix = NutritionMatrix()
+    matrix.add(product("1", kcal=10, categories="Dairies, Yogurts", grade="A", nova=1))
+    matrix.add(product("2", kcal=20, categories="Snacks", grade="e", nova=4))
+    matrix.add(product("3", kcal=30, categories="Snacks, Chips", nova=7))
+    matrix.remove("1")
+
+    assert matrix.category_counts() == {"snacks": 2}
+    assert matrix.by_category()["snacks"]["energy_kcal_100g"] == pytest.approx(50)
+    assert matrix.nutriscore_distribution() == {"unknown": 1, "a": 0, "b": 0, "c": 0, "d": 0, "e": 1}
+    assert matrix.nova_distribution() == {"unknown": 1, "1": 0, "2": 0, "3": 0, "4": 1}
+    assert matrix.summary()["products"] == 2
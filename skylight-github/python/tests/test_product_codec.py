@@ -0,0 +1,143 @@
+"""Product record codec and ProductCache"""
+
+import struct
+
+import pytest
+
+from lib.openfoodfacts_api import OFFNutriments, OFFProduct
+from lib.product_codec import (
+    FORMAT_VERSION, CodecError, ProductCache, as_float, decode_product, encode_product,
+)
+
+NUTELLA = OFFProduct(
+    code="3017620422003",
+    product_name="Nutella",
+    brands="Ferrero",
+    categories="Spreads, Sweet spreads",
+    quantity="400 g",
+    nutriments=OFFNutriments(energy_kcal_100g=539.0, fat_100g=30.9, sugars_100g=56.3),
+    nutriscore_grade="e",
+    nova_group=4,
+)
+
+
+def test_round_trip():
+    assert decode_product(encode_product(NUTELLA)) == NUTELLA
+
+
+def test_round_trip_minimal_product():
+    product = OFFProduct(code="5449000000996")
+    assert decode_product(encode_product(product)) == product
+
+
+def test_round_trip_empty_and_unicode_strings():
+    product = OFFProduct(code="3017620422003", product_name="Crème brûlée 🍮", brands="")
+    assert decode_product(encode_product(product)) == product
+
+
+def test_string_nutriments_are_coerced():
+    product = OFFProduct(code="3017620422003", nutriments=OFFNutriments(fat_100g="30,9", salt_100g="n/a"))
+    nutriments = decode_product(encode_product(product)).nutriments
+    assert nutriments.fat_100g == 30.9
+    assert nutriments.salt_100g is None
+
+
+@pytest.mark.parametrize("value, expected", [
+    (1, 1.0), ("2.5", 2.5), (" 3,5 ", 3.5), ("", None), ("abc", None), (None, None),
+])
+def test_as_float(value, expected):
+    assert as_float(value) == expected
+
+
+def test_truncated_record():
+    record = encode_product(NUTELLA)
+    with pytest.raises(CodecError):
+        decode_product(record[:3])
+    with pytest.raises(CodecError):
+        decode_product(record[:12])
+
+
+def test_wrong_version():
+    record = bytearray(encode_product(NUTELLA))
+    record[0] = FORMAT_VERSION + 1
+    with pytest.raises(CodecError, match="version"):
+        decode_product(bytes(record))
+
+
+def test_corrupt_strings():
+    record = encode_product(NUTELLA) + b"\x00extra"
+    with pytest.raises(CodecError):
+        decode_product(record)
+    with pytest.raises(CodecError):
+        decode_product(encode_product(NUTELLA)[:-1] + b"\xff")
+
+
+def test_cache_round_trip_and_reopen(tmp_path):
+    cache = ProductCache(tmp_path / "products.bin")
+    cache.put(NUTELLA)
+    assert cache.get(NUTELLA.code) == NUTELLA
+    cache.close()
+
+    cache = ProductCache(tmp_path / "products.bin")
+    assert cache.get(NUTELLA.code) == NUTELLA
+    assert len(cache) == 1
+    cache.close()
+
+
+def test_cache_normalizes_barcodes(tmp_path):
+    cache = ProductCache(tmp_path / "products.bin")
+    cola = OFFProduct(code="0049000000443", product_name="Coca-Cola")
+    cache.put(cola, barcode=" 049000000443 ")
+    assert cache.get("049000000443") == cola
+    assert cache.get("0049000000443") == cola
+    assert "00049000000443" in cache
+    cache.close()
+
+
+def test_cache_drops_undecodable_entry(tmp_path):
+    path = tmp_path / "products.bin"
+    cache = ProductCache(path)
+    cache.put(NUTELLA)
+    cache.close()
+
+    # Bump the record's version byte, just after the entry header and code
+    data = bytearray(path.read_bytes())
+    data[struct.calcsize("<IdH") + len(NUTELLA.code)] = FORMAT_VERSION + 1
+    path.write_bytes(bytes(data))
+
+    cache = ProductCache(path)
+    assert cache.get(NUTELLA.code) is None
+    assert NUTELLA.code not in cache
+    cache.put(NUTELLA)
+    assert cache.get(NUTELLA.code) == NUTELLA
+    cache.close()
+
+
+def test_cache_truncates_torn_tail(tmp_path):
+    path = tmp_path / "products.bin"
+    cache = ProductCache(path)
+    cache.put(NUTELLA)
+    size = path.stat().st_size
+    cache.put(OFFProduct(code="5449000000996", product_name="Coca-Cola"))
+    cache.close()
+    with open(path, "r+b") as f:
+        f.truncate(size + 10)
+
+    cache = ProductCache(path)
+    assert list(cache.codes()) == [NUTELLA.code]
+    assert path.stat().st_size == size
+    cache.close()
+
+
+def test_codes_since(tmp_path):
+    cache = ProductCache(tmp_path / "products.bin")
+    cache.put(NUTELLA)
+    codes, position = cache.codes_since(0)
+    assert codes == [NUTELLA.code]
+
+    cache.put(NUTELLA)  # replacing an entry is not a new code
+    cache.put(OFFProduct(code="5449000000996"))
+    codes, position = cache.codes_since(position)
+    assert codes == ["5449000000996"]
+    assert cache.codes_since(position) == ([], position)
+    cache.close()
@@ -0,0 +1,139 @@
+"""RestockPredictor model, batching and persistence"""
+
+import random
+
+import numpy as np
+import pytest
+
+from lib.restock import DAY, RestockPredictor
+from lib.scan_history import ScanEvents, ScanHistory
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = ScanHistory(tmp_path / "history")
+    yield history
+    history.close()
+
+
+def _fill(history, rng, scans=60, products=8, first_day=0):
+    """Daily scans of products used up at different rates and restocked when empty"""
+    stock = {f"p{i}": float(rng.randrange(2, 10)) for i in range(products)}
+    for day in range(scans):
+        counts = {}
+        for code in stock:
+            if rng.random() < 0.3:
+                continue  # not in this photo
+            stock[code] -= rng.choice([0, 0, 1, 2])
+            if stock[code] <= 0:
+                stock[code] = float(rng.randrange(4, 10))
+            counts[code] = stock[code]
+        history.append_scan(counts, (first_day + day) * DAY + rng.random() * 3600)
+
+
+def _state(predictor):
+    return (predictor.last_ts, predictor.last_qty, predictor.consumed, predictor.elapsed,
+            predictor.observations, predictor.restocks)
+
+
+def _assert_same(a, b):
+    for x, y in zip(_state(a), _state(b)):
+        np.testing.assert_allclose(x, y, rtol=1e-9)
+
+
+def test_constant_use_rate(history):
+    for day in range(5):
+        history.append("milk", 10 - 2 * day, day * DAY)
+    predictor = RestockPredictor()
+    assert predictor.update(history) == 5
+    assert predictor.rates_per_day()[0] == pytest.approx(2.0)
+    assert predictor.update(history) == 0
+
+    # 2 left at day 4, used at 2 a day: out within 3 days at day 4 + 0.5
+    [suggestion] = predictor.suggest(history, now=4.5 * DAY)
+    assert suggestion.barcode == "milk"
+    assert suggestion.days_left == pytest.approx(0.5)
+    assert predictor.suggest(history, now=4 * DAY, lead_days=0.5) == []
+
+
+def test_restock_interval_is_skipped(history):
+    for day, qty in enumerate([6, 4, 10, 8]):
+        history.append("rice", qty, day * DAY)
+    predictor = RestockPredictor(half_life_days=1e9)
+    predictor.update(history)
+    assert predictor.restocks[0] == 1
+    assert predictor.rates_per_day()[0] == pytest.approx(2.0)
+
+
+def test_run_out_is_suggested(history):
+    history.append_scan({"bread": 1, "jam": 1}, 0.0)
+    history.append_scan({"bread": 0, "jam": 1}, 2 * DAY)
+    predictor = RestockPredictor()
+    predictor.update(history)
+    assert predictor.held(history) == ["jam"]
+    assert [s.barcode for s in predictor.suggest(history, now=2 * DAY)] == ["bread"]
+
+
+def test_update_is_batch_invariant(history):
+    _fill(history, random.Random(11), scans=30)
+    history.append_scan({"p1": 3, "p2": 1}, 10 * DAY)  # a scan recorded late
+    _fill(history, random.Random(13), scans=30, first_day=30)
+    whole = RestockPredictor()
+    whole.update(history)
+
+    events = history.events()
+    rng = random.Random(12)
+    cuts = sorted(rng.sample(range(1, len(events)), 15))
+    batched = RestockPredictor()
+    for start, end in zip([0] + cuts, cuts + [len(events)]):
+        batched.apply(ScanEvents(
+            start, events.product_ids[start:end], events.timestamps[start:end], events.quantities[start:end]
+        ))
+    _assert_same(whole, batched)
+
+
+def test_update_after_reopen_matches_one_pass(tmp_path):
+    rng = random.Random(21)
+    history = ScanHistory(tmp_path / "history", chunk_size=16)
+    _fill(history, rng, scans=30)
+    incremental = RestockPredictor()
+    incremental.update(history)
+    incremental.save(tmp_path / "restock.npz")
+    history.close()
+
+    history = ScanHistory(tmp_path / "history", chunk_size=16)
+    _fill(history, rng, scans=30, first_day=30)
+    incremental = RestockPredictor.load(tmp_path / "restock.npz")
+    assert incremental.update(history) > 0
+    whole = RestockPredictor()
+    whole.update(history)
+    history.close()
+    _assert_same(whole, incremental)
+
+
+def test_out_of_order_events_are_ignored(history):
+    history.append("tea", 5, 10 * DAY)
+    history.append("tea", 9, 1 * DAY)  # recorded late, older than what the model has
+    predictor = RestockPredictor()
+    predictor.update(history)
+    assert predictor.observations[0] == 1
+    assert predictor.last_qty[0] == 5
+
+    history.append("tea", 7, 5 * DAY)
+    assert predictor.update(history) == 1
+    assert predictor.observations[0] == 1
+
+
+def test_save_load(tmp_path, history):
+    _fill(history, random.Random(31))
+    predictor = RestockPredictor(half_life_days=10)
+    predictor.update(history)
+    predictor.save(tmp_path / "restock.npz")
+    assert not list(tmp_path.glob("*.tmp*"))
+
+    loaded = RestockPredictor.load(tmp_path / "restock.npz")
+    assert loaded.seq == predictor.seq == len(history)
+    assert loaded.half_life == pytest.approx(predictor.half_life)
+    _assert_same(predictor, loaded)
+    now = 60 * DAY
+    assert loaded.suggest(history, now=now, lead_days=30) == predictor.suggest(history, now=now, lead_days=30)
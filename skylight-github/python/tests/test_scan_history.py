@@ -0,0 +1,108 @@
+"""ScanHistory storage and recovery"""
+
+import numpy as np
+
+from lib.scan_history import ScanHistory
+
+
+def _events(history, start=0):
+    events = history.events(start)
+    return list(zip(
+        (history.barcodes[i] for i in events.product_ids.tolist()),
+        events.timestamps.tolist(),
+        events.quantities.tolist(),
+    ))
+
+
+def test_append_and_read(tmp_path):
+    history = ScanHistory(tmp_path)
+    assert len(history) == 0
+    assert len(history.events()) == 0
+    history.append_scan({"a": 2, "b": 1.5}, 100.0)
+    history.append("a", 1, 200.0)
+    history.append_scan({}, 300.0)  # nothing seen, nothing recorded
+    assert len(history) == 3
+    assert _events(history) == [("a", 100.0, 2.0), ("b", 100.0, 1.5), ("a", 200.0, 1.0)]
+    assert _events(history, 2) == [("a", 200.0, 1.0)]
+    assert history.events(2).start == 2
+    assert len(history.events(10)) == 0
+    history.close()
+
+
+def test_reopen(tmp_path):
+    history = ScanHistory(tmp_path)
+    history.append_scan({"a": 1, "b": 2}, 100.0)
+    history.close()
+
+    history = ScanHistory(tmp_path)
+    assert history.barcodes == ["a", "b"]
+    history.append("c", 3, 200.0)
+    assert _events(history) == [("a", 100.0, 1.0), ("b", 100.0, 2.0), ("c", 200.0, 3.0)]
+    history.close()
+
+
+def test_seal_and_reopen(tmp_path):
+    history = ScanHistory(tmp_path, chunk_size=4)
+    expected = []
+    for i in range(11):
+        history.append(f"p{i % 3}", i, float(i))
+        expected.append((f"p{i % 3}", float(i), float(i)))
+    assert sorted(p.name for p in tmp_path.glob("chunk-*.bin")) == ["chunk-000000.bin", "chunk-000001.bin"]
+    assert _events(history) == expected
+    history.close()
+
+    history = ScanHistory(tmp_path, chunk_size=4)
+    assert len(history) == 11
+    assert _events(history) == expected
+    # Suffixes starting inside a sealed chunk, at a boundary and in the tail
+    for start in (3, 4, 9):
+        assert _events(history, start) == expected[start:]
+    # A scan that fills the tail and spills into the next chunk
+    history.append_scan({"x": 1, "y": 2, "z": 3}, 20.0)
+    assert len(history) == 14
+    assert _events(history, 11) == [("x", 20.0, 1.0), ("y", 20.0, 2.0), ("z", 20.0, 3.0)]
+    history.close()
+
+
+def test_torn_tail_record(tmp_path):
+    history = ScanHistory(tmp_path)
+    history.append_scan({"a": 1, "b": 2}, 100.0)
+    history.close()
+
+    tail = tmp_path / "tail.bin"
+    with open(tail, "ab") as f:
+        f.write(b"\x01\x00\x00")  # crash part-way through the next record
+    history = ScanHistory(tmp_path)
+    assert _events(history) == [("a", 100.0, 1.0), ("b", 100.0, 2.0)]
+    history.append("a", 0, 200.0)
+    assert _events(history, 2) == [("a", 200.0, 0.0)]
+    history.close()
+
+
+def test_torn_barcode_line(tmp_path):
+    history = ScanHistory(tmp_path)
+    history.append("a", 1, 100.0)
+    history.close()
+    with open(tmp_path / "barcodes.txt", "a", encoding="utf-8") as f:
+        f.write("30176204")  # barcode written without its newline
+
+    history = ScanHistory(tmp_path)
+    assert history.barcodes == ["a"]
+    history.append("b", 1, 200.0)
+    history.close()
+    assert (tmp_path / "barcodes.txt").read_text() == "a\nb\n"
+
+
+def test_stale_tail_after_seal(tmp_path):
+    history = ScanHistory(tmp_path, chunk_size=2)
+    history.append_scan({"a": 1, "b": 2}, 100.0)
+    history.close()
+
+    # Crash between writing the chunk and resetting the tail: the tail still
+    # names chunk 0, which is already sealed
+    tail = tmp_path / "tail.bin"
+    tail.write_bytes(bytes(8) + b"\x00" * 16)
+    history = ScanHistory(tmp_path, chunk_size=2)
+    assert len(history) == 2
+    assert np.array_equal(history.events().quantities, [1.0, 2.0])
+    history.close()
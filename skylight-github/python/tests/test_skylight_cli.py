@@ -0,0 +1,146 @@
+"""Headless CLI commands against the stand-in servers"""
+
+import asyncio
+import json
+import os
+import sys
+import time
+import types
+
+import pytest
+
+import skylight_cli
+from lib.frame_sync import FrameConfig, load_frames, queue_items, upsert_frame
+from lib.scan_history import ScanHistory
+from mock_servers import load_products, start_mock_server
+
+PRODUCTS = [p for p in load_products() if p.get("product_name")]
+
+
+@pytest.fixture
+def cli(tmp_path, capsys):
+    """Run a CLI command against a fresh stand-in; returns (exit code, JSONL records)"""
+    state = {}
+
+    def run(*argv):
+        async def go():
+            runner, base_url = await start_mock_server()
+            state["stats"] = runner.app["stats"]
+            try:
+                args = skylight_cli.parse_args([
+                    "--off-url", base_url,
+                    "--skylight-url", base_url,
+                    "--cache-dir", str(tmp_path / "cache"),
+                    "--history-dir", str(tmp_path / "history"),
+                    "--auth-file", str(tmp_path / "auth.json"),
+                    *argv,
+                ])
+                return await skylight_cli.COMMANDS[args.command](args)
+            finally:
+                await runner.cleanup()
+
+        capsys.readouterr()
+        code = asyncio.run(go())
+        out = capsys.readouterr().out
+        return code, [json.loads(line) for line in out.splitlines()]
+
+    run.tmp_path = tmp_path
+    run.state = state
+    return run
+
+
+def test_lookup_streams_one_record_per_barcode(cli):
+    barcodes = cli.tmp_path / "barcodes.txt"
+    barcodes.write_text(f"{PRODUCTS[0]['code']}\n# comment\n\n0000000000000\n{PRODUCTS[1]['code']}\n")
+
+    code, records = cli("lookup", str(barcodes))
+
+    assert code == 0
+    by_index = {r["index"]: r for r in records}
+    assert [by_index[i]["status"] for i in range(3)] == ["found", "not_found", "found"]
+    assert by_index[0]["product"]["name"] == PRODUCTS[0]["product_name"]
+    assert "product" not in by_index[1]
+
+
+def test_nutrition_counts_repeated_barcodes(cli):
+    barcodes = cli.tmp_path / "pantry.txt"
+    barcodes.write_text(f"{PRODUCTS[0]['code']}\n{PRODUCTS[0]['code']}\n0000000000000\n")
+
+    code, [summary] = cli("nutrition", str(barcodes))
+
+    assert code == 0
+    assert summary["products"] == 1
+    assert summary["missing"] == ["0000000000000"]
+    kcal = PRODUCTS[0]["nutriments"]["energy-kcal_100g"]
+    assert summary["totals_100g"]["energy_kcal_100g"] == pytest.approx(2 * kcal)
+
+
+def test_frames_add_and_remove(cli):
+    auth = cli.tmp_path / "auth.json"
+
+    code, records = cli("frames", "add", "kitchen", "111", "token-a", "--sync-interval", "60")
+    assert code == 0
+    assert records == [{"name": "kitchen", "frame_id": "111", "sync_interval": 60.0}]
+
+    cli("frames", "add", "garage", "222", "token-b")
+    code, records = cli("frames", "remove", "kitchen")
+    assert code == 0
+    assert [r["name"] for r in records] == ["garage"]
+    assert [f.name for f in load_frames(auth)] == ["garage"]
+
+    code, _ = cli("frames", "remove", "kitchen")
+    assert code == 1
+
+
+def test_sync_pushes_queued_items(cli):
+    upsert_frame(cli.tmp_path / "auth.json", FrameConfig("kitchen", "111", "token"))
+    queue_items(cli.tmp_path / "cache", "111", [{"label": "Milk", "section": "dairy"}])
+
+    code, [result] = cli("sync")
+
+    assert code == 0
+    assert result["frame"] == "kitchen" and result["status"] == "ok"
+    assert result["pushed"] == 1 and result["failed"] == 0
+    responses = cli.state["stats"].to_dict()
+    assert responses["/api/frames/{frame_id}/lists/{list_id}/list_items"] == {"201": 1}
+
+
+def test_sync_without_frames_fails(cli):
+    code, records = cli("sync")
+    assert code == 2
+    assert records == []
+
+
+def test_import_photos_records_scans_oldest_first(cli, monkeypatch):
+    photos = cli.tmp_path / "photos"
+    photos.mkdir()
+    now = time.time()
+    codes = [p["code"] for p in PRODUCTS[:3]]
+    for i, code in enumerate(codes):
+        path = photos / f"{i}.jpg"
+        path.write_bytes(b"")
+        os.utime(path, (now - 3600 * (3 - i), now - 3600 * (3 - i)))
+
+    def decode_photo(path):
+        # Older photos finish decoding last
+        time.sleep(0.05 * (3 - int(path.stem)))
+        return path, [codes[int(path.stem)]]
+
+    pyzbar = types.ModuleType("pyzbar")
+    pyzbar.pyzbar = types.ModuleType("pyzbar.pyzbar")
+    monkeypatch.setitem(sys.modules, "pyzbar", pyzbar)
+    monkeypatch.setitem(sys.modules, "pyzbar.pyzbar", pyzbar.pyzbar)
+    monkeypatch.setattr(skylight_cli, "decode_photo", decode_photo)
+
+    code, records = cli("import-photos", str(photos), "--record", "--workers", "3")
+
+    assert code == 0
+    assert sorted(r["barcode"] for r in records) == sorted(codes)
+    assert all(r["status"] == "found" for r in records)
+    history = ScanHistory(cli.tmp_path / "history")
+    try:
+        events = history.events()
+        assert [history.barcodes[i] for i in events.product_ids.tolist()] == codes
+        assert list(events.timestamps) == sorted(events.timestamps)
+    finally:
+        history.close()
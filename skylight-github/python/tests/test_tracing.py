@@ -0,0 +1,127 @@
+"""Tracer spans and Chrome trace export"""
+
+import asyncio
+import json
+import threading
+
+import pytest
+
+from lib.tracing import Tracer
+
+
+def by_name(tracer):
+    return {span.name: span for span in tracer._finished}
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer()
+    with tracer.span("scan") as span:
+        span.set(items=3)
+    assert tracer.current() is None
+    assert list(tracer._finished) == []
+    assert tracer.to_chrome_trace()["traceEvents"] == []
+
+
+def test_nested_spans_link_to_their_parent():
+    tracer = Tracer(enabled=True)
+    with tracer.span("scan", source="camera") as root:
+        with tracer.span("scan.decode") as child:
+            assert tracer.current() is child
+        assert tracer.current() is root
+    assert tracer.current() is None
+
+    spans = by_name(tracer)
+    assert spans["scan.decode"].parent is spans["scan"]
+    assert spans["scan"].parent is None
+    assert spans["scan"].args == {"source": "camera"}
+    assert spans["scan"].start_ns <= spans["scan.decode"].start_ns
+    assert spans["scan.decode"].end_ns <= spans["scan"].end_ns
+
+
+def test_span_records_errors():
+    tracer = Tracer(enabled=True)
+    with pytest.raises(KeyError):
+        with tracer.span("scan.match"):
+            raise KeyError("x")
+    assert by_name(tracer)["scan.match"].args["error"] == "KeyError: 'x'"
+
+
+def test_wrap_carries_the_parent_across_threads():
+    tracer = Tracer(enabled=True)
+
+    def work():
+        with tracer.span("worker"):
+            pass
+
+    with tracer.span("scan"):
+        wrapped = threading.Thread(target=tracer.wrap(work), name="wrapped")
+        plain = threading.Thread(target=work, name="plain")
+        wrapped.start()
+        wrapped.join()
+        plain.start()
+        plain.join()
+
+    workers = [span for span in tracer._finished if span.name == "worker"]
+    parents = {span.thread_name: span.parent for span in workers}
+    assert parents["wrapped"] is by_name(tracer)["scan"]
+    assert parents["plain"] is None
+
+
+def test_chrome_trace_events():
+    tracer = Tracer(enabled=True)
+
+    async def fetch():
+        with tracer.span("off.get_product", barcode="123"):
+            await asyncio.sleep(0)
+
+    def worker():
+        with tracer.span("scan.decode"):
+            pass
+
+    with tracer.span("scan"):
+        thread = threading.Thread(target=tracer.wrap(worker), name="scanner")
+        thread.start()
+        thread.join()
+        asyncio.run(fetch())
+
+    document = json.loads(json.dumps(tracer.to_chrome_trace()))
+    events = document["traceEvents"]
+    spans = by_name(tracer)
+
+    complete = {e["name"]: e for e in events if e["ph"] == "X"}
+    assert set(complete) == {"scan", "scan.decode"}
+    assert complete["scan"]["cat"] == "scan"
+    assert complete["scan"]["dur"] >= complete["scan.decode"]["dur"] >= 0
+    assert complete["scan.decode"]["args"]["parent_id"] == spans["scan"].span_id
+
+    # The span opened in an asyncio task becomes a begin/end pair
+    pair = [e for e in events if e["ph"] in ("b", "e")]
+    assert [e["ph"] for e in pair] == ["b", "e"]
+    assert pair[0]["args"]["barcode"] == "123"
+    assert pair[0]["id"] == pair[1]["id"] == spans["off.get_product"].span_id
+
+    # The decode ran on another thread than its parent, so a flow arrow links them
+    flow = [e for e in events if e.get("cat") == "flow"]
+    assert [(e["ph"], e["tid"]) for e in flow] == [
+        ("s", spans["scan"].thread_id), ("f", spans["scan.decode"].thread_id)
+    ]
+    names = {e["tid"]: e["args"]["name"] for e in events if e["ph"] == "M"}
+    assert names[spans["scan.decode"].thread_id] == "scanner"
+
+
+def test_export_chrome_trace_writes_json(tmp_path):
+    tracer = Tracer(enabled=True)
+    with tracer.span("sync"):
+        pass
+    path = tmp_path / "traces" / "trace.json"
+    tracer.export_chrome_trace(path)
+    assert json.loads(path.read_text())["traceEvents"][0]["name"] == "sync"
+    assert [p.name for p in path.parent.iterdir()] == ["trace.json"]
+
+
+def test_finished_spans_are_bounded():
+    tracer = Tracer(enabled=True, max_spans=3)
+    for i in range(5):
+        with tracer.span(f"s{i}"):
+            pass
+    assert [span.name for span in tracer._finished] == ["s2", "s3", "s4"]